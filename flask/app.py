@@ -1,27 +1,82 @@
-from flask import Flask, request, jsonify, Response, session
+from flask import Flask, request, jsonify, Response, session, send_from_directory, abort
 from flask_cors import CORS
-import os, uuid, openai
+import os, re, time, uuid, threading
+from collections import deque
+from contextlib import nullcontext
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from urllib.parse import quote
 from dotenv import load_dotenv
 
 from utils.logging import LogManager
-from core.faiss_matcher import FaissMatcher, MatchStatus
+from utils.openai_client import openai_client
+from utils.tts_cache import TTSCache
+from utils.response_cache import ResponseCache
+from utils.metrics import metrics
+from utils.embed import embedding_cache, embedding_coalescer
+from utils.vision import image_preparer
+from utils.model_router import model_router
+from core.faiss_matcher import FaissMatcher, MatchStatus, file_lock
 from core.session_manager import SessionManager
 from core.process_manager import ProcessManager
+from core.step_media import StepMedia
+from core.voice_stream import VoiceConnection
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Task-Id", "X-Step-Num"])
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
+# Whisper takes at most 25 MB of audio; anything far beyond that is not a voice message
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_BYTES", str(32 * 1024 * 1024)))
+# Keeps idle voice sockets open through proxies
+app.config["SOCK_SERVER_OPTIONS"] = {"ping_interval": int(os.getenv("VOICE_PING_INTERVAL", "25"))}
+sock = Sock(app) if Sock else None
+if sock is None:
+    print("⚠️ flask-sock not installed, /api/voice is disabled")
 
 log_manager = LogManager()
+SessionManager.logger_factory = log_manager.get_session_logger
+
+TTS_STREAM_WORKERS = int(os.getenv("TTS_STREAM_WORKERS", "3"))
+TTS_MODEL = "tts-1"
+TTS_VOICE = "nova"
+TTS_FORMAT = "mp3"
+
+tts_cache = TTSCache.from_env()
+response_cache = ResponseCache.from_env()
 
+VECTOR_DIR = Path(os.getenv("VECTOR_DIR", "./model/vector"))
 faiss_matcher = FaissMatcher(
-    index_path=Path("./model/vector/task_index.faiss"),
-    meta_path=Path("./model/vector/task_meta.json")
+    index_path=VECTOR_DIR / "task_index.faiss",
+    meta_path=VECTOR_DIR / "task_meta.json"
 )
+# Cached replies may quote steps that changed; start over with every new index generation
+faiss_matcher.reload_listeners.append(lambda generation: response_cache.clear())
+faiss_matcher.watch(float(os.getenv("INDEX_WATCH_INTERVAL", "5")))
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Content-hashed WebP renditions of the instruction images, built by model/build_renditions.py
+RENDITIONS_DIR = Path(APP_FOLDER) / "model" / "renditions"
+MEDIA_MAX_AGE = 365 * 24 * 3600
+step_media = StepMedia(RENDITIONS_DIR)
+
+# Components keeping their own counters are read at scrape time
+metrics.register_collector("embedding_cache", embedding_cache.stats)
+metrics.register_collector("embedding_batcher", embedding_coalescer.stats)
+metrics.register_collector("tts_cache", tts_cache.stats)
+metrics.register_collector("response_cache", response_cache.stats)
+metrics.register_collector("sessions", SessionManager.store.stats)
+metrics.register_collector("index", faiss_matcher.stats)
+metrics.register_collector("topic_shift", faiss_matcher.topic_shift.stats)
+metrics.register_collector("vision", image_preparer.stats)
+metrics.register_collector("memory", SessionManager.memory.stats)
 
 @app.route("/api/session/init", methods=['GET'])
 def init_session():
@@ -37,18 +92,67 @@ def init_session():
     logger.info(f"🆕 Session initialized and logger attached for uuid {user_id}")
     return jsonify({"ok": "hello dear", "session_id": user_id})
 
+@app.route("/api/admin/reload-index", methods=['POST'])
+def reload_index():
+    # Disabled unless a token is configured
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({'error': 'forbidden'}), 403
+
+    reloaded, error = faiss_matcher.reload(force=request.args.get("force") == "1")
+    if error:
+        return jsonify({'error': error, 'index': faiss_matcher.stats()}), 500
+    return jsonify({'reloaded': reloaded, 'index': faiss_matcher.stats()})
+
+@app.route("/api/tasks/<task_id>/steps/<int:step_num>/images", methods=['GET'])
+def step_images(task_id, step_num):
+    step = faiss_matcher.get_step(faiss_matcher.get_task(task_id), step_num)
+    if step is None:
+        return jsonify({'error': 'unknown step'}), 404
+
+    names = step.get("images", [])
+    response = jsonify({
+        "task_id": task_id,
+        "step_num": step_num,
+        "images": step_media.images(task_id, names),
+    })
+    # Revalidated every time: the step's images change with the index and the renditions
+    response.set_etag(step_media.etag(task_id, step_num, names))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route("/api/media/<path:filename>", methods=['GET'])
+def media(filename):
+    # nginx serves these from disk in production; this covers running Flask alone
+    if not filename.endswith(".webp"):
+        abort(404)
+    # The name is the content hash, so it doubles as an ETag that is the same on every host
+    response = send_from_directory(RENDITIONS_DIR, filename, max_age=MEDIA_MAX_AGE, etag=filename.split(".")[0])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route("/api/metrics", methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/api/process', methods=['POST'])
 def process():
+    logger = None
+    outcome = "error"
     try:
         # --- Always needed preparations ---
         session_id, logger = ProcessManager.prepare_session(session)
         if not session_id:
-            return jsonify({'error': logger}), 400
+            error, logger = logger, None
+            outcome = "rejected"
+            return jsonify({'error': error}), 400
 
-        openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Screenshots are downscaled on the shared pool while Whisper runs
+        pending_images = ProcessManager.start_vision(logger)
 
         query, error = ProcessManager.transcribe_audio(openai_client, logger)
         if not query:
+            outcome = "rejected"
             return jsonify({'error': error}), 400
         
         logger.info(f"Received user input: {query}")
@@ -56,113 +160,376 @@ def process():
         # --- Matching and task handling ---
         match_result = faiss_matcher.process(session_id, query, openai_client, logger)
 
+        # Unmatched questions get a canned reply, the screen is not needed
+        vision_parts, screen_hash = [], None
+        if match_result.status != MatchStatus.NO_TASK_MATCH:
+            vision_parts, screen_hash = ProcessManager.prepare_vision_parts(session_id, pending_images, logger)
+
         # --- Generate final response ---
+        if request.args.get("stream") == "1" or request.form.get("stream") == "1":
+            # The generator closes the request once the last chunk is out
+            outcome = None
+            return Response(
+                stream_response(openai_client, query, session_id, logger, match_result, vision_parts, screen_hash),
+                mimetype="audio/mpeg",
+                headers={"X-Accel-Buffering": "no", **step_headers(match_result)}
+            )
+
         mp3_data = generate_response(
             openai_client,
             query,
             session_id,
             logger,
-            match_result
+            match_result,
+            vision_parts,
+            screen_hash
         )
 
-        logger.log_time("🤖 GPT + TTS")
-
         if not mp3_data:
             return jsonify({'error': 'TTS failed'}), 500
 
-        return Response(mp3_data, mimetype="audio/mpeg")
+        outcome = "ok"
+        return Response(mp3_data, mimetype="audio/mpeg", headers=step_headers(match_result))
 
     except Exception as e:
-        logger.error("❌ process failed:", e)
+        if logger:
+            logger.error(f"❌ process failed: {e}")
         return jsonify({'error': str(e)}), 500
 
-def generate_speech(openai_client, text, voice="nova"):
+    finally:
+        if logger and outcome:
+            logger.finish(outcome)
+
+def voice_turn(session_id, wav, pending_images):
+    """
+    One turn of the voice socket: JSON events around the MP3 chunks of stream_response.
+
+    Same pipeline as /api/process, starting from the utterance cut by the server-side VAD.
+    """
+    logger = SessionManager.get_logger(session_id).for_request()
+    outcome = "error"
     try:
-        response = openai_client.audio.speech.create(
-            model="tts-1",
-            voice=voice,
-            input=text
-        )
+        query, error = ProcessManager.transcribe(openai_client, logger, "utterance.wav", wav)
+        if not query:
+            outcome = "rejected"
+            yield {"type": "error", "error": error}
+            return
+
+        logger.info(f"Received user input: {query}")
+        yield {"type": "transcript", "text": query}
+
+        match_result = faiss_matcher.process(session_id, query, openai_client, logger)
+
+        vision_parts, screen_hash = [], None
+        if match_result.status != MatchStatus.NO_TASK_MATCH:
+            vision_parts, screen_hash = ProcessManager.prepare_vision_parts(session_id, pending_images, logger)
+
+        event = {"type": "reply_start"}
+        if match_result.task:
+            event["task_id"] = match_result.task["task_id"]
+            if match_result.step and match_result.step.get("step_num") is not None:
+                event["step_num"] = match_result.step["step_num"]
+        yield event
+
+        # The generator closes the request once the last chunk is out
+        outcome = None
+        yield from stream_response(openai_client, query, session_id, logger, match_result, vision_parts, screen_hash)
+        yield {"type": "reply_end"}
+
+    except GeneratorExit:
+        outcome = outcome and "interrupted"
+        raise
+
+    except Exception as e:
+        logger.error(f"❌ voice turn failed: {e}")
+        yield {"type": "error", "error": str(e)}
+
+    finally:
+        if outcome:
+            logger.finish(outcome)
+
+if sock is not None:
+    @sock.route("/api/voice")
+    def voice(ws):
+        """Full-duplex voice: PCM frames in, transcript and step events plus MP3 chunks out."""
+        SessionManager.clear_expired_sessions()
+        session_id = session.get('user_id')
+        if not session_id or not SessionManager.session_exists(session_id):
+            ws.send('{"type": "error", "error": "Invalid session_id"}')
+            return
+        VoiceConnection(ws, session_id, voice_turn, SessionManager.get_logger(session_id)).serve()
+
+def step_headers(match_result):
+    """Matched task and step, so the client can fetch the step's images."""
+    headers = {}
+    if match_result.task:
+        # Percent-encoded, ready to be put in the images URL
+        headers["X-Task-Id"] = quote(match_result.task["task_id"], safe="")
+        if match_result.step and match_result.step.get("step_num") is not None:
+            headers["X-Step-Num"] = str(match_result.step["step_num"])
+    return headers
+
+def generate_speech(openai_client, text, voice=TTS_VOICE, pin=False, logger=None):
+    cached = tts_cache.get(TTS_MODEL, voice, TTS_FORMAT, text)
+    if cached:
+        return cached
+
+    try:
+        with logger.span("tts", "🔊 TTS") if logger else nullcontext():
+            response = openai_client.call("speech", lambda c: c.audio.speech.create(
+                model=TTS_MODEL,
+                voice=voice,
+                input=text,
+                response_format=TTS_FORMAT
+            ))
+        tts_cache.put(TTS_MODEL, voice, TTS_FORMAT, text, response.content, pin=pin)
         return response.content
 
     except Exception as e:
         print("❌ TTS failed:", e)
         return None
-    
 
-def generate_response(openai_client, query, session_id, logger, match_result):
-    try:
-        history = SessionManager.get_history(session_id)
+def preload_canned_speech():
+    """Synthesize fixed replies once so their paths never wait on TTS."""
+    # With a shared disk cache, one worker synthesizes and the others find the files
+    lock = file_lock(tts_cache.cache_dir / ".preload.lock") if tts_cache.cache_dir else nullcontext()
+    with lock:
+        for text in (NO_TASK_REPLY, FALLBACK_REPLY):
+            if generate_speech(openai_client, text, pin=True):
+                log_manager.logger.info(f"🔊 Canned reply ready: {text}")
+
+def start_canned_speech_preload():
+    """Called by whatever serves the app (gunicorn hook, dev server), not on import."""
+    threading.Thread(target=preload_canned_speech, name="tts-preload", daemon=True).start()
+
+NO_TASK_REPLY = "Я не понял, что нужно сделать. Попробуйте переформулировать запрос."
+FALLBACK_REPLY = "Извините, не смог точно определить действие."
+
+# Sentence boundary for streaming TTS; shorter pieces are glued to the next one
+SENTENCE_END = re.compile(r"[.!?…]+[\"»)]*\s+")
+MIN_SENTENCE_CHARS = 20
+
+def build_messages(query, session_id, match_result, vision_parts=None):
+    """Chat messages for the match result, or None when no task matched."""
+    # Rolling summary plus the newest turns within the token budget, rendered once per turn
+    memory = SessionManager.get_memory_prompt(session_id)
+
+    system_prompt = (
+        "Ты помогаешь выполнять действия на экране. "
+        "Отвечай очень коротко и просто — 1–2 предложения. "
+        "Никаких лишних объяснений, никаких сложных фраз."
+    )
+
+    messages = [{"role": "system", "content": system_prompt}]
+
+    if memory:
+        messages.append({"role": "system", "content": memory})
+
+    # --- Three paths based on match result ---
+    if match_result.status == MatchStatus.MATCHED and match_result.step:
+        # ✅ Matched step: use step full text
+        user_content = (
+            f"Текущий шаг:\n{match_result.step.get('text', '')}\n\n"
+            f"Вопрос пользователя:\n{query}"
+        )
+        messages.append(user_message(user_content, vision_parts))
 
-        system_prompt = (
-            "Ты помогаешь выполнять действия на экране. "
-            "Отвечай очень коротко и просто — 1–2 предложения. "
-            "Никаких лишних объяснений, никаких сложных фраз."
+    elif match_result.status == MatchStatus.NO_STEP_MATCH and match_result.task:
+        # ✅ Matched task but no step: list steps
+        steps = match_result.task.get('steps', [])
+        steps_list = "\n".join(
+            f"- {step.get('text', '').strip()}" for step in steps
+        )
+        user_content = (
+            f"Есть такие шаги:\n{steps_list}\n\n"
+            f"Пользователь спросил:\n{query}\n\n"
+            "Помоги выбрать шаг. Ответь коротко, без лишних слов."
         )
+        messages.append(user_message(user_content, vision_parts))
 
-        messages = [{"role": "system", "content": system_prompt}]
+    elif match_result.status == MatchStatus.NO_TASK_MATCH:
+        # ❌ No task matched
+        return None
 
-        if history:
-            history_text = "\n".join(
-                f"Пользователь: {h['text']}\nАссистент: {h['reply']}" for h in history
-            )
-            messages.append({"role": "system", "content": f"История общения:\n{history_text}"})
-
-        # --- Three paths based on match result ---
-        if match_result.status == MatchStatus.MATCHED and match_result.step:
-            # ✅ Matched step: use step full text
-            user_content = (
-                f"Текущий шаг:\n{match_result.step.get('text', '')}\n\n"
-                f"Вопрос пользователя:\n{query}"
-            )
-            messages.append({"role": "user", "content": user_content})
+    return messages
 
-        elif match_result.status == MatchStatus.NO_STEP_MATCH and match_result.task:
-            # ✅ Matched task but no step: list steps
-            steps = match_result.task.get('steps', [])
-            steps_list = "\n".join(
-                f"- {step.get('text', '').strip()}" for step in steps
-            )
-            user_content = (
-                f"Есть такие шаги:\n{steps_list}\n\n"
-                f"Пользователь спросил:\n{query}\n\n"
-                "Помоги выбрать шаг. Ответь коротко, без лишних слов."
-            )
-            messages.append({"role": "user", "content": user_content})
+def chat_route(match_result):
+    """Model route of the reply: answering about a matched step, or choosing among the task's steps."""
+    return "step_answer" if match_result.status == MatchStatus.MATCHED else "step_choice"
+
+def user_message(text, vision_parts):
+    if not vision_parts:
+        return {"role": "user", "content": text}
+    return {"role": "user", "content": [{"type": "text", "text": text}, *vision_parts]}
 
-        elif match_result.status == MatchStatus.NO_TASK_MATCH:
-            # ❌ No task matched
-            reply = "Я не понял, что нужно сделать. Попробуйте переформулировать запрос."
-            SessionManager.save_history(session_id, query, reply)
-            return generate_speech(openai_client, reply)
+def shows_screen(vision_parts):
+    return any(part["type"] == "image_url" for part in vision_parts or ())
+
+def cached_response(match_result, logger, vision_parts=None):
+    """Earlier reply to a near-identical question on the same step, if any."""
+    # A reply about a new screen can't be reused for another one
+    if match_result.status != MatchStatus.MATCHED or not match_result.step or shows_screen(vision_parts):
+        return None
+    cached = response_cache.get(
+        match_result.task["task_id"], match_result.step.get("step_num"), match_result.query_embedding
+    )
+    if cached:
+        logger.info("♻️ Response cache hit")
+    return cached
+
+def save_reply(session_id, query, reply, screen_hash=None):
+    """History of a finished turn; the screen it answered about becomes the one to compare against."""
+    SessionManager.save_history(session_id, query, reply)
+    if screen_hash is not None:
+        SessionManager.set_screen_hash(session_id, screen_hash)
+
+def cache_response(match_result, reply, audio, vision_parts=None):
+    if (match_result.status != MatchStatus.MATCHED or not match_result.step or reply == FALLBACK_REPLY
+            or shows_screen(vision_parts)):
+        return
+    response_cache.put(
+        match_result.task["task_id"], match_result.step.get("step_num"), match_result.query_embedding, reply, audio
+    )
+
+def generate_response(openai_client, query, session_id, logger, match_result, vision_parts=None, screen_hash=None):
+    try:
+        messages = build_messages(query, session_id, match_result, vision_parts)
+
+        if messages is None:
+            SessionManager.save_history(session_id, query, NO_TASK_REPLY)
+            return generate_speech(openai_client, NO_TASK_REPLY, logger=logger)
+
+        cached = cached_response(match_result, logger, vision_parts)
+        if cached:
+            SessionManager.save_history(session_id, query, cached.reply)
+            return cached.audio or generate_speech(openai_client, cached.reply, logger=logger)
 
         # --- Call GPT ---
-        logger.info("RESPONSE PROMPT")
-        logger.info(messages)
+        logger.payload("RESPONSE PROMPT", messages)
 
-        chat = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages
-        )
-        logger.log_time("🧠 GPT")
+        with logger.span("chat", "🧠 GPT"):
+            chat = model_router.complete(chat_route(match_result), messages, logger)
 
         full_reply = chat.choices[0].message.content.strip()
 
         if not full_reply or len(full_reply) < 10:
-            full_reply = "Извините, не смог точно определить действие."
+            full_reply = FALLBACK_REPLY
 
-        SessionManager.save_history(session_id, query, full_reply)
+        save_reply(session_id, query, full_reply, screen_hash)
 
         with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(generate_speech, openai_client, full_reply)
+            future = executor.submit(generate_speech, openai_client, full_reply, logger=logger)
             mp3_data = future.result()
-            logger.log_time("🔊 TTS")
 
+        cache_response(match_result, full_reply, mp3_data, vision_parts)
         return mp3_data
 
     except Exception as e:
-        logger.error("❌ GPT or TTS error:", e)
+        logger.error(f"❌ GPT or TTS error: {e}")
         return None
 
+def split_sentences(buffer):
+    """Split off complete sentences from the streamed text, returning (sentences, rest)."""
+    sentences = []
+    start = 0
+    for boundary in SENTENCE_END.finditer(buffer):
+        sentence = buffer[start:boundary.end()].strip()
+        if len(sentence) >= MIN_SENTENCE_CHARS:
+            sentences.append(sentence)
+            start = boundary.end()
+    return sentences, buffer[start:]
+
+def stream_response(openai_client, query, session_id, logger, match_result, vision_parts=None, screen_hash=None):
+    """
+    Yield MP3 chunks sentence by sentence while GPT is still generating.
+
+    Each complete sentence goes to TTS as soon as it is cut from the token stream,
+    and chunks are yielded in order as soon as the head of the queue is synthesized.
+    """
+    outcome = "error"
+    try:
+        messages = build_messages(query, session_id, match_result, vision_parts)
+
+        if messages is None:
+            SessionManager.save_history(session_id, query, NO_TASK_REPLY)
+            mp3_data = generate_speech(openai_client, NO_TASK_REPLY, logger=logger)
+            if mp3_data:
+                yield mp3_data
+            outcome = "ok"
+            return
+
+        cached = cached_response(match_result, logger, vision_parts)
+        if cached:
+            SessionManager.save_history(session_id, query, cached.reply)
+            mp3_data = cached.audio or generate_speech(openai_client, cached.reply, logger=logger)
+            if mp3_data:
+                yield mp3_data
+            outcome = "ok"
+            return
+
+        logger.payload("RESPONSE PROMPT", messages)
+
+        chat_started = time.perf_counter()
+        chat = model_router.complete(chat_route(match_result), messages, logger, stream=True)
+
+        with ThreadPoolExecutor(max_workers=TTS_STREAM_WORKERS) as executor:
+            pending = deque()
+            voiced = []
+            reply_parts = []
+            buffer = ""
+            first_sentence_logged = False
+
+            for chunk in chat:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                reply_parts.append(delta)
+                sentences, buffer = split_sentences(buffer + delta)
+                for sentence in sentences:
+                    if not first_sentence_logged:
+                        logger.record("chat_first_sentence", time.perf_counter() - chat_started, "🧠 GPT first sentence")
+                        first_sentence_logged = True
+                    pending.append(executor.submit(generate_speech, openai_client, sentence, logger=logger))
+
+                while pending and pending[0].done():
+                    mp3_data = pending.popleft().result()
+                    if mp3_data:
+                        voiced.append(mp3_data)
+                        yield mp3_data
+
+            logger.record("chat", time.perf_counter() - chat_started, "🧠 GPT stream")
+
+            full_reply = "".join(reply_parts).strip()
+            if not full_reply or len(full_reply) < 10:
+                # Nothing long enough to have been voiced yet
+                full_reply = FALLBACK_REPLY
+                buffer = full_reply
+
+            if buffer.strip():
+                pending.append(executor.submit(generate_speech, openai_client, buffer.strip(), logger=logger))
+
+            save_reply(session_id, query, full_reply, screen_hash)
+
+            while pending:
+                mp3_data = pending.popleft().result()
+                if mp3_data:
+                    voiced.append(mp3_data)
+                    yield mp3_data
+
+        cache_response(match_result, full_reply, b"".join(voiced) or None, vision_parts)
+        outcome = "ok"
+
+    except GeneratorExit:
+        # Client went away or talked over the reply
+        outcome = "interrupted"
+        raise
+
+    except Exception as e:
+        logger.error(f"❌ GPT or TTS stream error: {e}")
+
+    finally:
+        logger.finish(outcome)
+
 if __name__ == '__main__':
+    start_canned_speech_preload()
     app.run(host='0.0.0.0', port=9091, debug=True)
@@ -0,0 +1,255 @@
+"""
+Local stand-in for the OpenAI endpoints the backend uses, with configurable latency per stage.
+
+    python -m bench.fake_openai --port 8099 --latency chat=0.8:0.4 --scale 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8099/v1 OPENAI_API_KEY=fake python app.py
+
+- transcriptions: the uploaded "audio" is UTF-8 text and comes back as the transcript
+- embeddings: queries contained in an indexed step text get that step's vector plus a little
+  noise, so replayed sessions really match tasks; anything else gets a stable random vector
+- chat: a short reply, numbered so replies differ like real ones, plain or streamed as SSE
+- speech: silent bytes proportional to the text length
+
+Latency of each stage is lognormal: median seconds and sigma, multiplied by --scale.
+GET /stats returns the latencies served per stage.
+"""
+import sys
+import json
+import time
+import base64
+import hashlib
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+VECTOR_DIR = Path(__file__).resolve().parent.parent / "model" / "vector"
+DIM = 1536
+
+# stage -> (median seconds, sigma)
+DEFAULT_LATENCY = {
+    "transcription": (0.6, 0.3),
+    "embedding": (0.12, 0.3),
+    "chat": (0.8, 0.4),
+    "speech": (0.5, 0.3),
+}
+# Streamed chat: the median above is the time to first token, then this per chunk
+STREAM_CHUNK_DELAY = 0.02
+
+REPLY = "Откройте раздел с платежами и выберите нужный реестр. Затем нажмите кнопку привязки и проверьте сумму."
+SPEECH_BYTES_PER_CHAR = 160
+
+
+def parse_latency(specs):
+    latency = dict(DEFAULT_LATENCY)
+    for spec in specs or []:
+        stage, _, value = spec.partition("=")
+        median, _, sigma = value.partition(":")
+        if stage not in latency:
+            raise ValueError(f"❌ Unknown stage: {stage}")
+        latency[stage] = (float(median), float(sigma) if sigma else latency[stage][1])
+    return latency
+
+
+class StepVectors:
+    """Texts of the indexed steps with their vectors, to give replayed queries realistic embeddings."""
+
+    def __init__(self, vector_dir: Path, noise: float = 0.05):
+        self.noise = noise
+        self.texts, self.vectors = [], []
+        if not vector_dir or not Path(vector_dir).exists():
+            return
+
+        import faiss
+        for meta_path in sorted(Path(vector_dir).glob("steps_*_meta.json")):
+            index_path = meta_path.with_name(meta_path.name.replace("_meta.json", ".faiss"))
+            if not index_path.exists():
+                continue
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            index = faiss.read_index(str(index_path))
+            if index.ntotal != len(meta) or index.d != DIM:
+                continue
+            self.texts.extend(step["text"] for step in meta)
+            self.vectors.extend(index.reconstruct_n(0, index.ntotal))
+
+    def embed(self, text: str):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        rng = np.random.default_rng(seed)
+        noise = rng.standard_normal(DIM).astype("float32")
+
+        match = next((i for i, step_text in enumerate(self.texts) if text.strip() and text.strip() in step_text), None)
+        if match is None:
+            vector = noise
+        else:
+            vector = self.vectors[match] + self.noise * noise / np.linalg.norm(noise)
+        return (vector / np.linalg.norm(vector)).astype("float32")
+
+
+class FakeOpenAI:
+    def __init__(self, latency: dict, scale: float = 1.0, vector_dir: Path = VECTOR_DIR, seed: int = 0):
+        self.latency = latency
+        self.scale = scale
+        self.steps = StepVectors(vector_dir)
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.served = {stage: [] for stage in latency}
+        self.replies = 0
+
+    def delay(self, stage: str) -> float:
+        median, sigma = self.latency[stage]
+        with self.lock:
+            z = self.rng.standard_normal()
+        return self.scale * median * float(np.exp(sigma * z))
+
+    def reply(self) -> str:
+        with self.lock:
+            self.replies += 1
+            return f"{REPLY} Ответ {self.replies}."
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            self.served[stage].append(seconds)
+
+    def stats(self):
+        with self.lock:
+            return {stage: list(values) for stage, values in self.served.items()}
+
+    def reset(self):
+        with self.lock:
+            for values in self.served.values():
+                values.clear()
+
+    def make_server(self, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def body(self) -> bytes:
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def send(self, status: int, payload: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def send_json(self, data, status: int = 200):
+                self.send(status, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    return self.send_json(fake.stats())
+                self.send_json({"error": {"message": "not found"}}, 404)
+
+            def do_DELETE(self):
+                if self.path == "/stats":
+                    fake.reset()
+                    return self.send_json({"ok": True})
+                self.send_json({"error": {"message": "not found"}}, 404)
+
+            def do_POST(self):
+                started = time.perf_counter()
+                routes = {
+                    "/v1/audio/transcriptions": ("transcription", self.transcription),
+                    "/v1/embeddings": ("embedding", self.embeddings),
+                    "/v1/chat/completions": ("chat", self.chat),
+                    "/v1/audio/speech": ("speech", self.speech),
+                }
+                if self.path not in routes:
+                    return self.send_json({"error": {"message": "not found"}}, 404)
+
+                stage, handler = routes[self.path]
+                handler(self.body(), fake.delay(stage))
+                fake.record(stage, time.perf_counter() - started)
+
+            def transcription(self, body: bytes, delay: float):
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+                )
+                audio = next((part.get_payload(decode=True) for part in message.iter_parts()
+                              if part.get_param("name", header="content-disposition") == "file"), b"")
+                text = audio.decode("utf-8", errors="ignore").strip()
+                time.sleep(delay)
+                self.send_json({"task": "transcribe", "language": "russian", "duration": 1.0, "text": text, "segments": []})
+
+            def embeddings(self, body: bytes, delay: float):
+                request = json.loads(body)
+                texts = request["input"] if isinstance(request["input"], list) else [request["input"]]
+                data = []
+                for i, text in enumerate(texts):
+                    vector = fake.steps.embed(text)
+                    if request.get("encoding_format") == "base64":
+                        embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+                    else:
+                        embedding = vector.tolist()
+                    data.append({"object": "embedding", "index": i, "embedding": embedding})
+                time.sleep(delay)
+                self.send_json({"object": "list", "data": data, "model": request.get("model"),
+                                "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+            def chat(self, body: bytes, delay: float):
+                request = json.loads(body)
+                head = {"id": "chatcmpl-fake", "created": int(time.time()), "model": request.get("model")}
+                reply = fake.reply()
+                time.sleep(delay)
+
+                if not request.get("stream"):
+                    return self.send_json({**head, "object": "chat.completion", "choices": [{
+                        "index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": reply},
+                    }], "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = reply.split(" ")
+                for i, word in enumerate(words):
+                    delta = {"content": word if i == 0 else " " + word}
+                    self.chunk({**head, "object": "chat.completion.chunk",
+                                "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                    time.sleep(fake.scale * STREAM_CHUNK_DELAY)
+                self.chunk({**head, "object": "chat.completion.chunk",
+                            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+                self.chunk("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def chunk(self, data):
+                payload = f"data: {data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+                self.wfile.flush()
+
+            def speech(self, body: bytes, delay: float):
+                request = json.loads(body)
+                time.sleep(delay)
+                self.send(200, bytes(SPEECH_BYTES_PER_CHAR * len(request.get("input", ""))), "audio/mpeg")
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", nargs="*", help="stage=median[:sigma], e.g. chat=0.8:0.4")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for every latency")
+    parser.add_argument("--vector-dir", type=Path, default=VECTOR_DIR)
+    args = parser.parse_args()
+
+    server = FakeOpenAI(parse_latency(args.latency), args.scale, args.vector_dir).make_server(args.host, args.port)
+    print(f"✅ Fake OpenAI listening on http://{args.host}:{server.server_address[1]}/v1")
+    server.serve_forever()
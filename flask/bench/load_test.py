@@ -0,0 +1,259 @@
+"""
+Replay load test of /api/process against the local OpenAI stand-in (bench/fake_openai.py).
+
+By default both the fake server and the backend run in this process, so nothing leaves the
+machine and memory growth of the backend can be measured. Each virtual user replays one
+session (init, then its turns in order); `--concurrency` users run at once.
+
+Sessions are JSON lines {"session": ..., "text": ...}, replayed in file order per session;
+--generate N builds N sessions from the indexed step texts instead (--record saves them).
+
+    python -m bench.load_test --generate 40 --concurrency 8 --scale 0.1
+    python -m bench.load_test --sessions sessions.jsonl --stream --max-p95 2.5
+    python -m bench.load_test --url http://localhost:9091 --fake-url http://localhost:8099 --sessions sessions.jsonl
+
+Reports p50/p95/p99 per upstream stage and end to end, requests per second and RSS growth.
+Exits with status 1 when a --max-* limit is exceeded, so it can gate CI.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fake_openai import FakeOpenAI, StepVectors, parse_latency, VECTOR_DIR
+
+OFF_TOPIC = [
+    "Какая сегодня погода?",
+    "Расскажи анекдот",
+    "Как перезагрузить компьютер?",
+]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+# --- Sessions ---
+def load_sessions(path):
+    sessions = {}
+    with open(path, encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if line.strip():
+                row = json.loads(line)
+                sessions.setdefault(row.get("session", f"session-{i}"), []).append(row["text"])
+    return list(sessions.values())
+
+
+def generate_sessions(n, vector_dir, seed):
+    """Turns quote the start of consecutive steps, with an occasional off-topic question."""
+    rng = random.Random(seed)
+    texts = StepVectors(vector_dir).texts or OFF_TOPIC
+    sessions = []
+    for _ in range(n):
+        start = rng.randrange(len(texts))
+        turns = [texts[(start + i) % len(texts)][:80] for i in range(rng.randint(2, 4))]
+        if rng.random() < 0.3:
+            turns.insert(rng.randrange(len(turns) + 1), rng.choice(OFF_TOPIC))
+        sessions.append(turns)
+    return sessions
+
+
+# --- Backend ---
+# Env that turns off every cache in front of an upstream call, to load the full pipeline
+NO_CACHE_ENV = {
+    "EMBED_CACHE_SIZE": "0",
+    "EMBED_CACHE_DIR": "",
+    "TTS_CACHE_MAX_BYTES": "0",
+    "TTS_CACHE_DIR": "",
+    "RESPONSE_CACHE_MAX": "0",
+}
+
+
+def start_in_process(fake_url, no_cache=False, verbose=False):
+    """Import the app against the fake server and serve it on an ephemeral port."""
+    os.environ["OPENAI_BASE_URL"] = fake_url + "/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "fake")
+    os.environ.setdefault("FLASK_SECRET_KEY", "load-test")
+    os.environ.setdefault("INDEX_WATCH_INTERVAL", "0")
+    # Replayed "audio" is the transcript itself, there is nothing for ffmpeg to decode
+    os.environ.setdefault("AUDIO_NORMALIZE", "0")
+    if no_cache:
+        os.environ.update(NO_CACHE_ENV)
+
+    from werkzeug.serving import make_server
+    import app as backend
+
+    if not verbose:
+        # Per-request logs of the app, werkzeug and httpx would bury the report
+        for name in (None, "Needlee", "werkzeug"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+    backend.start_canned_speech_preload()
+    server = make_server("127.0.0.1", 0, backend.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="backend", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def replay(url, turns, stream, timeout):
+    """[(latency, time to first byte, ok)] for every turn of one session."""
+    results = []
+    with httpx.Client(base_url=url, timeout=timeout) as client:
+        client.get("/api/session/init").raise_for_status()
+        for text in turns:
+            started = time.perf_counter()
+            first_byte = None
+            ok = False
+            try:
+                with client.stream(
+                    "POST", "/api/process", params={"stream": "1"} if stream else None,
+                    files={"audio": ("turn.webm", text.encode("utf-8"), "audio/webm")},
+                ) as response:
+                    size = 0
+                    for chunk in response.iter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - started
+                        size += len(chunk)
+                    ok = response.status_code == 200 and size > 0
+            except httpx.HTTPError:
+                pass
+            results.append((time.perf_counter() - started, first_byte, ok))
+    return results
+
+
+def run(args):
+    fake_server = None
+    fake_url = args.fake_url
+    if not fake_url:
+        fake = FakeOpenAI(parse_latency(args.latency), args.scale, args.vector_dir, args.seed)
+        fake_server = fake.make_server()
+        threading.Thread(target=fake_server.serve_forever, name="fake-openai", daemon=True).start()
+        fake_url = f"http://127.0.0.1:{fake_server.server_address[1]}"
+
+    url = args.url or start_in_process(fake_url, args.no_cache, args.verbose)
+    in_process = not args.url
+
+    sessions = load_sessions(args.sessions) if args.sessions else generate_sessions(args.generate, args.vector_dir, args.seed)
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for i, turns in enumerate(sessions):
+                for text in turns:
+                    f.write(json.dumps({"session": f"session-{i}", "text": text}, ensure_ascii=False) + "\n")
+
+    for turns in sessions[:args.warmup]:
+        replay(url, turns, args.stream, args.timeout)
+    httpx.delete(fake_url + "/stats")
+
+    rss_start = rss_mb() if in_process else None
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = [r for session in executor.map(lambda turns: replay(url, turns, args.stream, args.timeout), sessions)
+                   for r in session]
+    duration = time.perf_counter() - started
+    rss_end = rss_mb() if in_process else None
+
+    upstream = httpx.get(fake_url + "/stats").json()
+    if fake_server:
+        fake_server.shutdown()
+
+    latencies = [latency for latency, _, ok in results if ok]
+    report = {
+        "requests": len(results),
+        "errors": sum(not ok for *_, ok in results),
+        "duration_s": duration,
+        "rps": len(results) / duration if duration else 0.0,
+        "concurrency": args.concurrency,
+        "end_to_end": percentiles(latencies),
+        "first_byte": percentiles([ttfb for _, ttfb, ok in results if ok and ttfb is not None]),
+        "stages": {stage: percentiles(values) for stage, values in upstream.items()},
+        "rss_mb": {"start": rss_start, "end": rss_end,
+                   "growth": rss_end - rss_start if in_process else None},
+    }
+    report["error_rate"] = report["errors"] / report["requests"] if report["requests"] else 0.0
+    return report
+
+
+def print_report(report):
+    ms = lambda value: "-" if value is None else f"{value * 1000:.0f}"
+    print(f"\n📊 {report['requests']} requests in {report['duration_s']:.2f} sec, {report['rps']:.2f} req/s "
+          f"at concurrency {report['concurrency']}, {report['errors']} errors")
+    print(f"{'stage':>14} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = [("end_to_end", report["end_to_end"]), ("first_byte", report["first_byte"])]
+    rows += sorted(report["stages"].items())
+    for name, stats in rows:
+        print(f"{name:>14} {stats['count']:>6} {ms(stats['p50']):>8} {ms(stats['p95']):>8} {ms(stats['p99']):>8}")
+    rss = report["rss_mb"]
+    if rss["start"] is not None:
+        print(f"🧠 RSS {rss['start']:.1f} → {rss['end']:.1f} MB ({rss['growth']:+.1f} MB)")
+
+
+def check_limits(report, args):
+    failures = []
+    p95 = report["end_to_end"]["p95"]
+    if args.max_p95 is not None and (p95 is None or p95 > args.max_p95):
+        failures.append(f"end-to-end p95 {p95} s > {args.max_p95} s")
+    if args.max_error_rate is not None and report["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {report['error_rate']:.3f} > {args.max_error_rate}")
+    growth = report["rss_mb"]["growth"]
+    if args.max_rss_growth is not None and growth is not None and growth > args.max_rss_growth:
+        failures.append(f"RSS growth {growth:.1f} MB > {args.max_rss_growth} MB")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sessions", type=Path, help="recorded sessions, JSON lines")
+    source.add_argument("--generate", type=int, help="number of sessions to generate")
+    parser.add_argument("--record", type=Path, help="save the replayed sessions here")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--stream", action="store_true", help="use the streaming response mode")
+    parser.add_argument("--warmup", type=int, default=1, help="sessions replayed before measuring")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--url", help="running backend; default starts one in-process")
+    parser.add_argument("--no-cache", action="store_true", help="in-process backend without embedding, TTS and response caches")
+    parser.add_argument("--verbose", action="store_true", help="keep the in-process backend's logs")
+    parser.add_argument("--fake-url", help="running bench.fake_openai server; default starts one in-process")
+    parser.add_argument("--latency", nargs="*", help="fake stage latency, stage=median[:sigma]")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for every fake latency")
+    parser.add_argument("--vector-dir", type=Path, default=VECTOR_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="write the report here")
+    parser.add_argument("--max-p95", type=float, help="fail if end-to-end p95 exceeds this many seconds")
+    parser.add_argument("--max-error-rate", type=float, help="fail if more than this fraction of requests fail")
+    parser.add_argument("--max-rss-growth", type=float, help="fail if RSS grows by more than this many MB")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+    failures = check_limits(report, args)
+    for failure in failures:
+        print(f"❌ {failure}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,138 @@
+"""
+Threshold sweep for FaissMatcher over a labelled set of utterances.
+
+Every query is matched once with FaissMatcher.match_many; each (task, step) threshold pair is
+then scored on the stored distances, so the sweep itself costs no searches.
+
+The labelled set is JSON lines: {"text": ..., "task_id": ... or null, "step_num": ... or null},
+optionally with a precomputed "embedding". Texts without one are embedded through utils.embed
+(cached). --synthetic N builds a set from the index itself instead: stored step vectors plus noise.
+
+    python -m bench.match_sweep --data eval.jsonl
+    python -m bench.match_sweep --synthetic 5000 --noise 0.4
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.faiss_matcher import FaissMatcher
+
+VECTOR_DIR = Path(__file__).resolve().parent.parent / "model" / "vector"
+EMBED_CHUNK = 256
+
+
+def load_labelled(path):
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+
+    missing = [row["text"] for row in rows if row.get("embedding") is None]
+    if missing:
+        from utils.embed import embed_batch
+        from utils.logging import SessionLogger
+        from utils.openai_client import openai_client
+
+        logger = SessionLogger("match-sweep", logging.getLogger(__name__))
+        embedded = {}
+        for i in range(0, len(missing), EMBED_CHUNK):
+            chunk = missing[i:i + EMBED_CHUNK]
+            embedded.update(zip(chunk, embed_batch(chunk, openai_client, logger, silent=True)))
+        for row in rows:
+            if row.get("embedding") is None:
+                row["embedding"] = embedded[row["text"]]
+
+    queries = np.array([row["embedding"] for row in rows], dtype="float32")
+    return queries, [row.get("task_id") for row in rows], [row.get("step_num") for row in rows]
+
+
+def make_synthetic(matcher, n, noise, rng):
+    """Noisy copies of random step vectors, labelled with their task and step."""
+    vectors = matcher.vectors
+    rows = rng.integers(0, vectors.nsteps, n)
+    steps = np.stack([vectors.step_index.reconstruct(int(row)) for row in rows])
+    directions = rng.standard_normal(steps.shape)
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    queries = steps + noise * directions
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    task_ids, step_nums = [], []
+    for row in rows:
+        task_id, position = vectors.locate(int(row))
+        task_ids.append(task_id)
+        step_nums.append(matcher.step_meta[task_id][position].get("step_num"))
+    return queries.astype("float32"), task_ids, step_nums
+
+
+def score(batch, task_labels, step_labels, task_threshold, step_threshold):
+    tasks, steps = batch.predict(task_threshold, step_threshold)
+    task_labels = np.array(task_labels, dtype=object)
+    step_labels = np.array(step_labels, dtype=object)
+
+    task_ok = tasks == task_labels
+    has_step = step_labels != None  # noqa: E711 - elementwise on an object array
+    both_ok = task_ok & (steps == step_labels)
+    step_acc = float(both_ok[has_step].mean()) if has_step.any() else float("nan")
+    return float(task_ok.mean()), step_acc, float(both_ok.mean())
+
+
+def throughput(matcher, queries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        matcher.match_many(queries)
+    batched = len(queries) * repeat / (time.perf_counter() - start)
+
+    # The per-query path process() takes, without session state and logging
+    sample = queries[:min(len(queries), 500)]
+    start = time.perf_counter()
+    for query in sample:
+        task, _ = matcher.search_task(query)
+        if task:
+            matcher.search_step(task, query)
+    single = len(sample) / (time.perf_counter() - start)
+    return batched, single
+
+
+def run(args):
+    matcher = FaissMatcher(args.vector_dir / "task_index.faiss", args.vector_dir / "task_meta.json")
+
+    if args.synthetic:
+        queries, task_labels, step_labels = make_synthetic(matcher, args.synthetic, args.noise, np.random.default_rng(args.seed))
+    else:
+        queries, task_labels, step_labels = load_labelled(args.data)
+
+    batch = matcher.match_many(queries)
+    batched_qps, single_qps = throughput(matcher, queries, args.repeat)
+    print(f"🧮 {len(queries)} queries, {matcher.vectors.ntasks} tasks, {matcher.vectors.nsteps} steps")
+    print(f"⏱️ match_many {batched_qps:,.0f} q/s, per-query search {single_qps:,.0f} q/s\n")
+
+    print(f"{'task thr':>8} {'step thr':>8} {'task acc':>9} {'step acc':>9} {'both acc':>9}")
+    best = None
+    for task_threshold in args.task_thresholds:
+        for step_threshold in args.step_thresholds:
+            task_acc, step_acc, both_acc = score(batch, task_labels, step_labels, task_threshold, step_threshold)
+            print(f"{task_threshold:>8.3f} {step_threshold:>8.3f} {task_acc:>9.3f} {step_acc:>9.3f} {both_acc:>9.3f}")
+            if best is None or both_acc > best[2]:
+                best = (task_threshold, step_threshold, both_acc)
+
+    print(f"\n✅ Best: TASK_MATCH_THRESHOLD={best[0]:.3f} STEP_MATCH_THRESHOLD={best[1]:.3f} (accuracy {best[2]:.3f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--data", type=Path, help="labelled JSON lines")
+    source.add_argument("--synthetic", type=int, help="number of synthetic queries")
+    parser.add_argument("--noise", type=float, default=0.4, help="synthetic query noise (L2 norm)")
+    parser.add_argument("--vector-dir", type=Path, default=VECTOR_DIR)
+    parser.add_argument("--task-thresholds", type=float, nargs="+", default=np.round(np.arange(0.20, 0.61, 0.05), 2).tolist())
+    parser.add_argument("--step-thresholds", type=float, nargs="+", default=np.round(np.arange(0.20, 0.61, 0.05), 2).tolist())
+    parser.add_argument("--repeat", type=int, default=5, help="match_many passes for the throughput figure")
+    parser.add_argument("--seed", type=int, default=0)
+
+    run(parser.parse_args())
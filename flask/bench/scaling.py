@@ -0,0 +1,242 @@
+"""
+Throughput and memory of the production server (gunicorn.conf.py) by worker count.
+
+For each --workers value a gunicorn is started against the local OpenAI stand-in and the same
+generated sessions are replayed with bench.load_test. Reported per run: requests per second,
+end-to-end p50/p95, errors, and memory read from /proc after the run: anonymous (heap) memory
+of the average worker, and PSS (shared pages split between the processes mapping them) summed
+over master and workers. With the memory-mapped index, the vectors count once in the sum however
+many workers there are; --no-mmap loads a copy per worker for comparison.
+
+Sessions must be shared between workers, so more than one worker needs Redis (--redis-url).
+--pad-steps adds that many random step vectors to a copy of the index, far from every real
+query, to see the index's share of memory at a realistic size.
+
+    python -m bench.scaling --workers 1 2 4 --redis-url redis://localhost:6379/0 --generate 40 --concurrency 16 --scale 0.1
+    python -m bench.scaling --workers 1 2 4 --redis-url redis://localhost:6379/0 --pad-steps 20000 --no-mmap
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench.fake_openai import FakeOpenAI, parse_latency, VECTOR_DIR, DIM
+from bench.load_test import run as run_load, NO_CACHE_ENV
+
+APP_DIR = Path(__file__).resolve().parent.parent
+BOOT_TIMEOUT = 120
+
+
+# --- Index padding ---
+def padded_vector_dir(source: Path, steps: int, seed: int) -> Path:
+    """Copy of the vector directory plus one task holding `steps` random unit vectors."""
+    import faiss
+
+    target = Path(tempfile.mkdtemp(prefix="bench-vectors-"))
+    for path in source.iterdir():
+        if path.is_file():
+            shutil.copy2(path, target / path.name)
+
+    rng = np.random.default_rng(seed)
+    def unit(n):
+        vectors = rng.standard_normal((n, DIM)).astype("float32")
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    task_id = "BENCH-PAD"
+    task_index = faiss.read_index(str(target / "task_index.faiss"))
+    task_index.add(unit(1))
+    faiss.write_index(task_index, str(target / "task_index.faiss"))
+
+    steps_meta = [{"step_num": i + 1, "text": ""} for i in range(steps)]
+    step_index = faiss.IndexFlatL2(DIM)
+    step_index.add(unit(steps))
+    faiss.write_index(step_index, str(target / f"steps_{task_id}.faiss"))
+    with open(target / f"steps_{task_id}_meta.json", "w", encoding="utf-8") as f:
+        json.dump(steps_meta, f)
+
+    with open(target / "task_meta.json", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta.append({"task_id": task_id, "title": "", "intro": "", "steps": steps_meta})
+    with open(target / "task_meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return target
+
+
+# --- Server ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers, threads, fake_url, args, vector_dir, log_path):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": fake_url + "/v1",
+        "OPENAI_API_KEY": "fake",
+        "FLASK_SECRET_KEY": "load-test",
+        "FLASK_SERVER_PORT": str(port),
+        "INDEX_WATCH_INTERVAL": "0",
+        # Replayed "audio" is the transcript itself, there is nothing for ffmpeg to decode
+        "AUDIO_NORMALIZE": "0",
+        "WEB_WORKERS": str(workers),
+        "WEB_THREADS": str(threads),
+        "VECTOR_INDEX_MMAP": "0" if args.no_mmap else "1",
+    })
+    if vector_dir:
+        env["VECTOR_DIR"] = str(vector_dir)
+    if args.redis_url:
+        env.update({"SESSION_BACKEND": "redis", "SESSION_REDIS_URL": args.redis_url})
+    if args.no_cache:
+        env.update(NO_CACHE_ENV)
+
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+    # Ready once every worker has imported the app
+    deadline = time.time() + BOOT_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"❌ gunicorn exited with {process.returncode}, see {log_path}")
+        if Path(log_path).read_text(errors="ignore").count("✅ Worker") >= workers:
+            return process, f"http://127.0.0.1:{port}"
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"❌ {workers} workers not ready after {BOOT_TIMEOUT} sec, see {log_path}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# --- Memory ---
+def smaps_mb(pid):
+    """{Pss, Anonymous} in MB of one process, from smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Pss", "Anonymous"):
+                values[key] = int(rest.split()[0]) / 1024
+    return values
+
+
+def server_memory(master_pid):
+    children = Path(f"/proc/{master_pid}/task/{master_pid}/children").read_text().split()
+    workers = [smaps_mb(int(pid)) for pid in children]
+    master = smaps_mb(master_pid)
+    return {
+        # Mapped index pages are file-backed, not anonymous, and counted once in the PSS sum
+        "worker_anon_mb": sum(w["Anonymous"] for w in workers) / len(workers) if workers else None,
+        "total_pss_mb": master["Pss"] + sum(w["Pss"] for w in workers),
+    }
+
+
+# --- Runs ---
+def load_args(args, url, fake_url):
+    return argparse.Namespace(
+        url=url, fake_url=fake_url, sessions=None, generate=args.generate, record=None,
+        warmup=args.warmup, stream=args.stream, timeout=args.timeout, concurrency=args.concurrency,
+        no_cache=args.no_cache, verbose=False, latency=args.latency, scale=args.scale,
+        vector_dir=VECTOR_DIR, seed=args.seed,
+    )
+
+
+def run(args):
+    if max(args.workers) > 1 and not args.redis_url:
+        raise SystemExit("❌ More than one worker needs shared sessions: pass --redis-url")
+
+    fake = FakeOpenAI(parse_latency(args.latency), args.scale, VECTOR_DIR, args.seed)
+    fake_server = fake.make_server()
+    threading.Thread(target=fake_server.serve_forever, name="fake-openai", daemon=True).start()
+    fake_url = f"http://127.0.0.1:{fake_server.server_address[1]}"
+
+    vector_dir = padded_vector_dir(VECTOR_DIR, args.pad_steps, args.seed) if args.pad_steps else None
+    log_dir = Path(tempfile.mkdtemp(prefix="bench-scaling-"))
+    results = []
+    try:
+        for workers in args.workers:
+            log_path = log_dir / f"gunicorn-{workers}.log"
+            process, url = start_server(workers, args.threads, fake_url, args, vector_dir, log_path)
+            try:
+                report = run_load(load_args(args, url, fake_url))
+                memory = server_memory(process.pid)
+            finally:
+                stop_server(process)
+
+            results.append({
+                "workers": workers,
+                "threads": args.threads,
+                "rps": report["rps"],
+                "p50": report["end_to_end"]["p50"],
+                "p95": report["end_to_end"]["p95"],
+                "errors": report["errors"],
+                **memory,
+            })
+            print_row(results[-1], results[0])
+    finally:
+        fake_server.shutdown()
+        if vector_dir:
+            shutil.rmtree(vector_dir, ignore_errors=True)
+    return results
+
+
+def print_header(args):
+    print(f"\n📊 {args.generate} sessions at concurrency {args.concurrency}, {args.threads} threads per worker, "
+          f"index {'loaded per worker' if args.no_mmap else 'memory-mapped'}"
+          + (f", +{args.pad_steps} padding steps" if args.pad_steps else ""))
+    print(f"{'workers':>7} {'req/s':>7} {'speedup':>7} {'p50 ms':>7} {'p95 ms':>7} {'errors':>6} "
+          f"{'worker anon MB':>14} {'total PSS MB':>12}")
+
+
+def print_row(row, base):
+    ms = lambda value: "-" if value is None else f"{value * 1000:.0f}"
+    mb = lambda value: "-" if value is None else f"{value:.1f}"
+    speedup = row["rps"] / base["rps"] if base["rps"] else 0.0
+    print(f"{row['workers']:>7} {row['rps']:>7.2f} {speedup:>6.2f}x {ms(row['p50']):>7} {ms(row['p95']):>7} "
+          f"{row['errors']:>6} {mb(row['worker_anon_mb']):>14} {mb(row['total_pss_mb']):>12}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=16, help="threads per worker")
+    parser.add_argument("--redis-url", default=os.getenv("SESSION_REDIS_URL"), help="session store shared by the workers")
+    parser.add_argument("--generate", type=int, default=40, help="number of sessions to generate")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stream", action="store_true", help="use the streaming response mode")
+    parser.add_argument("--warmup", type=int, default=4, help="sessions replayed before measuring")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--no-cache", action="store_true", help="server without embedding, TTS and response caches")
+    parser.add_argument("--no-mmap", action="store_true", help="load a copy of the index in every worker")
+    parser.add_argument("--pad-steps", type=int, default=0, help="random step vectors added to a copy of the index")
+    parser.add_argument("--latency", nargs="*", help="fake stage latency, stage=median[:sigma]")
+    parser.add_argument("--scale", type=float, default=0.1, help="multiplier for every fake latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="write the results here")
+    args = parser.parse_args()
+
+    print_header(args)
+    results = run(args)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
@@ -0,0 +1,94 @@
+"""
+Recall/latency benchmark of VectorIndex backends on synthetic corpora.
+
+Tasks are random unit centroids, steps are noisy copies of their task, queries are noisy copies
+of random steps. Exact flat search gives the ground truth for recall.
+
+    python -m bench.vector_index_bench --sizes 100 1000 10000 100000 --dim 1536
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.vector_index import VectorIndex, BACKENDS
+
+
+def unit(x):
+    return (x / np.linalg.norm(x, axis=-1, keepdims=True)).astype("float32")
+
+
+def make_corpus(n_steps, dim, steps_per_task, rng):
+    n_tasks = max(1, n_steps // steps_per_task)
+    centroids = unit(rng.standard_normal((n_tasks, dim)))
+    tasks = []
+    for t in range(n_tasks):
+        steps = unit(centroids[t] + 0.35 * unit(rng.standard_normal((steps_per_task, dim))))
+        tasks.append((f"task-{t}", centroids[t], steps))
+    return tasks
+
+
+def make_queries(index, n_queries, rng):
+    rows = rng.integers(0, index.nsteps, n_queries)
+    steps = index.step_index.reconstruct_batch(rows) if hasattr(index.step_index, "reconstruct_batch") \
+        else np.stack([index.step_index.reconstruct(int(r)) for r in rows])
+    return unit(steps + 0.25 * unit(rng.standard_normal(steps.shape)))
+
+
+def recall(found, truth, k):
+    hits = [len(set(f[:k]) & set(t[:k])) / k for f, t in zip(found, truth)]
+    return float(np.mean(hits))
+
+
+def time_queries(search, queries):
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(search(q[None, :]))
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000, results
+
+
+def run(sizes, dim, n_queries, steps_per_task, k, seed):
+    rng = np.random.default_rng(seed)
+    print(f"{'vectors':>8} {'backend':>7} {'build s':>8} {'recall@1':>9} {'recall@k':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'filtered p50 ms':>16}")
+
+    for n in sizes:
+        tasks = make_corpus(n, dim, steps_per_task, rng)
+        exact = VectorIndex(dim=dim, backend="flat").build(tasks)
+        queries = make_queries(exact, n_queries, rng)
+        truth = exact.search_steps(queries, k=k)[1]
+        owners = [exact.locate(int(row))[0] for row in truth[:, 0]]
+
+        for backend in BACKENDS:
+            start = time.perf_counter()
+            index = VectorIndex(dim=dim, backend=backend).build(tasks)
+            build_time = time.perf_counter() - start
+
+            latencies, results = time_queries(lambda q: index.search_steps(q, k=k)[1][0], queries)
+            filtered, _ = time_queries(
+                lambda q, it=iter(owners): index.search_steps(q, k=1, task_id=next(it)), queries
+            )
+
+            print(f"{n:>8} {backend:>7} {build_time:>8.2f} {recall(results, truth, 1):>9.3f} "
+                  f"{recall(results, truth, k):>9.3f} {np.percentile(latencies, 50):>8.3f} "
+                  f"{np.percentile(latencies, 99):>8.3f} {np.percentile(filtered, 50):>16.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--steps-per-task", type=int, default=4)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run(args.sizes, args.dim, args.queries, args.steps_per_task, args.k, args.seed)
@@ -0,0 +1,203 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from utils.openai_client import openai_client
+from utils.tokens import token_counter
+
+SUMMARY_PROMPT = (
+    "Ты ведёшь краткую память разговора ассистента с пользователем. "
+    "Дополни краткое содержание новыми репликами: сохрани задачу пользователя, "
+    "шаги, которые он уже выполнил, и его нерешённые вопросы. "
+    "Пиши по-русски, сжато, без вступлений."
+)
+
+
+def render_turn(text: str, reply: str) -> str:
+    return f"Пользователь: {text}\nАссистент: {reply}"
+
+
+@dataclass
+class RenderedMemory:
+    summary: str
+    first: tuple        # oldest turn of the rendered window
+    last: tuple         # newest turn of the rendered window
+    count: int
+    text: str
+
+
+class ConversationMemory:
+    """
+    What the chat prompt remembers of a session, within a fixed token budget.
+
+    Turns are stored with their token count. The prompt gets the rolling summary plus the newest
+    turns that fit `budget_tokens`. Once stored turns exceed the budget, a background worker folds
+    the oldest ones into the summary with a small model, down to `fold_to` of the budget, so folds
+    (and the prompt prefix changes they cause) stay rare. Until a fold lands, the overflow is just
+    left out of the prompt.
+
+    The rendered memory text is cached per session; a new turn is appended to it instead of
+    re-rendering the whole history, and the text only changes at the front when a fold lands.
+    """
+
+    def __init__(self, store, budget_tokens: int = 1200, keep_turns: int = 2, fold_to: float = 0.5,
+                 summary_tokens: int = 300, model: str = "gpt-4o-mini", max_turns: int = 50,
+                 workers: int = 2, max_rendered: int = 10_000):
+        self.store = store
+        self.budget_tokens = budget_tokens
+        self.keep_turns = keep_turns
+        self.fold_to = fold_to
+        self.summary_tokens = summary_tokens
+        self.model = model
+        self.max_turns = max_turns
+        self.max_rendered = max_rendered
+        self.counter = token_counter
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="memory")
+        self.folding = set()
+        self.rendered = OrderedDict()   # session_id -> RenderedMemory
+        self.lock = threading.Lock()
+        self.counters = {"turns": 0, "folds": 0, "folded_turns": 0, "fold_failures": 0, "fold_conflicts": 0,
+                         "prompt_appends": 0, "prompt_rebuilds": 0}
+
+    @classmethod
+    def from_env(cls, store, max_turns: int = 50):
+        return cls(
+            store,
+            budget_tokens=int(os.getenv("MEMORY_TOKEN_BUDGET", "1200")),
+            keep_turns=int(os.getenv("MEMORY_KEEP_TURNS", "2")),
+            summary_tokens=int(os.getenv("MEMORY_SUMMARY_TOKENS", "300")),
+            model=os.getenv("MEMORY_SUMMARY_MODEL", "gpt-4o-mini"),
+            max_turns=max_turns,
+            workers=int(os.getenv("MEMORY_SUMMARY_WORKERS", "2")),
+        )
+
+    def tokens(self, entry: tuple) -> int:
+        # Turns stored before token counts were kept are counted on the fly
+        return entry[2] if len(entry) > 2 else self.counter.count(render_turn(entry[0], entry[1]))
+
+    # --- Writing ---
+    def add_turn(self, session_id, text: str, reply: str):
+        entry = (text, reply, self.counter.count(render_turn(text, reply)))
+        self.store.append_history(session_id, entry, self.max_turns)
+
+        with self.lock:
+            self.counters["turns"] += 1
+            if session_id in self.folding:
+                return
+            self.folding.add(session_id)
+        # Reading the history back and summarizing both happen off the request path
+        self.executor.submit(self._fold, session_id)
+
+    def _fold(self, session_id):
+        try:
+            history = self.store.get(session_id, "history", ())
+            tokens = [self.tokens(entry) for entry in history]
+            remaining = sum(tokens)
+            if remaining <= self.budget_tokens:
+                return
+
+            count = 0
+            while count < len(history) - self.keep_turns and remaining > self.budget_tokens * self.fold_to:
+                remaining -= tokens[count]
+                count += 1
+            if not count:
+                return
+
+            summary = self.store.get(session_id, "summary", "") or ""
+            summary = self._summarize(summary, history[:count])
+            applied = self.store.fold_history(session_id, tuple(history[0]), count, summary)
+            with self.lock:
+                if applied:
+                    self.counters["folds"] += 1
+                    self.counters["folded_turns"] += count
+                else:
+                    self.counters["fold_conflicts"] += 1
+
+        except Exception as e:
+            print(f"⚠️ Memory fold failed for {session_id}: {e}")
+            with self.lock:
+                self.counters["fold_failures"] += 1
+
+        finally:
+            with self.lock:
+                self.folding.discard(session_id)
+
+    def _summarize(self, summary: str, turns) -> str:
+        turns_text = "\n".join(render_turn(entry[0], entry[1]) for entry in turns)
+        content = f"Краткое содержание:\n{summary or '—'}\n\nНовые реплики:\n{turns_text}"
+        response = openai_client.call("summary", lambda c: c.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": content},
+            ],
+            max_tokens=self.summary_tokens
+        ))
+        folded = (response.choices[0].message.content or "").strip()
+        if not folded:
+            raise ValueError("empty summary")
+        return folded
+
+    # --- Reading ---
+    def window(self, session_id):
+        """(summary, newest turns within the token budget, oldest first)."""
+        # History first: a fold landing in between repeats a turn instead of losing it
+        history = self.store.get(session_id, "history", ())
+        summary = self.store.get(session_id, "summary", "") or ""
+
+        turns, used = [], 0
+        for entry in reversed(history):
+            used += self.tokens(entry)
+            if used > self.budget_tokens:
+                break
+            turns.append(tuple(entry))
+        turns.reverse()
+        return summary, turns
+
+    def prompt(self, session_id):
+        """Memory text for the system prompt, or None for a fresh session."""
+        summary, turns = self.window(session_id)
+        if not summary and not turns:
+            return None
+
+        with self.lock:
+            cached = self.rendered.get(session_id)
+
+        if (cached and turns and cached.count and cached.summary == summary and cached.first == turns[0]
+                and len(turns) >= cached.count and turns[cached.count - 1] == cached.last):
+            new_turns = turns[cached.count:]
+            text = cached.text + "".join("\n" + render_turn(entry[0], entry[1]) for entry in new_turns)
+            counter = "prompt_appends"
+        else:
+            sections = []
+            if summary:
+                sections.append(f"Краткое содержание разговора:\n{summary}")
+            if turns:
+                sections.append("История общения:\n" + "\n".join(render_turn(entry[0], entry[1]) for entry in turns))
+            text = "\n\n".join(sections)
+            counter = "prompt_rebuilds"
+
+        with self.lock:
+            self.counters[counter] += 1
+            if turns:
+                self.rendered[session_id] = RenderedMemory(summary, turns[0], turns[-1], len(turns), text)
+                self.rendered.move_to_end(session_id)
+                while len(self.rendered) > self.max_rendered:
+                    self.rendered.popitem(last=False)
+            else:
+                self.rendered.pop(session_id, None)
+        return text
+
+    def forget(self, session_id):
+        with self.lock:
+            self.rendered.pop(session_id, None)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["rendered_sessions"] = len(self.rendered)
+            stats["folds_in_flight"] = len(self.folding)
+        stats["exact_token_counts"] = int(self.counter.encoder is not None)
+        return stats
@@ -1,12 +1,26 @@
+import os
+import time
+import fcntl
 import faiss
+import shutil
+import hashlib
+import threading
 import numpy as np
 import json
+from contextlib import contextmanager
 from pathlib import Path
-from utils.embed import embed_query, embed_batch
+from utils.embed import embed_query
+from utils.model_router import model_router
 from dataclasses import dataclass
 from enum import Enum
 
 from core.session_manager import SessionManager
+from core.topic_shift import TopicShiftDetector
+from core.vector_index import VectorIndex, LAYOUT_FILE
+
+# Built indexes are saved here and memory-mapped, so all worker processes share one copy
+PACKED_DIR = "packed"
+VECTOR_INDEX_MMAP = os.getenv("VECTOR_INDEX_MMAP", "1") == "1"
 
 class MatchStatus(Enum):
     NO_TASK_MATCH = "NO_TASK_MATCH"
@@ -18,94 +32,386 @@ class MatchResult:
     status: MatchStatus
     task: dict = None
     step: dict = None
+    query_embedding: list = None
 
-class FaissMatcher:
-    def __init__(self, index_path: Path, meta_path: Path, dim: int = 1536):
-        self.index = faiss.read_index(str(index_path))
+@dataclass
+class BatchMatch:
+    """
+    Raw top-k results of FaissMatcher.match_many, all shaped (n_queries, k).
+    Steps are the nearest ones inside each query's top task; missing hits are None / inf.
+    """
+    task_ids: np.ndarray
+    task_distances: np.ndarray
+    step_nums: np.ndarray
+    step_distances: np.ndarray
+
+    def predict(self, task_threshold: float, step_threshold: float):
+        """(task_ids, step_nums) the matcher would pick for a fresh session at these thresholds."""
+        task_ok = self.task_distances[:, 0] <= task_threshold
+        step_ok = task_ok & (self.step_distances[:, 0] <= step_threshold)
+        return (np.where(task_ok, self.task_ids[:, 0], None),
+                np.where(step_ok, self.step_nums[:, 0], None))
+
+class IndexGeneration:
+    """
+    One immutable load of the task/step indexes and their metadata.
+
+    Never modified after load: a reload builds a new generation and swaps the reference,
+    so readers holding the old one keep a consistent view until they let go of it.
+    """
+
+    def __init__(self, index_path: Path, meta_path: Path, dim: int, version: int = 1):
         self.dim = dim
+        self.version = version
+        self.signature = index_signature(index_path.parent)
+        self.loaded_at = time.time()
+
         with open(meta_path, encoding="utf-8") as f:
             self.meta = json.load(f)
+        self.tasks = {task["task_id"]: task for task in self.meta}
+        if not self.meta:
+            raise ValueError("❌ Task metadata is empty.")
+        if len(self.tasks) != len(self.meta):
+            raise ValueError("❌ Task metadata has duplicate task ids.")
+
+        # Task and step vectors built by model/build_fiass_index.py, held in one index subsystem.
+        # Shared read-only across all sessions, and across worker processes when memory-mapped.
+        self.step_meta = {}
+        self.vectors = self.load_packed(index_path) if VECTOR_INDEX_MMAP else self.load_vectors(index_path)
 
-    def set_step_vectors(self, match_result, client, logger, session_id):
-        steps = match_result.get('steps')
-        if not steps or not isinstance(steps, list):
-            raise ValueError("❌ Invalid or missing steps in task metadata.")
+    def load_packed(self, index_path: Path) -> VectorIndex:
+        """
+        The combined index saved under vector/packed/ and memory-mapped. The first process to
+        need a version builds and saves it; the others wait on the lock and map the same files.
+        """
+        vector_dir = index_path.parent
+        vectors = VectorIndex.from_env(self.dim)
+        packed_root = vector_dir / PACKED_DIR
+        packed_dir = packed_root / packed_key(vector_dir, vectors)
 
-        # Filter steps with non-empty text
-        step_texts = [
-            (step.get("text", "") + " " + " ".join(step.get("keywords", []))).strip()
-            for step in steps
-        ]
-        step_texts = [text for text in step_texts if text]
+        with file_lock(packed_root / ".lock"):
+            if not (packed_dir / LAYOUT_FILE).exists():
+                self.load_vectors(index_path).save(packed_dir)
+                # Processes still on an old version keep their mapping after the unlink
+                for stale in packed_root.iterdir():
+                    if stale.is_dir() and stale != packed_dir:
+                        shutil.rmtree(stale, ignore_errors=True)
+            vectors.load(packed_dir)
 
-        if not step_texts:
-            raise ValueError("❌ No valid step texts to embed.")
+        if vectors.task_ids != [task["task_id"] for task in self.meta]:
+            raise ValueError("❌ Packed index does not match the task metadata.")
+        self.step_meta = {}
+        for task_id in vectors.task_ids:
+            if vectors.has_steps(task_id):
+                with open(vector_dir / f"steps_{task_id}_meta.json", encoding="utf-8") as f:
+                    self.step_meta[task_id] = json.load(f)
+                start, end = vectors.step_ranges[task_id]
+                if len(self.step_meta[task_id]) != end - start:
+                    raise ValueError(f"❌ Packed step index for {task_id} does not match its metadata.")
+        return vectors
 
-        # Try batch embedding
+    def load_vectors(self, index_path: Path) -> VectorIndex:
+        task_index = faiss.read_index(str(index_path))
+        if task_index.d != self.dim:
+            raise ValueError(f"❌ Task index has dimension {task_index.d}, expected {self.dim}.")
+        if task_index.ntotal != len(self.meta):
+            raise ValueError(f"❌ Task index has {task_index.ntotal} vectors for {len(self.meta)} tasks.")
+        task_vectors = task_index.reconstruct_n(0, task_index.ntotal)
+        if not np.isfinite(task_vectors).all():
+            raise ValueError("❌ Task index contains non-finite vectors.")
+
+        tasks = []
+        for position, task in enumerate(self.meta):
+            tasks.append((task["task_id"], task_vectors[position], self.load_step_vectors(index_path.parent, task["task_id"])))
+
+        return VectorIndex.from_env(self.dim).build(tasks)
+
+    def load_step_vectors(self, vector_dir: Path, task_id: str):
+        step_index_path = vector_dir / f"steps_{task_id}.faiss"
+        step_meta_path = vector_dir / f"steps_{task_id}_meta.json"
+        no_steps = np.empty((0, self.dim), dtype="float32")
+
+        if not step_index_path.exists() or not step_meta_path.exists():
+            print(f"⚠️ No step index for {task_id}")
+            return no_steps
+
+        index = faiss.read_index(str(step_index_path))
+        with open(step_meta_path, encoding="utf-8") as f:
+            step_meta = json.load(f)
+
+        if index.d != self.dim or index.ntotal != len(step_meta):
+            print(f"⚠️ Step index for {task_id} does not match its metadata, skipping")
+            return no_steps
+
+        self.step_meta[task_id] = step_meta
+        return index.reconstruct_n(0, index.ntotal)
+
+
+def index_signature(vector_dir: Path):
+    """(mtime, size) of the files a rebuild rewrites when anything changed; the manifest is written last."""
+    signature = []
+    for name in ("manifest.json", "task_meta.json", "task_index.faiss"):
         try:
-            vectors = embed_batch(step_texts, client, logger, silent=True)
-            if not vectors:
-                raise ValueError("❌ Embedding failed: no vectors returned.")
+            stat = (vector_dir / name).stat()
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append((name, None, None))
+    return tuple(signature)
 
-            vectors = np.stack(vectors)
-            SessionManager.set_step_vectors(session_id, vectors)
 
-        except Exception as e:
-            logger.error("❌ Failed to set step vectors:", e)
-            raise e
+def packed_key(vector_dir: Path, vectors: VectorIndex) -> str:
+    """Changes with any file of the vector directory or any setting that shapes the built index."""
+    files = sorted((path.name, path.stat().st_mtime_ns, path.stat().st_size)
+                   for path in vector_dir.iterdir() if path.is_file())
+    settings = (vectors.dim, vectors.backend, vectors.nlist, vectors.hnsw_m)
+    return hashlib.sha256(json.dumps([files, settings]).encode("utf-8")).hexdigest()[:16]
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive lock shared by all processes on this machine."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class FaissMatcher:
+    def __init__(self, index_path: Path, meta_path: Path, dim: int = 1536):
+        self.dim = dim
+        self.index_path = Path(index_path)
+        self.meta_path = Path(meta_path)
+        self.task_threshold = float(os.getenv("TASK_MATCH_THRESHOLD", "0.40"))
+        self.step_threshold = float(os.getenv("STEP_MATCH_THRESHOLD", "0.40"))
+
+        # Current generation; requests pin it for their whole duration (see pinned)
+        self._generation = IndexGeneration(self.index_path, self.meta_path, dim)
+        self._local = threading.local()
+        self.reload_lock = threading.Lock()
+        self.reload_listeners = []
+        self.watcher = None
+        self.lock = threading.Lock()
+        self.counters = {"reloads": 0, "reload_failures": 0, "orphaned_sessions": 0}
+
+        # Local topic-shift check; the LLM is only asked when the margin is ambiguous
+        self.topic_shift = TopicShiftDetector.from_env(self)
+
+    # --- Index generations ---
+    @property
+    def generation(self) -> IndexGeneration:
+        return getattr(self._local, "generation", None) or self._generation
+
+    @property
+    def meta(self):
+        return self.generation.meta
+
+    @property
+    def tasks(self):
+        return self.generation.tasks
+
+    @property
+    def step_meta(self):
+        return self.generation.step_meta
+
+    @property
+    def vectors(self) -> VectorIndex:
+        return self.generation.vectors
+
+    @contextmanager
+    def pinned(self):
+        """Read side: everything inside sees one generation, even if a reload swaps it meanwhile."""
+        previous = getattr(self._local, "generation", None)
+        self._local.generation = previous or self._generation
+        try:
+            yield self._local.generation
+        finally:
+            self._local.generation = previous
+
+    def reload(self, force: bool = False):
+        """
+        Load the indexes from disk into a new generation and swap it in.
+        Returns (reloaded, error); on any failure the current generation stays in place.
+        """
+        with self.reload_lock:
+            current = self._generation
+            if not force and index_signature(self.index_path.parent) == current.signature:
+                return False, None
+
+            started = time.time()
+            try:
+                generation = IndexGeneration(self.index_path, self.meta_path, self.dim, current.version + 1)
+            except Exception as e:
+                with self.lock:
+                    self.counters["reload_failures"] += 1
+                print(f"⚠️ Index reload failed, keeping generation {current.version}: {e}")
+                return False, str(e)
+
+            # Single reference swap: new requests see the new generation, pinned ones finish on the old
+            self._generation = generation
+            with self.lock:
+                self.counters["reloads"] += 1
+
+        removed = sorted(set(current.tasks) - set(generation.tasks))
+        print(f"✅ Index generation {generation.version} loaded in {time.time() - started:.2f} sec: "
+              f"{generation.vectors.ntasks} tasks, {generation.vectors.nsteps} steps"
+              + (f", removed {removed}" if removed else ""))
+
+        for listener in self.reload_listeners:
+            try:
+                listener(generation)
+            except Exception as e:
+                print(f"⚠️ Index reload listener failed: {e}")
+
+        return True, None
+
+    def watch(self, interval: float):
+        """Poll the vector directory and reload once a changed index has stayed unchanged for one interval."""
+        if interval <= 0 or self.watcher is not None:
+            return
+
+        def loop():
+            seen = self._generation.signature
+            failed = None
+            while True:
+                time.sleep(interval)
+                signature = index_signature(self.index_path.parent)
+                # A rebuild writes several files; wait until they stop changing
+                if signature != seen:
+                    seen = signature
+                    continue
+                # Don't retry a broken set of files until it changes again
+                if signature != self._generation.signature and signature != failed:
+                    reloaded, error = self.reload()
+                    failed = signature if error else None
+
+        self.watcher = threading.Thread(target=loop, name="index-watcher", daemon=True)
+        self.watcher.start()
+
+    def stats(self):
+        generation = self._generation
+        with self.lock:
+            stats = dict(self.counters)
+        stats.update({
+            "version": generation.version,
+            "tasks": generation.vectors.ntasks,
+            "steps": generation.vectors.nsteps,
+            "loaded_at": generation.loaded_at,
+            "mmap": int(VECTOR_INDEX_MMAP),
+        })
+        return stats
+
+    def match_many(self, queries, k: int = 1) -> BatchMatch:
+        """
+        Vectorized task and step lookup for many query embeddings at once, without thresholds,
+        session state or logging. Meant for offline evaluation and replay.
+        """
+        with self.pinned() as generation:
+            vectors = generation.vectors
+            queries = np.asarray(queries, dtype="float32").reshape(-1, self.dim)
+
+            found_distances, found_positions = vectors.search_tasks(queries, k=k)
+            # FAISS returns at most as many columns as there are tasks; pad up to k
+            task_distances = np.full((len(queries), k), np.inf, dtype="float32")
+            positions = np.full((len(queries), k), -1, dtype="int64")
+            task_distances[:, :found_distances.shape[1]] = found_distances
+            positions[:, :found_positions.shape[1]] = found_positions
+            task_ids = np.full(positions.shape, None, dtype=object)
+            found = positions >= 0
+            task_ids[found] = np.array(vectors.task_ids, dtype=object)[positions[found]]
+
+            step_distances, step_positions = vectors.search_steps_grouped(queries, task_ids[:, 0], k=k)
+            step_nums = np.full(step_positions.shape, None, dtype=object)
+            for task_id in set(task_ids[:, 0]) - {None}:
+                rows = task_ids[:, 0] == task_id
+                nums = np.array([step.get("step_num") for step in generation.step_meta.get(task_id, [])] + [None], dtype=object)
+                # -1 (no hit) picks the trailing None
+                step_nums[rows] = nums[step_positions[rows]]
+
+        return BatchMatch(task_ids, task_distances, step_nums, step_distances)
 
     def process(self, session_id, query, client, logger):
+        with self.pinned():
+            return self.process_pinned(session_id, query, client, logger)
+
+    def current_task(self, session_id, logger):
+        """The session's task in the current generation; a task that was removed is released."""
+        task_id = SessionManager.get_task_id(session_id)
+        task = self.get_task(task_id)
+        if task_id is not None and task is None:
+            logger.info(f"⚠️ Task {task_id} is no longer in the index, starting over.")
+            SessionManager.unlock_task(session_id)
+            with self.lock:
+                self.counters["orphaned_sessions"] += 1
+        return task
+
+    def process_pinned(self, session_id, query, client, logger):
         logger.info("🔍 Processing user input for task or step matching.")
 
+        current_task = self.current_task(session_id, logger)
+        current_step = self.get_step(current_task, SessionManager.get_step_num(session_id))
+
         query_embedding = embed_query(query, client, logger)
 
-        current_task = SessionManager.get_matched_task(session_id)
+        # Resolve both branches up front: FAISS lookups are cheap next to any network call
+        with logger.span("task_search", "🔎 Task search"):
+            new_task, task_distance = self.search_task(query_embedding)
+        with logger.span("step_search", "🔎 Step search"):
+            new_step = self.search_step(new_task, query_embedding) if new_task else (None, None)
+            kept_step = (None, None)
+            if current_task:
+                if new_task and new_task["task_id"] == current_task["task_id"]:
+                    kept_step = new_step
+                else:
+                    kept_step = self.search_step(current_task, query_embedding)
 
-        if not current_task or self.user_says_mismatch(query, client, current_task, SessionManager.get_current_step(session_id)):
+        if not current_task or self.topic_shift.is_shift(
+            query, query_embedding, client, current_task, current_step, logger
+        ):
             logger.info("No active task. Trying to match a new task.")
-            match = self.match_task(query_embedding, logger)
-            if match is not None:
-                SessionManager.set_matched_task(session_id, match)
-                self.set_step_vectors(match, client, logger, session_id)
-            else:
+            if new_task is None:
+                logger.info("❌ No task match found.")
                 return MatchResult(
-                    MatchStatus.NO_TASK_MATCH
+                    MatchStatus.NO_TASK_MATCH,
+                    query_embedding=query_embedding
                 )
+            self.log_task_match(new_task, task_distance, logger)
+            SessionManager.set_task_id(session_id, new_task["task_id"])
+            current_task = new_task
+            current_step, step_distance = new_step
+        else:
+            current_step, step_distance = kept_step
 
-        current_task = SessionManager.get_matched_task(session_id)
-
-        current_step = self.match_step_in_task(current_task, query_embedding, logger, session_id)
         if current_step is not None:
-            SessionManager.set_current_step(session_id, current_step)
+            self.log_step_match(current_step, step_distance, logger)
+            SessionManager.set_step_num(session_id, current_step.get("step_num"))
         else:
+            logger.info("❌ No step match found.")
             return MatchResult(
                 MatchStatus.NO_STEP_MATCH,
-                task=current_task
+                task=current_task,
+                query_embedding=query_embedding
             )
 
         return MatchResult(
             MatchStatus.MATCHED,
             task=current_task,
-            step=current_step
+            step=current_step,
+            query_embedding=query_embedding
         )
 
-    def user_says_mismatch(self, text: str, openai_client, task_match=None, current_step_num=None) -> bool:
+    def user_says_mismatch(self, text: str, openai_client, task_match=None, current_step=None) -> bool:
         try:
-            current_step = ""
-            if task_match and current_step_num is not None:
-                steps = task_match.get('steps', [])
-                if 0 <= current_step_num < len(steps):
-                    current_step = steps[current_step_num].get('text', '')
+            current_step = current_step.get('text', '') if current_step else ""
 
             prompt_context = f"Task title: {task_match.get('title', '')}\nCurrent step description: {current_step}\nUser's latest message: {text}"
 
-            response = openai_client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are helping determine if the user's latest message fits into the current task and step context. If it fits, reply ONLY 'confirm'. If it is a new unrelated topic, reply ONLY 'reject'."},
-                    {"role": "user", "content": prompt_context}
-                ]
-            )
+            response = model_router.complete("mismatch", [
+                {"role": "system", "content": "You are helping determine if the user's latest message fits into the current task and step context. If it fits, reply ONLY 'confirm'. If it is a new unrelated topic, reply ONLY 'reject'."},
+                {"role": "user", "content": prompt_context}
+            ])
             result = response.choices[0].message.content.strip().lower()
             return result == "reject"
 
@@ -114,49 +420,76 @@ class FaissMatcher:
             return False
         
     def match_task(self, query_embedding, logger):
-        D, I = self.index.search(np.array([query_embedding]), k=1)
-        best_distance = D[0][0]
-        best_idx = I[0][0]
-
-        if 0 <= best_idx < len(self.meta) and best_distance <= 0.40:
-            best_task = self.meta[best_idx]
-            logger.info(f"\n✅ Task matched: {best_task['title']}")
-            logger.info(f"📏 Task distance: {best_distance:.4f}")
-            return best_task
+        best_task, best_distance = self.search_task(query_embedding)
+        if best_task is not None:
+            self.log_task_match(best_task, best_distance, logger)
         else:
             logger.info("❌ No task match found.")
-            return None
-        
-    def match_step_in_task(self, task_meta: dict, query_embedding, logger, session_id: str):
-        steps = task_meta.get("steps", [])
-        if not steps:
+        return best_task
+
+    def match_step_in_task(self, task_meta: dict, query_embedding, logger):
+        if not task_meta.get("steps"):
             logger.info("❌ No steps found in task.")
             return None
 
-        # 🧠 Get precomputed step vectors
-        step_vectors = SessionManager.get_step_vectors(session_id)
-        if step_vectors is None:
-            logger.error("❌ Step vectors missing.")
+        if not self.vectors.has_steps(task_meta.get("task_id")):
+            logger.error(f"❌ Step index missing for {task_meta.get('task_id')}.")
             return None
 
-        # Build a temporary FAISS index
-        index = faiss.IndexFlatL2(step_vectors.shape[1])
-        index.add(step_vectors)
+        best_step, best_distance = self.search_step(task_meta, query_embedding)
+        if best_step is not None:
+            self.log_step_match(best_step, best_distance, logger)
+        else:
+            logger.info("❌ No step match found.")
+        return best_step
 
-        # Search
-        D, I = index.search(np.array([query_embedding]), k=1)
+    def search_task(self, query_embedding):
+        """Best task within the distance cutoff, as (task, distance), or (None, distance)."""
+        D, I = self.vectors.search_tasks(np.array([query_embedding], dtype="float32"), k=1)
+        best_distance = D[0][0]
+        best_idx = I[0][0]
 
+        if 0 <= best_idx < len(self.meta) and best_distance <= self.task_threshold:
+            return self.meta[best_idx], best_distance
+        return None, best_distance
+
+    def search_step(self, task_meta: dict, query_embedding):
+        """Best step of the task within the distance cutoff, as (step, distance), or (None, distance)."""
+        # 🧠 Search only this task's slice of the shared step vectors
+        task_id = task_meta.get("task_id")
+        if not self.vectors.has_steps(task_id) or not task_meta.get("steps"):
+            return None, None
+
+        D, I = self.vectors.search_steps(np.array([query_embedding], dtype="float32"), k=1, task_id=task_id)
         best_distance = D[0][0]
         best_idx = I[0][0]
 
-        if 0 <= best_idx < len(steps) and best_distance <= 0.40:
-            best_step = steps[best_idx]
-            logger.info(f"\n✅ Step matched: Step {best_step.get('step_num', best_idx)}")
-            logger.info(f"📝 {best_step.get('text', '')}")
-            logger.info(f"📏 Step distance: {best_distance:.4f}")
-            return best_step
-        else:
-            logger.info("❌ No step match found.")
-            return None
+        if 0 <= best_idx < len(self.step_meta[task_id]) and best_distance <= self.step_threshold:
+            return self.resolve_step(task_meta, best_idx), best_distance
+        return None, best_distance
 
+    def log_task_match(self, task: dict, distance, logger):
+        logger.info(f"\n✅ Task matched: {task['title']}")
+        logger.info(f"📏 Task distance: {distance:.4f}")
+
+    def log_step_match(self, step: dict, distance, logger):
+        logger.info(f"\n✅ Step matched: Step {step.get('step_num')}")
+        logger.info(f"📝 {step.get('text', '')}")
+        logger.info(f"📏 Step distance: {distance:.4f}")
+
+    def get_task(self, task_id):
+        """Shared task dict for a session's task id, or None if it is unknown."""
+        return self.tasks.get(task_id) if task_id is not None else None
+
+    def get_step(self, task_meta: dict, step_num):
+        if not task_meta or step_num is None:
+            return None
+        return next((step for step in task_meta.get("steps", []) if step.get("step_num") == step_num), None)
 
+    def resolve_step(self, task_meta: dict, step_idx: int):
+        """Map a row of the step index back to the step dict of the task."""
+        indexed = self.step_meta[task_meta["task_id"]][step_idx]
+        for step in task_meta.get("steps", []):
+            if step.get("step_num") == indexed.get("step_num"):
+                return step
+        return indexed
@@ -1,11 +1,15 @@
 # services/process_manager.py
 
-import os, base64, time
-from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor
+import os, time
 from flask import request
 import openai
 from core.session_manager import SessionManager
+from utils.audio import audio_normalizer
+from utils.vision import image_preparer
+
+VISION_MAX_IMAGES = int(os.getenv("VISION_MAX_IMAGES", "5"))
+VISION_TIMEOUT = float(os.getenv("VISION_TIMEOUT", "10"))
+UNCHANGED_SCREEN_TEXT = "Экран не изменился с прошлого вопроса."
 
 class ProcessManager:
     @staticmethod
@@ -14,38 +18,51 @@ class ProcessManager:
         
         session_id = session.get('user_id')
         if not session_id:
-            return None, None, "Missing session_id"
+            return None, "Missing session_id"
         
         if not SessionManager.session_exists(session_id):
-            return None, None, "Invalid session_id"
+            return None, "Invalid session_id"
         
-        logger = SessionManager.get_logger(session_id)
-        logger.start_timer()
+        # Own timer and spans per request, even when requests of one session overlap
+        logger = SessionManager.get_logger(session_id).for_request()
         
         return session_id, logger
 
     @staticmethod
     def transcribe_audio(openai_client, logger):
-        audio = request.files.get('audio')
-        logger.log_time("📥 Audio received")
+        with logger.span("audio_receive", "📥 Audio received"):
+            audio = request.files.get('audio')
 
         if not audio or not hasattr(audio.stream, 'read'):
             return None, "No valid audio file"
 
-        raw_bytes = audio.read()
-        if not raw_bytes:
-            return None, "Empty audio stream"
+        # Already spooled by werkzeug; ffmpeg reads it from there: mono, 16 kHz, silence trimmed, Opus
+        with logger.span("audio_normalize", "🎚️ Audio prepared"):
+            prepared = audio_normalizer.prepare(audio.stream, audio.filename)
+
+        try:
+            if not prepared.bytes_in:
+                return None, "Empty audio stream"
+            logger.info(f"🎚️ Audio {prepared.bytes_in} → {prepared.bytes_out} bytes"
+                        f"{'' if prepared.normalized else ' (as uploaded)'}")
 
-        buffer = BytesIO(raw_bytes)
-        buffer.name = audio.filename
-        logger.log_time("📦 Audio wrapped")
+            return ProcessManager.transcribe(openai_client, logger, prepared.filename, prepared.file)
+        finally:
+            prepared.close()
 
-        response = openai_client.audio.transcriptions.create(
-            model="whisper-1",
-            file=buffer,
-            response_format="verbose_json"
-        )
-        logger.log_time("🧠 Whisper took")
+    @staticmethod
+    def transcribe(openai_client, logger, filename, file):
+        """Whisper transcript of a seekable audio file, as (text, error)."""
+        def call(client):
+            file.seek(0)  # rewind for retries
+            return client.audio.transcriptions.create(
+                model="whisper-1",
+                file=(filename, file),
+                response_format="verbose_json"
+            )
+
+        with logger.span("transcription", "🧠 Whisper took"):
+            response = openai_client.call("transcription", call)
 
         if not response.text:
             return None, "Missing text"
@@ -53,35 +70,61 @@ class ProcessManager:
         return response.text, None
 
     @staticmethod
-    def prepare_vision_parts(logger):
+    def start_vision(logger):
+        """Queue uploaded screenshots on the shared vision pool; they are prepared while Whisper runs."""
         image_files = request.files.getlist("images")
 
         if not image_files:
-            logger.log_time("📷 No images uploaded")
+            logger.info("📷 No images uploaded")
             return []
 
-        encoded_images = []
-
-        def encode_safe(img):
+        pending = []
+        for img in image_files[:VISION_MAX_IMAGES]:
             try:
-                content = img.read()
-                if not content:
-                    return None
-                return base64.b64encode(content).decode("utf-8")
+                pending.append(image_preparer.submit(img.read()))
             except Exception as e:
                 logger.info(f"⚠️ Image read error: {str(e)}")
-                return None
+        return pending
 
-        with ThreadPoolExecutor() as executor:
-            results = list(executor.map(encode_safe, image_files[:5]))
-
-        for b64 in results:
-            if b64:
-                encoded_images.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{b64}"}
-                })
-
-        logger.log_time("🖼 Image encoding complete")
-
-        return encoded_images
+    @staticmethod
+    def prepare_vision_parts(session_id, pending, logger):
+        """
+        Image parts for the chat model, without screens near-identical to the last one sent in this session.
+
+        When every uploaded screen is a repeat, a short text part says so instead. Returns
+        (parts, screen_hash): the hash of the last screen sent, to be saved once the reply has
+        been made so a failed turn doesn't hide that screen from the next one; None if unchanged.
+        """
+        if not pending:
+            return [], None
+
+        with logger.span("image_encode", "🖼 Images ready"):
+            images = []
+            for future in pending:
+                try:
+                    images.append(future.result(timeout=VISION_TIMEOUT))
+                except Exception as e:
+                    logger.info(f"⚠️ Image prepare error: {str(e)}")
+
+        previous = last_sent = SessionManager.get_screen_hash(session_id)
+        parts = []
+        duplicates = 0
+        for image in images:
+            if image is None:
+                continue
+            if image_preparer.is_duplicate(image.fingerprint, previous):
+                duplicates += 1
+                image_preparer.count_duplicate()
+                continue
+            parts.append(image.part(image_preparer.detail))
+            if image.fingerprint is not None:
+                previous = image.fingerprint
+
+        prepared = [image for image in images if image is not None]
+        logger.info(f"🖼 {len(parts)} image(s) sent, {duplicates} unchanged, "
+                    f"{sum(i.bytes_in for i in prepared)} → {sum(i.bytes_out for i in prepared)} bytes")
+
+        screen_hash = previous if previous != last_sent else None
+        if not parts and duplicates:
+            return [{"type": "text", "text": UNCHANGED_SCREEN_TEXT}], screen_hash
+        return parts, screen_hash
@@ -1,104 +1,88 @@
 import time
 
-SESSION_STORE = {}
+from core.session_store import build_session_store
+from core.conversation_memory import ConversationMemory
 
 class SessionManager:
-    MEMORY_LIMIT = 10
+    # Hard cap on stored turns; the token budget of ConversationMemory decides what reaches the prompt
+    MEMORY_LIMIT = 50
     SESSION_LIFETIME_SECONDS = 3600  # 1 hour
 
+    store = build_session_store(SESSION_LIFETIME_SECONDS)
+    memory = ConversationMemory.from_env(store, max_turns=MEMORY_LIMIT)
+    # Rebuilds the logger when the store can't hold it (shared backends)
+    logger_factory = None
+
     @staticmethod
     def init_session(session_id, logger):
-        SESSION_STORE[session_id] = {
-            "history": [],
+        SessionManager.store.create(session_id, {
             "logger": logger,
-            "matched_task": None,
-            "current_step": 0,             # Added current_step
+            "task_id": None,
+            "step_num": None,
+            "screen_hash": None,
+            "summary": "",
             "created_at": time.time(),
             "updated_at": time.time()
-        }
+        })
 
     @staticmethod
     def get_logger(session_id):
-        SessionManager._refresh(session_id)
-        return SESSION_STORE.get(session_id, {}).get("logger")
+        logger = SessionManager.store.get(session_id, "logger")
+        if logger is None and SessionManager.logger_factory and SessionManager.store.exists(session_id):
+            logger = SessionManager.logger_factory(session_id)
+        return logger
 
     @staticmethod
     def get_history(session_id):
-        SessionManager._refresh(session_id)
-        return SESSION_STORE.get(session_id, {}).get("history", [])
+        history = SessionManager.store.get(session_id, "history", ())
+        return [{"text": text, "reply": reply} for text, reply, *_ in history]
 
     @staticmethod
-    def save_history(session_id, user_text, assistant_reply):
-        if session_id not in SESSION_STORE:
-            return
-        SESSION_STORE[session_id]["history"].append({
-            "text": user_text,
-            "reply": assistant_reply
-        })
-        SESSION_STORE[session_id]["history"] = SESSION_STORE[session_id]["history"][-SessionManager.MEMORY_LIMIT:]
-        SessionManager._refresh(session_id)
+    def get_memory_prompt(session_id):
+        return SessionManager.memory.prompt(session_id)
 
     @staticmethod
-    def set_matched_task(session_id, task_match):
-        if session_id in SESSION_STORE:
-            SESSION_STORE[session_id]["matched_task"] = task_match
-            SessionManager._refresh(session_id)
+    def save_history(session_id, user_text, assistant_reply):
+        SessionManager.memory.add_turn(session_id, user_text, assistant_reply)
 
     @staticmethod
-    def get_matched_task(session_id):
-        SessionManager._refresh(session_id)
-        return SESSION_STORE.get(session_id, {}).get("matched_task")
+    def set_task_id(session_id, task_id):
+        # A new task starts without a matched step
+        SessionManager.store.set(session_id, task_id=task_id, step_num=None)
 
     @staticmethod
-    def set_current_step(session_id, step_num):
-        if session_id in SESSION_STORE:
-            SESSION_STORE[session_id]["current_step"] = step_num
-            SessionManager._refresh(session_id)
+    def get_task_id(session_id):
+        return SessionManager.store.get(session_id, "task_id")
 
     @staticmethod
-    def get_current_step(session_id):
-        return SESSION_STORE.get(session_id, {}).get("current_step", 0)
+    def set_step_num(session_id, step_num):
+        SessionManager.store.set(session_id, step_num=step_num)
 
     @staticmethod
-    def unlock_task(session_id):
-        if session_id in SESSION_STORE:
-            SESSION_STORE[session_id]["matched_task"] = None
-            SESSION_STORE[session_id]["current_step"] = 0
-            SessionManager._refresh(session_id)
+    def get_step_num(session_id):
+        return SessionManager.store.get(session_id, "step_num")
 
     @staticmethod
-    def session_exists(session_id):
-        SessionManager._refresh(session_id)
-        return session_id in SESSION_STORE
+    def set_screen_hash(session_id, screen_hash):
+        SessionManager.store.set(session_id, screen_hash=screen_hash)
 
     @staticmethod
-    def clear_session(session_id):
-        if session_id in SESSION_STORE:
-            del SESSION_STORE[session_id]
+    def get_screen_hash(session_id):
+        return SessionManager.store.get(session_id, "screen_hash")
 
     @staticmethod
-    def clear_expired_sessions():
-        now = time.time()
-        expired = [
-            sid for sid, data in SESSION_STORE.items()
-            if now - data.get("updated_at", 0) > SessionManager.SESSION_LIFETIME_SECONDS
-        ]
-        for sid in expired:
-            del SESSION_STORE[sid]
+    def unlock_task(session_id):
+        SessionManager.store.set(session_id, task_id=None, step_num=None)
 
     @staticmethod
-    def _refresh(session_id):
-        """Private helper to update session activity time."""
-        if session_id in SESSION_STORE:
-            SESSION_STORE[session_id]["updated_at"] = time.time()
+    def session_exists(session_id):
+        return SessionManager.store.exists(session_id)
 
     @staticmethod
-    def set_step_vectors(session_id, vectors):
-        if session_id in SESSION_STORE:
-            SESSION_STORE[session_id]["step_vectors"] = vectors
-            SessionManager._refresh(session_id)
+    def clear_session(session_id):
+        SessionManager.store.delete(session_id)
+        SessionManager.memory.forget(session_id)
 
     @staticmethod
-    def get_step_vectors(session_id):
-        SessionManager._refresh(session_id)
-        return SESSION_STORE.get(session_id, {}).get("step_vectors")
+    def clear_expired_sessions():
+        SessionManager.store.expire()
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+
+
+def text_bytes(entry: tuple) -> int:
+    return len(entry[0].encode("utf-8")) + len(entry[1].encode("utf-8"))
+
+
+class SessionState:
+    """
+    Compact per-session record. Task content and vectors are shared by the matcher,
+    so a session only keeps ids; history is a deque of (text, reply, tokens) turns
+    next to the rolling summary of turns folded out of it.
+    """
+
+    __slots__ = ("logger", "task_id", "step_num", "screen_hash", "summary", "turns", "history_bytes",
+                 "created_at", "updated_at")
+
+    def __init__(self, logger=None, task_id=None, step_num=None, screen_hash=None, summary="",
+                 created_at=None, updated_at=None):
+        self.logger = logger
+        self.task_id = task_id
+        self.step_num = step_num
+        self.screen_hash = screen_hash
+        self.summary = summary
+        self.turns = deque()
+        self.history_bytes = 0
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+    @property
+    def history(self):
+        """Turns from oldest to newest."""
+        return list(self.turns)
+
+    def add_turn(self, entry: tuple, limit: int):
+        self.turns.append(entry)
+        self.history_bytes += text_bytes(entry)
+        self.drop_oldest(len(self.turns) - limit)
+
+    def drop_oldest(self, count: int):
+        for _ in range(min(count, len(self.turns))):
+            self.history_bytes -= text_bytes(self.turns.popleft())
+
+
+class SessionStore(ABC):
+    """
+    Storage behind SessionManager. Every read or write counts as activity and
+    pushes the session's expiry forward.
+
+    Fields are those of SessionState; history entries are (text, reply, tokens) tuples.
+    """
+
+    @abstractmethod
+    def create(self, session_id, data: dict):
+        ...
+
+    @abstractmethod
+    def get(self, session_id, field, default=None):
+        ...
+
+    @abstractmethod
+    def set(self, session_id, **fields):
+        ...
+
+    @abstractmethod
+    def append_history(self, session_id, entry: tuple, limit: int):
+        ...
+
+    @abstractmethod
+    def fold_history(self, session_id, first: tuple, count: int, summary: str) -> bool:
+        """
+        Replace the oldest `count` turns with `summary`, unless the history no longer starts
+        with `first` (another worker folded them already). Returns whether it was applied.
+        """
+
+    @abstractmethod
+    def exists(self, session_id) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id):
+        ...
+
+    @abstractmethod
+    def expire(self):
+        ...
+
+    @abstractmethod
+    def stats(self) -> dict:
+        ...
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Single-process store. Sessions sit in an OrderedDict kept in last-activity order,
+    so expiry and capacity eviction only ever look at the oldest end: amortized O(1).
+    """
+
+    # Measured cost of a SessionState with its logger and an empty history, rounded up
+    SESSION_OVERHEAD_BYTES = 512
+    # Tuple, two str headers and the token count per history entry
+    HISTORY_ENTRY_OVERHEAD_BYTES = 240
+
+    def __init__(self, lifetime: float, max_sessions: int = 10_000, max_bytes: int = 256 * 1024 * 1024):
+        self.lifetime = lifetime
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.sessions = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def _touch(self, session_id):
+        data = self.sessions.get(session_id)
+        if data is None:
+            return None
+        if time.time() - data.updated_at > self.lifetime:
+            self._remove(session_id)
+            return None
+        data.updated_at = time.time()
+        self.sessions.move_to_end(session_id)
+        return data
+
+    def _remove(self, session_id):
+        self.sessions.pop(session_id, None)
+        self.total_bytes -= self.sizes.pop(session_id, 0)
+
+    def _resize(self, session_id):
+        data = self.sessions[session_id]
+        size = (self.SESSION_OVERHEAD_BYTES + self.HISTORY_ENTRY_OVERHEAD_BYTES * len(data.turns)
+                + data.history_bytes + len(data.summary.encode("utf-8")))
+        self.total_bytes += size - self.sizes.get(session_id, 0)
+        self.sizes[session_id] = size
+
+    def _enforce_caps(self):
+        while self.sessions and (len(self.sessions) > self.max_sessions or self.total_bytes > self.max_bytes):
+            oldest = next(iter(self.sessions))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def create(self, session_id, data: dict):
+        with self.lock:
+            self._remove(session_id)
+            data["updated_at"] = time.time()
+            self.sessions[session_id] = SessionState(**data)
+            self._resize(session_id)
+            self.expire()
+            self._enforce_caps()
+
+    def get(self, session_id, field, default=None):
+        with self.lock:
+            data = self._touch(session_id)
+            return default if data is None else getattr(data, field, default)
+
+    def set(self, session_id, **fields):
+        with self.lock:
+            data = self._touch(session_id)
+            if data is not None:
+                for field, value in fields.items():
+                    setattr(data, field, value)
+
+    def append_history(self, session_id, entry: tuple, limit: int):
+        with self.lock:
+            data = self._touch(session_id)
+            if data is None:
+                return
+            data.add_turn(entry, limit)
+            self._resize(session_id)
+            self._enforce_caps()
+
+    def fold_history(self, session_id, first: tuple, count: int, summary: str) -> bool:
+        with self.lock:
+            data = self._touch(session_id)
+            if data is None or not data.turns or data.turns[0] != first:
+                return False
+            data.drop_oldest(count)
+            data.summary = summary
+            self._resize(session_id)
+            return True
+
+    def exists(self, session_id) -> bool:
+        with self.lock:
+            return self._touch(session_id) is not None
+
+    def delete(self, session_id):
+        with self.lock:
+            self._remove(session_id)
+
+    def expire(self):
+        cutoff = time.time() - self.lifetime
+        with self.lock:
+            while self.sessions:
+                oldest, data = next(iter(self.sessions.items()))
+                if data.updated_at >= cutoff:
+                    break
+                self._remove(oldest)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"sessions": len(self.sessions), "bytes": self.total_bytes, "evictions": self.evictions}
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Store shared by several worker processes through Redis (or any server speaking its protocol).
+
+    Each session is a hash of JSON-encoded fields plus a capped list for history, both with a
+    key TTL so Redis expires them itself. A sorted set of last-activity times drives eviction
+    of the least recently active sessions beyond either cap: session count, or bytes. Bytes are
+    the encoded size of each session's fields and history plus a fixed per-entry overhead,
+    tracked per session and in a running total; Redis's own bookkeeping is not counted, so
+    `maxmemory` should still be set on a server shared with other data.
+    Process-local objects such as the logger are not stored.
+    """
+
+    LOCAL_FIELDS = ("logger",)
+    # Refresh TTLs and activity only while the session still exists: touching an expired session
+    # would put it back in the activity set with nothing behind it, and leave its history unexpired
+    TOUCH_SCRIPT = """
+    if redis.call("EXPIRE", KEYS[1], ARGV[1]) == 1 then
+        redis.call("EXPIRE", KEYS[2], ARGV[1])
+        redis.call("ZADD", KEYS[3], ARGV[2], ARGV[3])
+        return 1
+    end
+    redis.call("DEL", KEYS[2])
+    return 0
+    """
+    # Hash and key bookkeeping per session, and list node per history entry, rounded up
+    SESSION_OVERHEAD_BYTES = 512
+    HISTORY_ENTRY_OVERHEAD_BYTES = 64
+
+    def __init__(self, url: str, lifetime: float, max_sessions: int = 10_000, max_bytes: int = 256 * 1024 * 1024,
+                 prefix: str = "caretaker:session:"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url)
+        self.lifetime = int(lifetime)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.activity_key = f"{prefix}activity"
+        self.sizes_key = f"{prefix}sizes"
+        self.bytes_key = f"{prefix}bytes"
+        self.evictions = 0
+        self.touch_script = self.redis.register_script(self.TOUCH_SCRIPT)
+
+    def _key(self, session_id):
+        return f"{self.prefix}{session_id}"
+
+    def _history_key(self, session_id):
+        return f"{self.prefix}{session_id}:history"
+
+    def _touch(self, pipe, session_id):
+        self.touch_script(
+            keys=[self._key(session_id), self._history_key(session_id), self.activity_key],
+            args=[self.lifetime, time.time(), session_id],
+            client=pipe,
+        )
+
+    def _resize(self, session_id):
+        """Re-measure one session and move the running total by the difference."""
+        pipe = self.redis.pipeline()
+        pipe.hvals(self._key(session_id))
+        pipe.lrange(self._history_key(session_id), 0, -1)
+        pipe.hget(self.sizes_key, session_id)
+        fields, history, old = pipe.execute()
+        if not fields:
+            # Expired or evicted in the meantime
+            self._forget([session_id])
+            return
+        size = (self.SESSION_OVERHEAD_BYTES + sum(map(len, fields))
+                + sum(len(item) + self.HISTORY_ENTRY_OVERHEAD_BYTES for item in history))
+
+        pipe = self.redis.pipeline()
+        pipe.hset(self.sizes_key, session_id, size)
+        pipe.incrby(self.bytes_key, size - int(old or 0))
+        pipe.execute()
+
+    def _forget(self, session_ids):
+        """Take removed sessions out of the size accounting."""
+        if not session_ids:
+            return
+        sizes = self.redis.hmget(self.sizes_key, session_ids)
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.sizes_key, *session_ids)
+        pipe.decrby(self.bytes_key, sum(int(size or 0) for size in sizes))
+        pipe.execute()
+
+    def create(self, session_id, data: dict):
+        fields = {k: json.dumps(v, ensure_ascii=False) for k, v in data.items()
+                  if k not in self.LOCAL_FIELDS and k != "history"}
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key(session_id), self._history_key(session_id))
+        pipe.hset(self._key(session_id), mapping=fields)
+        self._touch(pipe, session_id)
+        pipe.execute()
+        self._resize(session_id)
+        self.expire()
+        self._enforce_caps()
+
+    def get(self, session_id, field, default=None):
+        if field == "history":
+            if not self.redis.exists(self._key(session_id)):
+                return default
+            pipe = self.redis.pipeline()
+            pipe.lrange(self._history_key(session_id), 0, -1)
+            self._touch(pipe, session_id)
+            raw = pipe.execute()[0]
+            return [tuple(json.loads(item)) for item in raw]
+
+        raw = self.redis.hget(self._key(session_id), field)
+        if raw is None:
+            return default
+        pipe = self.redis.pipeline()
+        self._touch(pipe, session_id)
+        pipe.execute()
+        return json.loads(raw)
+
+    def set(self, session_id, **fields):
+        if not self.redis.exists(self._key(session_id)):
+            return
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(session_id), mapping={k: json.dumps(v, ensure_ascii=False) for k, v in fields.items()})
+        self._touch(pipe, session_id)
+        pipe.execute()
+
+    def append_history(self, session_id, entry: tuple, limit: int):
+        if not self.redis.exists(self._key(session_id)):
+            return
+        pipe = self.redis.pipeline()
+        pipe.rpush(self._history_key(session_id), json.dumps(entry, ensure_ascii=False))
+        pipe.ltrim(self._history_key(session_id), -limit, -1)
+        self._touch(pipe, session_id)
+        pipe.execute()
+        self._resize(session_id)
+        self._enforce_caps()
+
+    def fold_history(self, session_id, first: tuple, count: int, summary: str) -> bool:
+        import redis
+
+        history_key = self._history_key(session_id)
+        with self.redis.pipeline() as pipe:
+            try:
+                # Check-and-trim in one transaction, so two workers never fold the same turns
+                pipe.watch(history_key)
+                head = pipe.lindex(history_key, 0)
+                if head is None or tuple(json.loads(head)) != tuple(first):
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.ltrim(history_key, count, -1)
+                pipe.hset(self._key(session_id), "summary", json.dumps(summary, ensure_ascii=False))
+                self._touch(pipe, session_id)
+                pipe.execute()
+            except redis.WatchError:
+                return False
+        self._resize(session_id)
+        return True
+
+    def exists(self, session_id) -> bool:
+        if not self.redis.exists(self._key(session_id)):
+            return False
+        pipe = self.redis.pipeline()
+        self._touch(pipe, session_id)
+        pipe.execute()
+        return True
+
+    def delete(self, session_id):
+        pipe = self.redis.pipeline()
+        pipe.delete(self._key(session_id), self._history_key(session_id))
+        pipe.zrem(self.activity_key, session_id)
+        pipe.execute()
+        self._forget([session_id])
+
+    def expire(self):
+        # Session keys expire through their TTL; this trims the activity index and size accounting
+        cutoff = time.time() - self.lifetime
+        expired = [member.decode("utf-8") for member in self.redis.zrangebyscore(self.activity_key, "-inf", cutoff)]
+        if expired:
+            self.redis.zrem(self.activity_key, *expired)
+            self._forget(expired)
+
+    def _enforce_caps(self):
+        while (self.redis.zcard(self.activity_key) > self.max_sessions
+               or int(self.redis.get(self.bytes_key) or 0) > self.max_bytes):
+            oldest = self.redis.zpopmin(self.activity_key, 1)
+            if not oldest:
+                break
+            session_id = oldest[0][0].decode("utf-8")
+            self.redis.delete(self._key(session_id), self._history_key(session_id))
+            self._forget([session_id])
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": self.redis.zcard(self.activity_key),
+            "bytes": int(self.redis.get(self.bytes_key) or 0),
+            "evictions": self.evictions,
+        }
+
+
+def build_session_store(lifetime: float) -> SessionStore:
+    backend = os.getenv("SESSION_BACKEND", "memory")
+    max_sessions = int(os.getenv("SESSION_MAX_COUNT", "10000"))
+    max_bytes = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+
+    if backend == "redis":
+        return RedisSessionStore(
+            url=os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0"),
+            lifetime=lifetime,
+            max_sessions=max_sessions,
+            max_bytes=max_bytes,
+        )
+
+    return InMemorySessionStore(
+        lifetime=lifetime,
+        max_sessions=max_sessions,
+        max_bytes=max_bytes,
+    )
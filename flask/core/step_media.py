@@ -0,0 +1,69 @@
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+MEDIA_URL = "/api/media"
+
+
+class StepMedia:
+    """
+    Step image URLs from the renditions manifest written by model/build_renditions.py.
+
+    Rendition files are named by content hash, so their URLs can be cached forever.
+    The manifest is re-read when its mtime changes, so a rebuild needs no restart.
+    """
+
+    def __init__(self, renditions_dir: Path):
+        self.renditions_dir = Path(renditions_dir)
+        self.manifest_path = self.renditions_dir / "manifest.json"
+        self.tasks = {}
+        self.version = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            if mtime is None:
+                self.tasks, self.version = {}, None
+            else:
+                raw = self.manifest_path.read_bytes()
+                self.tasks = json.loads(raw).get("tasks", {})
+                self.version = hashlib.sha256(raw).hexdigest()[:16]
+                print(f"🖼 Step media manifest loaded: {sum(len(images) for images in self.tasks.values())} images")
+            self.mtime = mtime
+
+    def images(self, task_id, names) -> list:
+        """URLs and sizes of the named images of a task, in order; names without renditions are skipped."""
+        self._refresh()
+        renditions = self.tasks.get(task_id, {})
+        images = []
+        for name in names:
+            variants = renditions.get(name)
+            if not variants:
+                continue
+            full, thumb = variants["full"], variants.get("thumb", variants["full"])
+            images.append({
+                "name": name,
+                "url": f"{MEDIA_URL}/{full['file']}",
+                "width": full["width"],
+                "height": full["height"],
+                "thumb_url": f"{MEDIA_URL}/{thumb['file']}",
+                "thumb_width": thumb["width"],
+                "thumb_height": thumb["height"],
+            })
+        return images
+
+    def etag(self, task_id, step_num, names) -> str:
+        """Changes whenever the manifest or the step's image list does."""
+        self._refresh()
+        return hashlib.sha256(f"{self.version}\0{task_id}\0{step_num}\0{json.dumps(names)}".encode("utf-8")).hexdigest()[:16]
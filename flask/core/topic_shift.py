@@ -0,0 +1,89 @@
+import os
+import threading
+import numpy as np
+
+
+class TopicShiftDetector:
+    """
+    Decides locally whether a query left the current task, using the vectors the matcher already holds.
+
+    margin = (distance to the closest other task) - (distance to the current task or its closest step)
+    A clear positive margin keeps the task, a clear negative one switches it.
+    Only margins inside the ambiguous band fall back to the LLM check.
+    """
+
+    def __init__(self, matcher, band_low: float = -0.03, band_high: float = 0.03, neighbours: int = 8):
+        self.matcher = matcher
+        self.band_low = band_low
+        self.band_high = band_high
+        self.neighbours = neighbours
+        self.lock = threading.Lock()
+        self.counters = {"local_confirm": 0, "local_reject": 0, "llm_fallback": 0}
+
+    @classmethod
+    def from_env(cls, matcher):
+        return cls(
+            matcher,
+            band_low=float(os.getenv("TOPIC_SHIFT_BAND_LOW", "-0.03")),
+            band_high=float(os.getenv("TOPIC_SHIFT_BAND_HIGH", "0.03")),
+        )
+
+    def closest(self, query, task_id: str, task_distance):
+        """Distance to a task: its task vector or its nearest step, whichever is closer."""
+        distances = [] if task_distance is None else [task_distance]
+        if self.matcher.vectors.has_steps(task_id):
+            distances.append(self.matcher.vectors.search_steps(query, k=1, task_id=task_id)[0][0][0])
+        return min(distances) if distances else None
+
+    def margin(self, query_embedding, current_task: dict):
+        query = np.array([query_embedding], dtype="float32")
+        task_id = current_task["task_id"]
+
+        # Compare like with like: both sides use task vectors and step vectors
+        D, I = self.matcher.vectors.search_tasks(query, k=self.neighbours)
+
+        current_task_distance = None
+        others = []
+        for distance, idx in zip(D[0], I[0]):
+            if idx < 0:
+                continue
+            other_id = self.matcher.meta[idx]["task_id"]
+            if other_id == task_id:
+                current_task_distance = distance
+            else:
+                others.append(self.closest(query, other_id, distance))
+
+        current_distance = self.closest(query, task_id, current_task_distance)
+        if current_distance is None:
+            return None
+        if not others:
+            # No competing task among the neighbours: as far as the index can tell, it's on topic
+            return float("inf")
+        return float(min(others) - current_distance)
+
+    def is_shift(self, query: str, query_embedding, client, current_task: dict, current_step, logger) -> bool:
+        with logger.span("topic_shift", "🧭 Topic shift margin"):
+            margin = self.margin(query_embedding, current_task)
+
+        if margin is not None and margin > self.band_high:
+            verdict, counter = False, "local_confirm"
+        elif margin is not None and margin < self.band_low:
+            verdict, counter = True, "local_reject"
+        else:
+            with logger.span("mismatch_check", "🧭 LLM mismatch check"):
+                verdict = self.matcher.user_says_mismatch(query, client, current_task, current_step)
+            counter = "llm_fallback"
+
+        with self.lock:
+            self.counters[counter] += 1
+
+        margin_text = "n/a" if margin is None else f"{margin:.4f}"
+        logger.info(f"🧭 Topic shift: {'reject' if verdict else 'confirm'} via {counter} (margin {margin_text})")
+        return verdict
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        total = sum(stats.values())
+        stats["fallback_rate"] = stats["llm_fallback"] / total if total else 0.0
+        return stats
@@ -0,0 +1,216 @@
+import os
+import json
+import shutil
+import faiss
+import numpy as np
+from pathlib import Path
+
+BACKENDS = ("flat", "ivf", "hnsw")
+
+# Vectors of a saved index stay in the file and are paged in on demand, so every process
+# opening it shares one copy through the page cache. Older faiss maps only IVF lists.
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+LAYOUT_FILE = "layout.json"
+
+# Below this an IVF index can't be trained meaningfully and flat search is as fast anyway
+IVF_MIN_VECTORS = 1000
+
+
+class VectorIndex:
+    """
+    Task vectors and step vectors of every task in one subsystem.
+
+    Steps are stored contiguously per task, so a step row maps back to (task_id, position in task)
+    and a search restricted to one task reads only that task's slice. Both levels use the same
+    backend: exact flat search, IVF (coarse clustering, `nprobe` lists per query) or HNSW graphs.
+    """
+
+    def __init__(self, dim: int = 1536, backend: str = "flat", nlist: int = None, nprobe: int = 8,
+                 hnsw_m: int = 32, ef_search: int = 64):
+        if backend not in BACKENDS:
+            raise ValueError(f"❌ Unknown vector index backend: {backend}")
+        self.dim = dim
+        self.backend = backend
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+
+        self.task_ids = []
+        self.task_positions = {}
+        self.step_ranges = {}
+        self.step_owner = np.empty(0, dtype="int64")
+        self.task_index = None
+        self.step_index = None
+
+    @classmethod
+    def from_env(cls, dim: int = 1536):
+        nlist = os.getenv("VECTOR_INDEX_NLIST")
+        return cls(
+            dim=dim,
+            backend=os.getenv("VECTOR_INDEX_BACKEND", "flat"),
+            nlist=int(nlist) if nlist else None,
+            nprobe=int(os.getenv("VECTOR_INDEX_NPROBE", "8")),
+            hnsw_m=int(os.getenv("VECTOR_INDEX_HNSW_M", "32")),
+            ef_search=int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64")),
+        )
+
+    def _make_index(self, vectors: np.ndarray):
+        n = len(vectors)
+
+        if self.backend == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dim, self.hnsw_m)
+            index.hnsw.efSearch = self.ef_search
+        elif self.backend == "ivf" and n >= IVF_MIN_VECTORS:
+            # ~4*sqrt(n) lists, keeping at least 39 training points per list as faiss expects
+            nlist = self.nlist or max(1, min(int(4 * np.sqrt(n)), n // 39))
+            quantizer = faiss.IndexFlatL2(self.dim)
+            index = faiss.IndexIVFFlat(quantizer, self.dim, nlist)
+            index.train(vectors)
+            index.nprobe = min(self.nprobe, nlist)
+        else:
+            index = faiss.IndexFlatL2(self.dim)
+
+        index.add(vectors)
+        if isinstance(index, faiss.IndexIVF):
+            # Needed to reconstruct a task's step slice by row number
+            index.make_direct_map()
+        return index
+
+    def build(self, tasks):
+        """
+        tasks: iterable of (task_id, task_vector, step_vectors) with step_vectors shaped (n_steps, dim).
+        """
+        task_vectors, step_blocks, owners = [], [], []
+        self.task_ids, self.task_positions, self.step_ranges = [], {}, {}
+
+        row = 0
+        for position, (task_id, task_vector, step_vectors) in enumerate(tasks):
+            self.task_ids.append(task_id)
+            self.task_positions[task_id] = position
+            task_vectors.append(np.asarray(task_vector, dtype="float32"))
+
+            step_vectors = np.asarray(step_vectors, dtype="float32").reshape(-1, self.dim)
+            self.step_ranges[task_id] = (row, row + len(step_vectors))
+            step_blocks.append(step_vectors)
+            owners.append(np.full(len(step_vectors), position, dtype="int64"))
+            row += len(step_vectors)
+
+        self.task_index = self._make_index(np.stack(task_vectors) if task_vectors else np.empty((0, self.dim), "float32"))
+        self.step_index = self._make_index(np.concatenate(step_blocks) if step_blocks else np.empty((0, self.dim), "float32"))
+        self.step_owner = np.concatenate(owners) if owners else np.empty(0, dtype="int64")
+        return self
+
+    def save(self, directory: Path):
+        """Write both indexes and the task layout; the directory appears complete or not at all."""
+        directory = Path(directory)
+        tmp_dir = directory.with_name(f".{directory.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        faiss.write_index(self.task_index, str(tmp_dir / "tasks.faiss"))
+        faiss.write_index(self.step_index, str(tmp_dir / "steps.faiss"))
+        layout = {
+            "dim": self.dim,
+            "backend": self.backend,
+            "task_ids": self.task_ids,
+            "step_ranges": {task_id: list(rows) for task_id, rows in self.step_ranges.items()},
+        }
+        with open(tmp_dir / LAYOUT_FILE, "w", encoding="utf-8") as f:
+            json.dump(layout, f, ensure_ascii=False)
+        os.replace(tmp_dir, directory)
+        return self
+
+    def load(self, directory: Path, mmap: bool = True):
+        """Open an index written by save(), memory-mapped unless `mmap` is off. Search settings come from self."""
+        directory = Path(directory)
+        with open(directory / LAYOUT_FILE, encoding="utf-8") as f:
+            layout = json.load(f)
+        if layout["dim"] != self.dim or layout["backend"] != self.backend:
+            raise ValueError(f"❌ Saved index is {layout['backend']}/{layout['dim']}, expected {self.backend}/{self.dim}.")
+
+        flags = MMAP_FLAGS if mmap else 0
+        self.task_index = faiss.read_index(str(directory / "tasks.faiss"), flags)
+        self.step_index = faiss.read_index(str(directory / "steps.faiss"), flags)
+        for index in (self.task_index, self.step_index):
+            if isinstance(index, faiss.IndexHNSW):
+                index.hnsw.efSearch = self.ef_search
+            elif isinstance(index, faiss.IndexIVF):
+                index.nprobe = min(self.nprobe, index.nlist)
+
+        self.task_ids = layout["task_ids"]
+        self.task_positions = {task_id: position for position, task_id in enumerate(self.task_ids)}
+        self.step_ranges = {task_id: tuple(rows) for task_id, rows in layout["step_ranges"].items()}
+        owners = [np.full(end - start, self.task_positions[task_id], dtype="int64")
+                  for task_id, (start, end) in sorted(self.step_ranges.items(), key=lambda item: item[1][0])]
+        self.step_owner = np.concatenate(owners) if owners else np.empty(0, dtype="int64")
+        return self
+
+    @property
+    def ntasks(self):
+        return len(self.task_ids)
+
+    @property
+    def nsteps(self):
+        return len(self.step_owner)
+
+    def has_steps(self, task_id) -> bool:
+        start, end = self.step_ranges.get(task_id, (0, 0))
+        return end > start
+
+    def search_tasks(self, queries: np.ndarray, k: int = 1):
+        """(distances, task positions), both shaped (n_queries, k); missing hits are -1."""
+        queries = np.asarray(queries, dtype="float32").reshape(-1, self.dim)
+        return self.task_index.search(queries, min(k, max(self.ntasks, 1)))
+
+    def search_steps(self, queries: np.ndarray, k: int = 1, task_id=None):
+        """
+        Without task_id: global step search, returning step rows (see locate).
+        With task_id: exact search over that task's steps, returning positions within the task.
+        """
+        queries = np.asarray(queries, dtype="float32").reshape(-1, self.dim)
+
+        if task_id is None:
+            return self.step_index.search(queries, min(k, max(self.nsteps, 1)))
+
+        start, end = self.step_ranges.get(task_id, (0, 0))
+        n = end - start
+        if n <= 0:
+            return (np.full((len(queries), k), np.inf, dtype="float32"),
+                    np.full((len(queries), k), -1, dtype="int64"))
+
+        steps = self.step_index.reconstruct_n(start, n)
+        distances = (
+            (queries ** 2).sum(axis=1, keepdims=True)
+            - 2 * queries @ steps.T
+            + (steps ** 2).sum(axis=1)[None, :]
+        )
+        k = min(k, n)
+        order = np.argsort(distances, axis=1)[:, :k]
+        return np.take_along_axis(distances, order, axis=1).astype("float32"), order.astype("int64")
+
+    def search_steps_grouped(self, queries: np.ndarray, task_ids, k: int = 1):
+        """
+        Exact search of each query over the steps of its own task (task_ids[i], None to skip).
+        Queries of the same task share one matrix product. Returns (distances, positions within
+        the task), both shaped (n_queries, k); missing hits are inf / -1.
+        """
+        queries = np.asarray(queries, dtype="float32").reshape(-1, self.dim)
+        distances = np.full((len(queries), k), np.inf, dtype="float32")
+        positions = np.full((len(queries), k), -1, dtype="int64")
+
+        groups = {}
+        for i, task_id in enumerate(task_ids):
+            if task_id is not None and self.has_steps(task_id):
+                groups.setdefault(task_id, []).append(i)
+
+        for task_id, rows in groups.items():
+            D, I = self.search_steps(queries[rows], k=k, task_id=task_id)
+            distances[rows, :D.shape[1]] = D
+            positions[rows, :I.shape[1]] = I
+        return distances, positions
+
+    def locate(self, step_row: int):
+        """(task_id, position within task) for a global step row."""
+        task_id = self.task_ids[self.step_owner[step_row]]
+        return task_id, int(step_row - self.step_ranges[task_id][0])
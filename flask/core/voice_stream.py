@@ -0,0 +1,262 @@
+import io
+import os
+import json
+import wave
+import base64
+import binascii
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+from utils.metrics import metrics
+from utils.vision import image_preparer
+
+SAMPLE_WIDTH = 2   # 16-bit little-endian mono PCM
+MAX_PENDING_IMAGES = int(os.getenv("VISION_MAX_IMAGES", "5"))
+# Rates an AudioContext commonly runs at; Whisper takes WAV at any of them
+SAMPLE_RATES = (8000, 16000, 22050, 24000, 32000, 44100, 48000)
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int):
+    """Seekable WAV file around raw PCM, ready for Whisper."""
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    out.seek(0)
+    return out
+
+
+class VoiceActivityDetector:
+    """
+    Energy-based start and end of utterance on a stream of 16-bit mono PCM.
+
+    Audio is cut into `frame_ms` frames. A frame is speech when its level is `margin_db` above
+    the noise floor, which follows quiet frames quickly and loud ones slowly. An utterance starts
+    after `start_ms` of speech (keeping `preroll_ms` before it, so the first syllable is not cut)
+    and ends after `end_silence_ms` of non-speech or at `max_utterance_s`. Utterances with less
+    than `min_speech_ms` of speech are dropped as clicks and coughs.
+    """
+
+    def __init__(self, sample_rate: int = 16000, frame_ms: int = 20, margin_db: float = 12.0, min_db: float = -50.0,
+                 start_ms: int = 60, end_silence_ms: int = 700, preroll_ms: int = 300,
+                 max_utterance_s: float = 15.0, min_speech_ms: int = 250):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_bytes = sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.end_frames = max(1, end_silence_ms // frame_ms)
+        self.max_frames = int(max_utterance_s * 1000 // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.preroll = deque(maxlen=max(self.start_frames, preroll_ms // frame_ms))
+        self.reset()
+
+    @classmethod
+    def from_env(cls, sample_rate: int = 16000):
+        return cls(
+            sample_rate=sample_rate,
+            margin_db=float(os.getenv("VAD_MARGIN_DB", "12")),
+            min_db=float(os.getenv("VAD_MIN_DB", "-50")),
+            end_silence_ms=int(os.getenv("VAD_END_SILENCE_MS", "700")),
+            preroll_ms=int(os.getenv("VAD_PREROLL_MS", "300")),
+            max_utterance_s=float(os.getenv("VAD_MAX_UTTERANCE_S", "15")),
+            min_speech_ms=int(os.getenv("VAD_MIN_SPEECH_MS", "250")),
+        )
+
+    def reset(self):
+        self.pending = b""
+        self.noise_db = None
+        self.speaking = False
+        self.speech_run = 0
+        self.silence_run = 0
+        self.voiced = 0
+        self.utterance = []
+        self.preroll.clear()
+
+    def levels(self, frames: bytes):
+        """dBFS of each complete frame."""
+        samples = np.frombuffer(frames, dtype="<i2").astype(np.float32).reshape(-1, self.frame_bytes // SAMPLE_WIDTH)
+        rms = np.sqrt(np.mean(samples * samples, axis=1)) / 32768.0
+        return 20.0 * np.log10(rms + 1e-9)
+
+    def feed(self, pcm: bytes):
+        """
+        Events for a chunk of audio: ("start", None), then ("speech", None) once the utterance has
+        `min_speech_ms` of speech, then ("end", utterance PCM), or ("cancel", None) if it never had.
+        """
+        data = self.pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self.pending = data[usable:]
+        if not usable:
+            return []
+
+        events = []
+        for i, level in enumerate(self.levels(data[:usable])):
+            frame = data[i * self.frame_bytes:(i + 1) * self.frame_bytes]
+            if self.noise_db is None:
+                self.noise_db = level
+            speech = level > max(self.min_db, self.noise_db + self.margin_db)
+            if not speech:
+                # Down to quiet quickly, up to louder background slowly
+                self.noise_db += (level - self.noise_db) * (0.3 if level < self.noise_db else 0.02)
+
+            if not self.speaking:
+                self.preroll.append(frame)
+                self.speech_run = self.speech_run + 1 if speech else 0
+                if self.speech_run >= self.start_frames:
+                    self.speaking = True
+                    self.utterance = list(self.preroll)
+                    self.voiced = self.speech_run
+                    self.silence_run = 0
+                    self.preroll.clear()
+                    events.append(("start", None))
+                    if self.voiced >= self.min_speech_frames:
+                        events.append(("speech", None))
+                continue
+
+            self.utterance.append(frame)
+            if speech:
+                self.voiced += 1
+                self.silence_run = 0
+                if self.voiced == self.min_speech_frames:
+                    events.append(("speech", None))
+            else:
+                self.silence_run += 1
+
+            if self.silence_run >= self.end_frames or len(self.utterance) >= self.max_frames:
+                # Most of the trailing silence is left out of the upload
+                keep = len(self.utterance) - max(0, self.silence_run - self.start_frames * 2)
+                utterance = b"".join(self.utterance[:keep])
+                enough = self.voiced >= self.min_speech_frames
+                events.append(("end", utterance) if enough else ("cancel", None))
+                self.speaking = False
+                self.speech_run = 0
+                self.utterance = []
+        return events
+
+
+class VoiceConnection:
+    """
+    One full-duplex voice WebSocket.
+
+    The client sends binary frames of 16-bit mono PCM while the user talks, and JSON control
+    messages: {"type": "start", "sample_rate": n} and {"type": "image", "data": base64 JPEG}.
+    The receive loop only runs the VAD and never waits on a reply. Finished utterances go to a
+    worker thread running `run_turn(session_id, wav, images)`, a generator of JSON
+    events and MP3 chunks, which are sent back on the same socket as they come. Speech starting
+    while a reply is in flight interrupts it, once there is enough of it not to be a click.
+    """
+
+    def __init__(self, ws, session_id, run_turn, logger, sample_rate: int = 16000):
+        self.ws = ws
+        self.session_id = session_id
+        self.run_turn = run_turn
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.vad = VoiceActivityDetector.from_env(sample_rate)
+        self.turns = queue.Queue()
+        self.images = deque(maxlen=MAX_PENDING_IMAGES)
+        self.interrupted = threading.Event()
+        self.replying = False
+        self.send_lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        if isinstance(message, dict):
+            message = json.dumps(message, ensure_ascii=False)
+        with self.send_lock:
+            if not self.closed:
+                self.ws.send(message)
+
+    def serve(self):
+        metrics.inc("voice_connections_total")
+        worker = threading.Thread(target=self._work, name=f"voice-{self.session_id[:8]}", daemon=True)
+        worker.start()
+        try:
+            self.send({"type": "ready", "sample_rate": self.sample_rate})
+            while True:
+                message = self.ws.receive()
+                if message is None:
+                    continue
+                if isinstance(message, str):
+                    self._control(message)
+                else:
+                    self._audio(message)
+        finally:
+            self.closed = True
+            self.interrupted.set()
+            self.turns.put(None)
+
+    def _control(self, raw: str):
+        """Applies a control message; a malformed one gets an error event and the socket stays up."""
+        try:
+            message = json.loads(raw)
+        except ValueError:
+            return self._reject("Control messages must be JSON")
+        if not isinstance(message, dict):
+            return self._reject("Control messages must be JSON objects")
+
+        kind = message.get("type")
+        if kind == "start":
+            sample_rate = message.get("sample_rate", self.sample_rate)
+            if sample_rate not in SAMPLE_RATES:
+                # Keeps the current rate; 0 or garbage would break the VAD's framing
+                return self._reject(f"Unsupported sample_rate {sample_rate!r}, expected one of {list(SAMPLE_RATES)}")
+            self.sample_rate = int(sample_rate)
+            self.vad = VoiceActivityDetector.from_env(self.sample_rate)
+        elif kind == "image":
+            try:
+                content = base64.b64decode(message.get("data") or "", validate=True)
+            except (binascii.Error, TypeError, ValueError):
+                return self._reject("Image data must be base64")
+            # Prepared on the shared vision pool while the user is still talking
+            self.images.append(image_preparer.submit(content))
+
+    def _reject(self, error: str):
+        metrics.inc("voice_rejected_messages_total")
+        self.send({"type": "error", "error": error})
+
+    def _audio(self, pcm: bytes):
+        for event, utterance in self.vad.feed(pcm):
+            if event == "start":
+                self.send({"type": "speech_start"})
+            elif event == "speech":
+                if self.replying:
+                    self.interrupted.set()
+                    metrics.inc("voice_interruptions_total")
+                    self.send({"type": "interrupt"})
+            elif event == "cancel":
+                self.send({"type": "speech_cancel"})
+            else:
+                metrics.inc("voice_utterances_total")
+                self.send({"type": "speech_end", "seconds": round(len(utterance) / SAMPLE_WIDTH / self.sample_rate, 2)})
+                images = list(self.images)
+                self.images.clear()
+                self.turns.put((pcm_to_wav(utterance, self.sample_rate), images))
+
+    def _work(self):
+        while True:
+            turn = self.turns.get()
+            if turn is None or self.closed:
+                return
+
+            wav, images = turn
+            self.interrupted.clear()
+            self.replying = True
+            events = self.run_turn(self.session_id, wav, images)
+            try:
+                for event in events:
+                    if self.interrupted.is_set():
+                        break
+                    self.send(event)
+            except Exception as e:
+                self.logger.exception(f"⚠️ Voice reply failed: {e}")
+            finally:
+                events.close()
+                self.replying = False
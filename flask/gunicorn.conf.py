@@ -0,0 +1,41 @@
+# Production server: gunicorn -c gunicorn.conf.py app:app
+# app.py's own app.run() is the development server and stays for local runs.
+import os
+
+bind = f"0.0.0.0:{os.getenv('FLASK_SERVER_PORT', '9091')}"
+
+# Requests mostly wait on OpenAI, so each worker runs many threads; more workers spread the
+# CPU-bound parts (matching, JSON, logging) over cores. A voice socket holds one thread while open.
+workers = int(os.getenv("WEB_WORKERS", str(min(4, os.cpu_count() or 1))))
+threads = int(os.getenv("WEB_THREADS", "32"))
+worker_class = "gthread"
+
+# Streamed replies and voice sockets outlive any request timeout; gthread workers keep
+# heartbeating while their threads wait, so this only catches a stuck worker.
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# Heartbeat files on tmpfs: a slow container disk can't stall workers
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Not preloaded: importing the app starts threads (log writer, index watcher, worker pools) and
+# opens OpenAI and Redis connections, none of which survive a fork. Each worker imports it; the
+# vector index is memory-mapped from model/vector/packed/, so workers share one copy anyway.
+preload_app = False
+
+# Every worker has its own log writer: in-process size rotation would have them rename the file
+# under each other and lose records. Logs go to stdout for the container runtime to collect;
+# LOG_FILE_ROTATION=external keeps main.log too, for a host where logrotate moves it.
+os.environ.setdefault("LOG_FILE_ROTATION", "off")
+
+
+def on_starting(server):
+    if workers > 1 and os.getenv("SESSION_BACKEND", "memory") != "redis":
+        raise RuntimeError("❌ Several workers need shared sessions: set SESSION_BACKEND=redis")
+
+
+def post_worker_init(worker):
+    # The worker has imported the app by now
+    from app import start_canned_speech_preload
+    start_canned_speech_preload()
+    worker.log.info(f"✅ Worker {worker.pid} ready")
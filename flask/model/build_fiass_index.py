@@ -1,64 +1,132 @@
 import os
 import json
+import time
+import hashlib
 import faiss
 import numpy as np
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import openai
 
 # --- CONFIG ---
 OPENAI_API_KEY="sk-proj-..."
 openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBED_BATCH_SIZE = 256      # texts per embeddings.create call
+EMBED_CONCURRENCY = 4       # batches in flight at once
+
 INSTRUCTIONS_DIR = Path("instructions")
 VECTOR_DIR = Path("vector")
 VECTOR_DIR.mkdir(exist_ok=True)
 
 TASK_INDEX_FILE = VECTOR_DIR / "task_index.faiss"
 TASK_META_FILE = VECTOR_DIR / "task_meta.json"
-
-# --- EMBEDDING FUNCTION ---
-def get_text_vector(text: str) -> np.ndarray:
-    """Get text embedding vector using OpenAI ADA model (1536-dim)"""
-    embedding = openai_client.embeddings.create(
-        input=[text],
-        model="text-embedding-ada-002"
+# Content hashes of everything embedded in the current outputs, so reruns only embed what changed
+MANIFEST_FILE = VECTOR_DIR / "manifest.json"
+
+# --- HASHING ---
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def signature(*parts) -> str:
+    return text_hash(json.dumps(parts, ensure_ascii=False, sort_keys=True))
+
+# --- EMBEDDING FUNCTIONS ---
+def embed_batch(texts: list) -> list:
+    """Embed one batch of texts using OpenAI ADA model (1536-dim)"""
+    response = openai_client.embeddings.create(
+        input=texts,
+        model=EMBEDDING_MODEL
     )
-    return np.array(embedding.data[0].embedding, dtype="float32")
-
-# --- BUILD GLOBAL TASK VECTOR ---
-def build_task_vector(task_json: dict) -> np.ndarray:
-    base_text = task_json["title"] + "\n" + task_json["intro"]
-    return get_text_vector(base_text)
-
-# --- BUILD PER-TASK STEP VECTORS ---
-def build_step_vectors(task_json: dict):
-    steps = task_json.get("steps", [])
-    vectors = []
-    meta = []
-
-    for step in steps:
+    return [np.array(item.embedding, dtype="float32") for item in response.data]
+
+def embed_texts(texts: list) -> dict:
+    """Embed texts in large batches with bounded concurrency, returning {text_hash: vector}"""
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    vectors = {}
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+        for batch, embedded in zip(batches, executor.map(embed_batch, batches)):
+            for text, vec in zip(batch, embedded):
+                vectors[text_hash(text)] = vec
+    return vectors
+
+# --- TEXTS TO EMBED ---
+def task_text(task_json: dict) -> str:
+    return task_json["title"] + "\n" + task_json["intro"]
+
+def step_entries(task_json: dict):
+    """(text, meta) for every step with text"""
+    entries = []
+    for step in task_json.get("steps", []):
         text = step.get("text", "").strip()
         if not text:
             continue
-
-        vec = get_text_vector(text)
-        vectors.append(vec)
-        meta.append({
+        entries.append((text, {
             "step_num": step.get("step_num", 0),
             "text": text,
             "summary": step.get("summary", ""),
             "keywords": step.get("keywords", []),
             "images": step.get("images", [])
-        })
-
-    return vectors, meta
-
-# --- MAIN RUN ---
-def run():
-    task_vectors = []
-    task_metadata = []
-
-    for task_folder in INSTRUCTIONS_DIR.iterdir():
+        }))
+    return entries
+
+# --- ATOMIC OUTPUT ---
+def atomic_write_json(path: Path, data):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def atomic_write_index(index, path: Path):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, path)
+
+def remove_stale_step_files(live_task_ids: set) -> int:
+    """Delete step outputs of tasks that were removed or have no steps left"""
+    live = {name for task_id in live_task_ids for name in (f"steps_{task_id}.faiss", f"steps_{task_id}_meta.json")}
+    removed = 0
+    for path in list(VECTOR_DIR.glob("steps_*.faiss")) + list(VECTOR_DIR.glob("steps_*_meta.json")):
+        if path.name not in live:
+            path.unlink()
+            removed += 1
+            print(f"🗑 Removed stale {path.name}")
+    return removed
+
+def build_index(vectors: list):
+    index = faiss.IndexFlatL2(1536)
+    index.add(np.stack(vectors))
+    return index
+
+# --- PREVIOUS RUN ---
+def load_manifest() -> dict:
+    if not MANIFEST_FILE.exists():
+        return {}
+    with open(MANIFEST_FILE, encoding="utf-8") as f:
+        manifest = json.load(f)
+    # Vectors from another model can't be reused
+    return manifest if manifest.get("model") == EMBEDDING_MODEL else {}
+
+def read_vectors(path: Path, hashes: list) -> dict:
+    if not path.exists() or not hashes:
+        return {}
+    index = faiss.read_index(str(path))
+    if index.ntotal != len(hashes):
+        return {}
+    return dict(zip(hashes, index.reconstruct_n(0, index.ntotal)))
+
+def load_known_vectors(manifest: dict) -> dict:
+    """{text_hash: vector} recovered from the outputs the manifest describes"""
+    tasks = manifest.get("tasks", {})
+    known = read_vectors(TASK_INDEX_FILE, [tasks[task_id]["task_hash"] for task_id in manifest.get("order", [])])
+    for task_id, entry in tasks.items():
+        known.update(read_vectors(VECTOR_DIR / f"steps_{task_id}.faiss", entry["step_hashes"]))
+    return known
+
+def load_tasks() -> list:
+    tasks = []
+    for task_folder in sorted(INSTRUCTIONS_DIR.iterdir()):
         if not task_folder.is_dir():
             continue
 
@@ -68,64 +136,95 @@ def run():
             continue
 
         with open(json_file, encoding="utf-8") as f:
-            task = json.load(f)
-
-        # --- Build Global Task Vector ---
-        try:
-            task_vec = build_task_vector(task)
-            task_vectors.append(task_vec)
-            task_metadata.append({
-                "task_id": task["task_id"],
-                "title": task["title"],
-                "intro": task["intro"],
-                "steps": task["steps"]
-            })
-            print(f"✅ Embedded TASK: {task['title']}")
-        except Exception as e:
-            print(f"❌ Failed task embedding {task_folder.name}: {e}")
-            continue
-
-        # --- Build Step-level FAISS ---
-        try:
-            step_vectors, step_meta = build_step_vectors(task)
-            if not step_vectors:
-                print(f"⚠️ No steps found for {task['task_id']}")
-                continue
-
-            step_index = faiss.IndexFlatL2(1536)
-            step_index.add(np.stack(step_vectors))
-
-            step_faiss_path = VECTOR_DIR / f"steps_{task['task_id']}.faiss"
-            step_meta_path = VECTOR_DIR / f"steps_{task['task_id']}_meta.json"
-
-            faiss.write_index(step_index, str(step_faiss_path))
-            with open(step_meta_path, "w", encoding="utf-8") as f:
-                json.dump(step_meta, f, ensure_ascii=False, indent=2)
-
-            print(f"✅ Embedded STEPS for {task['task_id']}")
-
-        except Exception as e:
-            print(f"❌ Failed step embedding for {task_folder.name}: {e}")
-            continue
+            tasks.append(json.load(f))
+    return tasks
 
-    # --- Save Global TASK FAISS ---
-    if not task_vectors:
+# --- MAIN RUN ---
+def run():
+    started = time.time()
+    tasks = load_tasks()
+    if not tasks:
         print("❌ No valid tasks found. Exiting.")
         return
 
-    dim = task_vectors[0].shape[0]
-    if dim != 1536:
-        raise ValueError(f"Expected 1536-dim embeddings, got {dim}")
+    manifest = load_manifest()
+    known = load_known_vectors(manifest)
+
+    # --- Embed only texts not seen in the previous run ---
+    all_texts = {}
+    for task in tasks:
+        all_texts[text_hash(task_text(task))] = task_text(task)
+        for text, _ in step_entries(task):
+            all_texts[text_hash(text)] = text
 
-    task_index = faiss.IndexFlatL2(dim)
-    task_index.add(np.stack(task_vectors))
+    missing = [text for h, text in all_texts.items() if h not in known]
+    print(f"🧮 {len(all_texts)} texts, {len(all_texts) - len(missing)} reused, {len(missing)} to embed")
+    if missing:
+        known.update(embed_texts(missing))
 
-    faiss.write_index(task_index, str(TASK_INDEX_FILE))
-    with open(TASK_META_FILE, "w", encoding="utf-8") as f:
-        json.dump(task_metadata, f, ensure_ascii=False, indent=2)
+    new_manifest = {"model": EMBEDDING_MODEL, "order": [], "tasks": {}}
+    task_vectors = []
+    task_metadata = []
+    tasks_with_steps = set()
+    written = 0
+
+    for task in tasks:
+        task_id = task["task_id"]
+        previous = manifest.get("tasks", {}).get(task_id, {})
+
+        task_vectors.append(known[text_hash(task_text(task))])
+        task_metadata.append({
+            "task_id": task_id,
+            "title": task["title"],
+            "intro": task["intro"],
+            "steps": task["steps"]
+        })
 
-    print(f"\n✅ Global TASK index saved to {TASK_INDEX_FILE}")
-    print(f"✅ Global TASK metadata saved to {TASK_META_FILE}")
+        # --- Step-level FAISS, rewritten only when its content changed ---
+        entries = step_entries(task)
+        step_hashes = [text_hash(text) for text, _ in entries]
+        step_meta = [meta for _, meta in entries]
+        steps_signature = signature(step_hashes, step_meta)
+
+        step_faiss_path = VECTOR_DIR / f"steps_{task_id}.faiss"
+        step_meta_path = VECTOR_DIR / f"steps_{task_id}_meta.json"
+
+        if entries:
+            tasks_with_steps.add(task_id)
+
+        if not entries:
+            print(f"⚠️ No steps found for {task_id}")
+        elif previous.get("steps_signature") != steps_signature or not step_faiss_path.exists() or not step_meta_path.exists():
+            atomic_write_index(build_index([known[h] for h in step_hashes]), step_faiss_path)
+            atomic_write_json(step_meta_path, step_meta)
+            written += 2
+            print(f"✅ Embedded STEPS for {task_id}")
+
+        new_manifest["order"].append(task_id)
+        new_manifest["tasks"][task_id] = {
+            "task_hash": text_hash(task_text(task)),
+            "step_hashes": step_hashes,
+            "steps_signature": steps_signature
+        }
+
+    # --- Save Global TASK FAISS, rewritten only when any task changed ---
+    tasks_signature = signature(new_manifest["order"], [new_manifest["tasks"][t]["task_hash"] for t in new_manifest["order"]], task_metadata)
+    new_manifest["tasks_signature"] = tasks_signature
+
+    if manifest.get("tasks_signature") != tasks_signature or not TASK_INDEX_FILE.exists() or not TASK_META_FILE.exists():
+        atomic_write_json(TASK_META_FILE, task_metadata)
+        atomic_write_index(build_index(task_vectors), TASK_INDEX_FILE)
+        written += 2
+        print(f"\n✅ Global TASK index saved to {TASK_INDEX_FILE}")
+        print(f"✅ Global TASK metadata saved to {TASK_META_FILE}")
+
+    # After the task index stops referring to them, before the manifest marks the rebuild done
+    removed = remove_stale_step_files(tasks_with_steps)
+
+    # Left untouched on a no-op build: its mtime is part of the signature the app reloads on
+    if new_manifest != manifest:
+        atomic_write_json(MANIFEST_FILE, new_manifest)
+    print(f"\n⏱️ Rebuild done in {time.time() - started:.2f} sec, {written} files written, {removed} removed")
 
 if __name__ == "__main__":
     run()
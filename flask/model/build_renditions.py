@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+
+# --- CONFIG ---
+INSTRUCTIONS_DIR = Path("instructions")
+RENDITIONS_DIR = Path("renditions")
+MANIFEST_FILE = RENDITIONS_DIR / "manifest.json"
+RENDITION_WORKERS = int(os.getenv("RENDITION_WORKERS", str(os.cpu_count() or 1)))
+
+# variant -> (max width, WebP quality). Part of every file's hash, so changing them renames the files
+VARIANTS = {
+    "full": (1600, 82),
+    "thumb": (320, 75),
+}
+
+# --- HASHING ---
+def rendition_name(source_hash: str, variant: str) -> str:
+    width, quality = VARIANTS[variant]
+    digest = hashlib.sha256(f"{source_hash}\0{variant}\0{width}\0{quality}".encode("utf-8")).hexdigest()[:16]
+    return f"{digest}.webp" if variant == "full" else f"{digest}.{variant}.webp"
+
+# --- RENDERING ---
+def atomic_save(image, path: Path, quality: int):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    image.save(tmp_path, format="WEBP", quality=quality, method=6)
+    os.replace(tmp_path, path)
+
+def render_image(source: Path) -> dict:
+    """{variant: {file, width, height, bytes}} for one instruction image; existing files are reused"""
+    source_hash = hashlib.sha256(source.read_bytes()).hexdigest()
+    names = {variant: rendition_name(source_hash, variant) for variant in VARIANTS}
+
+    image = None
+    renditions = {}
+    for variant, (max_width, quality) in VARIANTS.items():
+        path = RENDITIONS_DIR / names[variant]
+        if not path.exists():
+            if image is None:
+                image = Image.open(source)
+                image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+            rendition = image
+            if image.width > max_width:
+                rendition = image.resize((max_width, round(image.height * max_width / image.width)), Image.LANCZOS)
+            atomic_save(rendition, path, quality)
+
+        with Image.open(path) as saved:
+            width, height = saved.size
+        renditions[variant] = {"file": names[variant], "width": width, "height": height, "bytes": path.stat().st_size}
+    return renditions
+
+# --- TASKS ---
+def load_task_images() -> dict:
+    """{task_id: {image_name: source path}} for images referenced by steps"""
+    tasks = {}
+    for task_folder in sorted(INSTRUCTIONS_DIR.iterdir()):
+        json_file = task_folder / "structured_output.json"
+        if not json_file.exists():
+            continue
+
+        with open(json_file, encoding="utf-8") as f:
+            task = json.load(f)
+
+        images = {}
+        for step in task.get("steps", []):
+            for name in step.get("images", []):
+                source = task_folder / "img" / name
+                if source.exists():
+                    images[name] = source
+                else:
+                    print(f"⚠️ {task['task_id']}: missing {name}")
+        tasks[task["task_id"]] = images
+    return tasks
+
+def atomic_write_json(path: Path, data):
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+# --- MAIN RUN ---
+def run():
+    started = time.time()
+    RENDITIONS_DIR.mkdir(exist_ok=True)
+    tasks = load_task_images()
+    sources = [(task_id, name, source) for task_id, images in tasks.items() for name, source in images.items()]
+    if not sources:
+        print("❌ No instruction images found. Exiting.")
+        return
+
+    manifest = {"variants": list(VARIANTS), "tasks": {task_id: {} for task_id in tasks}}
+    with ProcessPoolExecutor(max_workers=max(1, min(RENDITION_WORKERS, len(sources)))) as executor:
+        for (task_id, name, source), renditions in zip(sources, executor.map(render_image, [s for *_, s in sources])):
+            manifest["tasks"][task_id][name] = renditions
+
+    # Files no longer referenced belong to changed or removed images
+    referenced = {r["file"] for images in manifest["tasks"].values() for image in images.values() for r in image.values()}
+    removed = 0
+    for path in RENDITIONS_DIR.glob("*.webp"):
+        if path.name not in referenced:
+            path.unlink()
+            removed += 1
+
+    atomic_write_json(MANIFEST_FILE, manifest)
+
+    source_bytes = sum(source.stat().st_size for *_, source in sources)
+    full_bytes = sum(image["full"]["bytes"] for images in manifest["tasks"].values() for image in images.values())
+    thumb_bytes = sum(image["thumb"]["bytes"] for images in manifest["tasks"].values() for image in images.values())
+    print(f"🖼 {len(sources)} images: {source_bytes / 1e6:.1f} MB PNG → {full_bytes / 1e6:.1f} MB WebP, "
+          f"{thumb_bytes / 1e6:.2f} MB thumbnails; {removed} stale files removed")
+    print(f"⏱️ Renditions done in {time.time() - started:.2f} sec")
+
+if __name__ == "__main__":
+    run()
@@ -1,6 +1,10 @@
 import os
 import json
+import time
+import shutil
+import hashlib
 from zipfile import ZipFile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from lxml import etree
 from docx import Document
 from pathlib import Path
@@ -12,7 +16,14 @@ OPENAI_API_KEY="sk-proj-..."
 RAW_DIR = Path("raw")
 OUT_DIR = Path("instructions")
 MODEL = "gpt-4-turbo"
+ENTRY_LINE_MODEL = "gpt-4"
 MAX_TOKENS = 2400
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+
+# GPT answers per document, so unchanged documents skip both calls on the next run
+GPT_CACHE_DIR = Path("cache") / "gpt"
+# Bump to invalidate cached answers even when prompts and models are unchanged
+PROMPT_VERSION = "1"
 KEY_LINE_PROMPT = """
 Ты анализируешь внутреннюю инструкцию компании, написанную на русском языке.
 
@@ -59,6 +70,46 @@ steps.keywords - добавляй основные ключи, 3-6 ключей.
 
 openai_client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
+# Cached answers are only valid for the same prompts, models and generation settings
+PROMPT_HASH = hashlib.sha256(json.dumps(
+    [PROMPT_VERSION, KEY_LINE_PROMPT, ENTRY_LINE_MODEL, MAIN_PROMPT, MODEL, MAX_TOKENS],
+    ensure_ascii=False
+).encode("utf-8")).hexdigest()[:16]
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def atomic_write_json(path, data):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+def payload_hash(payload):
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+# --- GPT CACHE ---
+def cache_path(input_hash, stage):
+    return GPT_CACHE_DIR / f"{input_hash}.{PROMPT_HASH}.{stage}.json"
+
+def cached_gpt(input_hash, stage, call):
+    """Answer of `call()` for this input and prompt version, from disk if already asked"""
+    path = cache_path(input_hash, stage)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["answer"], True
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    answer = call()
+    os.makedirs(GPT_CACHE_DIR, exist_ok=True)
+    atomic_write_json(path, {"answer": answer})
+    return answer, False
+
 def extract_text(docx_path):
     doc = Document(docx_path)
     return "\n".join(p.text.strip() for p in doc.paragraphs if p.text.strip())
@@ -66,48 +117,60 @@ def extract_text(docx_path):
 def detect_entry_line(docx_path):
     text = extract_text(docx_path)
     response = openai_client.chat.completions.create(
-        model="gpt-4",
+        model=ENTRY_LINE_MODEL,
         messages=[{"role": "system", "content": KEY_LINE_PROMPT},
                   {"role": "user", "content": text}]
     )
     return response.choices[0].message.content.strip()
 
+def structure_steps(payload):
+    response = openai_client.chat.completions.create(
+        model=MODEL,
+        max_tokens=MAX_TOKENS,
+        temperature=0.2,
+        messages=[
+            {"role": "system", "content": MAIN_PROMPT},
+            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
+        ]
+    )
+    return response.choices[0].message.content.strip()
+
 def parse_docx_to_elements(docx_path, img_dir):
     elements = []
     os.makedirs(img_dir, exist_ok=True)
     with ZipFile(docx_path) as z:
         doc_xml = z.read("word/document.xml")
         rels_xml = z.read("word/_rels/document.xml.rels")
-        media = {n: z.read(n) for n in z.namelist() if n.startswith("word/media/")}
+        media = set(n for n in z.namelist() if n.startswith("word/media/"))
 
-    rels = etree.fromstring(rels_xml)
-    rel_map = {
-        r.attrib["Id"]: r.attrib["Target"]
-        for r in rels if r.attrib["Target"].startswith("media/")
-    }
+        rels = etree.fromstring(rels_xml)
+        rel_map = {
+            r.attrib["Id"]: r.attrib["Target"]
+            for r in rels if r.attrib["Target"].startswith("media/")
+        }
+
+        tree = etree.fromstring(doc_xml)
+        nsmap = tree.nsmap
+        body = tree.find(".//w:body", namespaces=nsmap)
 
-    tree = etree.fromstring(doc_xml)
-    nsmap = tree.nsmap
-    body = tree.find(".//w:body", namespaces=nsmap)
-
-    img_count = 0
-    for node in body:
-        if etree.QName(node).localname != "p":
-            continue
-        text = "".join(node.itertext()).strip()
-        if text:
-            elements.append({ "type": "normal", "text": text })
-
-        for blip in node.findall(".//a:blip", namespaces=nsmap):
-            rId = blip.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed")
-            filename = rel_map.get(rId)
-            if filename:
-                img_bytes = media.get("word/" + filename)
-                img_name = f"image_{img_count}.png"
-                with open(img_dir / img_name, "wb") as f:
-                    f.write(img_bytes)
-                elements.append({ "type": "image", "placeholder": img_name })
-                img_count += 1
+        img_count = 0
+        for node in body:
+            if etree.QName(node).localname != "p":
+                continue
+            text = "".join(node.itertext()).strip()
+            if text:
+                elements.append({ "type": "normal", "text": text })
+
+            for blip in node.findall(".//a:blip", namespaces=nsmap):
+                rId = blip.attrib.get("{http://schemas.openxmlformats.org/officeDocument/2006/relationships}embed")
+                filename = rel_map.get(rId)
+                if filename and "word/" + filename in media:
+                    img_name = f"image_{img_count}.png"
+                    # Stream one image at a time from the archive instead of holding all media in memory
+                    with z.open("word/" + filename) as src, open(img_dir / img_name, "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                    elements.append({ "type": "image", "placeholder": img_name })
+                    img_count += 1
 
     return elements
 
@@ -121,37 +184,39 @@ def merge_images_to_previous(elements):
     return steps
 
 def process_docx(docx_path):
+    """Runs in a worker process; returns (task_id, ok, timings) for the summary"""
+    started = time.time()
+    timings = {}
     task_id = docx_path.stem
     task_dir = OUT_DIR / task_id
     img_dir = task_dir / "img"
     os.makedirs(task_dir, exist_ok=True)
 
     print(f"📄 Processing {task_id}...")
-    elements = parse_docx_to_elements(docx_path, img_dir)
+    doc_hash = file_hash(docx_path)
 
-    with open(task_dir / "docx_parsed.json", "w", encoding="utf-8") as f:
-        json.dump(elements, f, ensure_ascii=False, indent=2)
+    t = time.time()
+    elements = parse_docx_to_elements(docx_path, img_dir)
+    atomic_write_json(task_dir / "docx_parsed.json", elements)
+    timings["parse"] = time.time() - t
 
-    entry_line = detect_entry_line(docx_path)
+    t = time.time()
+    entry_line, timings["entry_cached"] = cached_gpt(doc_hash, "entry", lambda: detect_entry_line(docx_path))
+    timings["entry"] = time.time() - t
 
     split_index = next((i for i, el in enumerate(elements) if el.get("text") == entry_line), 0)
     intro = "\n".join(el["text"] for el in elements[:split_index] if el["type"] == "normal")
 
     steps = merge_images_to_previous(elements[split_index:])
     payload = { "intro": intro, "steps": steps }
-    print("🤖 Calling GPT for structure...")
-    
-    response = openai_client.chat.completions.create(
-        model=MODEL,
-        max_tokens=MAX_TOKENS,
-        temperature=0.2,
-        messages=[
-            {"role": "system", "content": MAIN_PROMPT},
-            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)}
-        ]
-    )
+    # Keyed by what is actually sent: the same document split at another entry line is a new question
+    structure_hash = payload_hash(payload)
 
-    text = response.choices[0].message.content.strip()
+    t = time.time()
+    text, timings["structure_cached"] = cached_gpt(structure_hash, "structure", lambda: structure_steps(payload))
+    timings["structure"] = time.time() - t
+    if not timings["structure_cached"]:
+        print(f"🤖 Called GPT for structure of {task_id}")
 
     # Soft validation and trim fallback
     if text.startswith("```json"):
@@ -162,18 +227,47 @@ def process_docx(docx_path):
         if last_valid != -1:
             text = text[:last_valid+1] + "\n  ]\n}"
 
+    ok = True
     try:
         structured = json.loads(text)
-        with open(task_dir / "structured_output.json", "w", encoding="utf-8") as f:
-            json.dump(structured, f, ensure_ascii=False, indent=2)
+        atomic_write_json(task_dir / "structured_output.json", structured)
         print(f"✅ Saved to {task_dir}/structured_output.json")
     except json.JSONDecodeError:
+        # Don't keep an answer that can't be used, the next run should ask again
+        cache_path(structure_hash, "structure").unlink(missing_ok=True)
         print(f"❌ GPT returned invalid JSON for {task_id}")
         print(text)
+        ok = False
+
+    timings["total"] = time.time() - started
+    return task_id, ok, timings
 
 def run():
-    for docx_file in RAW_DIR.glob("*.docx"):
-        process_docx(docx_file)
+    started = time.time()
+    docx_files = sorted(RAW_DIR.glob("*.docx"))
+    if not docx_files:
+        print("❌ No .docx files found. Exiting.")
+        return
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, min(INGEST_WORKERS, len(docx_files)))) as executor:
+        futures = {executor.submit(process_docx, docx_file): docx_file for docx_file in docx_files}
+        for future in as_completed(futures):
+            try:
+                task_id, ok, timings = future.result()
+            except Exception as e:
+                print(f"❌ Failed {futures[future].stem}: {e}")
+                failed += 1
+                continue
+
+            failed += not ok
+            cached = lambda stage: " (cached)" if timings[f"{stage}_cached"] else ""
+            print(f"⏱️ {task_id}: parse {timings['parse']:.2f}s, "
+                  f"entry line {timings['entry']:.2f}s{cached('entry')}, "
+                  f"structure {timings['structure']:.2f}s{cached('structure')}, "
+                  f"total {timings['total']:.2f}s")
+
+    print(f"\n⏱️ Ingested {len(docx_files) - failed}/{len(docx_files)} documents in {time.time() - started:.2f} sec")
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -0,0 +1,52 @@
+import os
+import sys
+import logging
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# The app imports its modules as top-level packages (core, utils) from the flask directory
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Module-level singletons read these on import: no network, no shared caches on disk
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["EMBED_CACHE_DIR"] = ""
+os.environ["TTS_CACHE_DIR"] = ""
+
+
+class FakeEmbeddingsClient:
+    """Stands in for OpenAIClient: call() runs the request against canned embeddings."""
+
+    def __init__(self, respond):
+        self.respond = respond      # list of input texts -> list of response items
+        self.requests = []
+        self.embeddings = SimpleNamespace(create=self.create)
+
+    def create(self, model, input):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.requests.append(texts)
+        return SimpleNamespace(data=self.respond(texts))
+
+    def call(self, stage, request):
+        return request(self)
+
+
+def embedding_item(index, vector):
+    return SimpleNamespace(index=index, embedding=list(vector))
+
+
+@pytest.fixture
+def embeddings_client():
+    return FakeEmbeddingsClient
+
+
+@pytest.fixture
+def make_item():
+    return embedding_item
+
+
+@pytest.fixture
+def session_logger():
+    from utils.logging import SessionLogger
+    return SessionLogger("test-session", logging.getLogger("tests")).for_request()
@@ -0,0 +1,93 @@
+import io
+import math
+import shutil
+import struct
+import tempfile
+import wave
+
+import pytest
+
+from utils.audio import AudioNormalizer, ogg_has_audio
+
+
+def ogg_page(granule, payload=b""):
+    return b"OggS" + bytes([0, 0]) + struct.pack("<q", granule) + b"\x00" * 13 + payload
+
+
+def opus_stream(pre_skip, last_granule):
+    head = b"OpusHead" + bytes([1, 1]) + struct.pack("<H", pre_skip) + b"\x00" * 7
+    return ogg_page(0, head) + ogg_page(0, b"OpusTags") + ogg_page(last_granule)
+
+
+@pytest.mark.parametrize("last_granule, has_audio", [(312, False), (0, False), (313, True), (48000, True)])
+def test_ogg_has_audio_compares_the_last_granule_with_pre_skip(last_granule, has_audio):
+    assert ogg_has_audio(opus_stream(312, last_granule)) == has_audio
+
+
+def test_ogg_has_audio_leaves_unparsed_data_to_the_caller():
+    assert ogg_has_audio(b"not an ogg stream")
+
+
+def wav(seconds, amplitude, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"".join(struct.pack("<h", int(amplitude * math.sin(2 * math.pi * 440 * i / rate)))
+                               for i in range(int(seconds * rate))))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("normalizer", [AudioNormalizer(enabled=False), AudioNormalizer(ffmpeg="no-such-ffmpeg")])
+def test_upload_passes_through_without_ffmpeg(normalizer):
+    upload = io.BytesIO(b"webm bytes")
+    upload.read()
+
+    prepared = normalizer.prepare(upload, "voice.webm")
+
+    assert not prepared.normalized
+    assert prepared.file.read() == b"webm bytes"
+    assert (prepared.filename, prepared.bytes_in, prepared.bytes_out) == ("voice.webm", 10, 10)
+
+
+@pytest.fixture
+def normalizer():
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        ffmpeg = pytest.importorskip("imageio_ffmpeg").get_ffmpeg_exe()
+    return AudioNormalizer(ffmpeg=ffmpeg, timeout=10)
+
+
+@pytest.fixture(params=["memory", "file"])
+def upload(request):
+    """The upload in memory or in a real temporary file, as werkzeug hands over small and large ones."""
+    def make(data):
+        if request.param == "memory":
+            return io.BytesIO(data)
+        f = tempfile.SpooledTemporaryFile(max_size=0)
+        f.write(data)
+        f.rollover()
+        f.seek(0)
+        return f
+    return make
+
+
+def test_speech_is_normalized_to_opus(normalizer, upload):
+    data = wav(1.0, 8000)
+    prepared = normalizer.prepare(upload(data), "voice.wav")
+
+    assert prepared.normalized
+    assert prepared.filename == "audio.ogg"
+    assert prepared.bytes_in == len(data)
+    assert prepared.file.read(4) == b"OggS"
+    assert prepared.bytes_out < prepared.bytes_in
+
+
+@pytest.mark.parametrize("data", [wav(1.0, 0), b"\x00garbage" * 100], ids=["silence", "garbage"])
+def test_silence_and_undecodable_uploads_are_sent_as_is(normalizer, upload, data):
+    prepared = normalizer.prepare(upload(data), "voice.wav")
+
+    assert not prepared.normalized
+    assert prepared.filename == "voice.wav"
+    assert prepared.file.read() == data
@@ -0,0 +1,89 @@
+import importlib
+import json
+import shutil
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def embedded(tmp_path, monkeypatch):
+    """Runs the build script in tmp_path with fake embeddings; yields the texts it embedded."""
+    monkeypatch.chdir(tmp_path)     # the script works on instructions/ and vector/ under cwd
+    (tmp_path / "vector").mkdir()
+    texts = []
+
+    def fake_embed_batch(batch):
+        texts.extend(batch)
+        return [np.random.default_rng(len(text)).random(1536, dtype="float32") for text in batch]
+
+    monkeypatch.setattr(build_script(), "embed_batch", fake_embed_batch)
+    return texts
+
+
+def build_script():
+    return importlib.import_module("model.build_fiass_index")
+
+
+def write_task(root, task_id, steps):
+    folder = root / "instructions" / task_id
+    folder.mkdir(parents=True, exist_ok=True)
+    task = {"task_id": task_id, "title": task_id, "intro": "intro",
+            "steps": [{"step_num": i + 1, "text": text} for i, text in enumerate(steps)]}
+    (folder / "structured_output.json").write_text(json.dumps(task), encoding="utf-8")
+
+
+def mtimes(root):
+    return {path.name: path.stat().st_mtime_ns for path in (root / "vector").iterdir()}
+
+
+def read_json(path):
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def test_noop_build_writes_nothing(tmp_path, embedded):
+    write_task(tmp_path, "pay", ["open the bank", "pay the bill"])
+    write_task(tmp_path, "ship", ["pack the box"])
+    build_script().run()
+    assert len(embedded) == 5
+    before = mtimes(tmp_path)
+    assert set(before) == {"task_index.faiss", "task_meta.json", "manifest.json",
+                           "steps_pay.faiss", "steps_pay_meta.json", "steps_ship.faiss", "steps_ship_meta.json"}
+
+    embedded.clear()
+    build_script().run()
+
+    assert embedded == []
+    assert mtimes(tmp_path) == before
+
+
+def test_changed_step_reembeds_only_that_text(tmp_path, embedded):
+    write_task(tmp_path, "pay", ["open the bank", "pay the bill"])
+    write_task(tmp_path, "ship", ["pack the box"])
+    build_script().run()
+    before = mtimes(tmp_path)
+
+    embedded.clear()
+    write_task(tmp_path, "pay", ["open the bank", "pay the invoice"])
+    build_script().run()
+
+    assert embedded == ["pay the invoice"]
+    after = mtimes(tmp_path)
+    assert after["steps_pay.faiss"] != before["steps_pay.faiss"]
+    assert after["manifest.json"] != before["manifest.json"]
+    assert after["steps_ship.faiss"] == before["steps_ship.faiss"]
+    assert after["steps_ship_meta.json"] == before["steps_ship_meta.json"]
+
+
+def test_removed_task_loses_its_step_files(tmp_path, embedded):
+    write_task(tmp_path, "pay", ["open the bank"])
+    write_task(tmp_path, "ship", ["pack the box"])
+    build_script().run()
+
+    shutil.rmtree(tmp_path / "instructions" / "ship")
+    build_script().run()
+
+    assert not (tmp_path / "vector" / "steps_ship.faiss").exists()
+    assert not (tmp_path / "vector" / "steps_ship_meta.json").exists()
+    assert read_json(tmp_path / "vector" / "manifest.json")["order"] == ["pay"]
+    assert [task["task_id"] for task in read_json(tmp_path / "vector" / "task_meta.json")] == ["pay"]
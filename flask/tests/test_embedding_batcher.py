@@ -0,0 +1,63 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from utils.embedding_batcher import EmbeddingCoalescer
+
+
+def queued(text, client):
+    return (text, client, Future(), time.monotonic())
+
+
+def test_send_answers_each_caller_and_dedups_texts(embeddings_client, make_item):
+    client = embeddings_client(lambda texts: [make_item(i, [float(len(t))]) for i, t in enumerate(texts)])
+    coalescer = EmbeddingCoalescer("m")
+    batch = [queued("a", client), queued("bbb", client), queued("a", client)]
+
+    coalescer._send(batch)
+
+    assert client.requests == [["a", "bbb"]]
+    assert [future.result() for _, _, future, _ in batch] == [[1.0], [3.0], [1.0]]
+    stats = coalescer.stats()
+    assert (stats["requests"], stats["batches"], stats["sent_texts"]) == (3, 1, 2)
+
+
+def test_short_response_fails_every_caller(embeddings_client, make_item):
+    client = embeddings_client(lambda texts: [make_item(0, [0.0])])
+    coalescer = EmbeddingCoalescer("m")
+    batch = [queued("a", client), queued("b", client)]
+    batch[1][2].cancel()    # a caller that already gave up is left alone
+
+    coalescer._send(batch)
+
+    with pytest.raises(ValueError, match="1 embeddings for 2 texts"):
+        batch[0][2].result()
+    assert batch[1][2].cancelled()
+
+
+def test_concurrent_embeds_share_one_request(embeddings_client, make_item):
+    client = embeddings_client(lambda texts: [make_item(i, [float(t)]) for i, t in enumerate(texts)])
+    coalescer = EmbeddingCoalescer("m", window=0.2, max_batch=4)
+    start = threading.Barrier(4)
+
+    def embed(text):
+        start.wait()
+        return coalescer.embed(text, client)
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        vectors = list(pool.map(embed, ["1", "2", "3", "4"]))
+
+    assert vectors == [[1.0], [2.0], [3.0], [4.0]]
+    assert len(client.requests) == 1
+    assert sorted(client.requests[0]) == ["1", "2", "3", "4"]
+
+
+def test_zero_window_sends_directly(embeddings_client, make_item):
+    client = embeddings_client(lambda texts: [make_item(0, [7.0])])
+    coalescer = EmbeddingCoalescer("m", window=0)
+
+    assert coalescer.embed("a", client) == [7.0]
+    assert client.requests == [["a"]]
+    assert coalescer.thread is None
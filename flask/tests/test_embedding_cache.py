@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import utils.embed as embed
+from utils.embedding_cache import DiskArena, EmbeddingCache, cache_key
+
+DIM = 4
+
+
+def vector(value):
+    return np.full(DIM, value, dtype="float32")
+
+
+def test_cache_key_ignores_case_spacing_and_punctuation():
+    assert cache_key("m", "  Где  кнопка?") == cache_key("m", "где кнопка")
+    assert cache_key("m", "где кнопка") != cache_key("other", "где кнопка")
+
+
+def test_arena_rows_are_shared_between_instances(tmp_path):
+    writer = DiskArena(tmp_path, DIM, max_rows=10)
+    reader = DiskArena(tmp_path, DIM, max_rows=10)
+
+    assert writer.put("a", vector(1.0))
+    np.testing.assert_array_equal(reader.get("a"), vector(1.0))
+    assert reader.get("missing") is None
+
+
+def test_arena_cuts_a_partial_row_before_appending(tmp_path):
+    arena = DiskArena(tmp_path, DIM, max_rows=10)
+    arena.put("a", vector(1.0))
+    with open(arena.vectors_path, "ab") as f:
+        f.write(b"\x00" * 6)   # crash in the middle of the next row
+
+    assert arena.put("b", vector(2.0))
+
+    assert arena.vectors_path.stat().st_size == 2 * arena.row_bytes
+    fresh = DiskArena(tmp_path, DIM, max_rows=10)
+    np.testing.assert_array_equal(fresh.get("a"), vector(1.0))
+    np.testing.assert_array_equal(fresh.get("b"), vector(2.0))
+
+
+def test_arena_rejects_wrong_size_and_full_arena(tmp_path):
+    arena = DiskArena(tmp_path, DIM, max_rows=1)
+    assert not arena.put("short", np.zeros(DIM - 1, dtype="float32"))
+    assert arena.put("a", vector(1.0))
+    assert not arena.put("b", vector(2.0))
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = EmbeddingCache(max_items=2, dim=DIM)
+    cache.put("m", "a", vector(1.0))
+    cache.put("m", "b", vector(2.0))
+    cache.get("m", "a")
+    cache.put("m", "c", vector(3.0))
+
+    assert cache.get("m", "b") is None
+    assert cache.get("m", "a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = EmbeddingCache(dim=DIM)
+    monkeypatch.setattr(embed, "embedding_cache", cache)
+    return cache
+
+
+def test_embed_batch_sends_only_uncached_texts_and_keeps_order(fresh_cache, embeddings_client, make_item, session_logger):
+    fresh_cache.put(embed.EMBEDDING_MODEL, "cached", vector(9.0))
+    # Upstream answers out of order; items carry their index
+    client = embeddings_client(lambda texts: [make_item(i, vector(i)) for i in reversed(range(len(texts)))])
+
+    vectors = embed.embed_batch(["x", "cached", "y", "x"], client, session_logger)
+
+    assert client.requests == [["x", "y"]]
+    assert vectors == [vector(0).tolist(), vector(9.0).tolist(), vector(1).tolist(), vector(0).tolist()]
+
+
+def test_embed_batch_fails_on_a_short_response_without_caching(fresh_cache, embeddings_client, make_item, session_logger):
+    client = embeddings_client(lambda texts: [make_item(0, vector(0))])
+
+    with pytest.raises(ValueError, match="1 embeddings for 2 texts"):
+        embed.embed_batch(["x", "y"], client, session_logger)
+    assert fresh_cache.get(embed.EMBEDDING_MODEL, "x") is None
@@ -0,0 +1,62 @@
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+import core.faiss_matcher as faiss_matcher
+from core.faiss_matcher import FaissMatcher
+
+DIM = 4
+
+
+def write_index(path, vectors):
+    index = faiss.IndexFlatL2(DIM)
+    index.add(np.array(vectors, dtype="float32"))
+    faiss.write_index(index, str(path))
+
+
+@pytest.fixture(params=[True, False], ids=["mmap", "in-memory"])
+def matcher(request, tmp_path, monkeypatch):
+    """Two tasks: "pay" with steps 1 and 2, "ship" with step 7."""
+    monkeypatch.setattr(faiss_matcher, "VECTOR_INDEX_MMAP", request.param)
+    tasks = {
+        "pay": ([1, 0, 0, 0], {1: [1, 0.1, 0, 0], 2: [1, 0.3, 0, 0]}),
+        "ship": ([0, 1, 0, 0], {7: [0, 1, 0.1, 0]}),
+    }
+    meta = []
+    for task_id, (_, steps) in tasks.items():
+        step_meta = [{"step_num": num, "text": f"{task_id} {num}"} for num in steps]
+        meta.append({"task_id": task_id, "title": task_id, "intro": "", "steps": step_meta})
+        write_index(tmp_path / f"steps_{task_id}.faiss", list(steps.values()))
+        (tmp_path / f"steps_{task_id}_meta.json").write_text(json.dumps(step_meta), encoding="utf-8")
+    write_index(tmp_path / "task_index.faiss", [vector for vector, _ in tasks.values()])
+    (tmp_path / "task_meta.json").write_text(json.dumps(meta), encoding="utf-8")
+    return FaissMatcher(tmp_path / "task_index.faiss", tmp_path / "task_meta.json", dim=DIM)
+
+
+def test_match_many_picks_task_and_step_per_query(matcher):
+    result = matcher.match_many([[1, 0.28, 0, 0], [0, 1, 0.1, 0]], k=2)
+
+    assert result.task_ids.tolist() == [["pay", "ship"], ["ship", "pay"]]
+    assert result.step_nums.tolist() == [[2, 1], [7, None]]
+    assert result.step_distances[0, 0] == pytest.approx(0.02 ** 2, abs=1e-6)
+    assert result.step_distances[1, 1] == np.inf
+
+
+def test_match_many_pads_past_the_number_of_tasks(matcher):
+    result = matcher.match_many([[1, 0, 0, 0]], k=5)
+
+    assert result.task_ids.shape == result.task_distances.shape == (1, 5)
+    assert result.task_ids.tolist() == [["pay", "ship", None, None, None]]
+    assert np.isinf(result.task_distances[0, 2:]).all()
+    assert result.step_nums.tolist() == [[1, 2, None, None, None]]
+
+
+def test_predict_applies_both_thresholds(matcher):
+    result = matcher.match_many([[1, 0.1, 0, 0], [1, 0.1, 0.5, 0], [0, 0, 0, 5]])
+
+    task_ids, step_nums = result.predict(task_threshold=0.5, step_threshold=0.1)
+
+    assert task_ids.tolist() == ["pay", "pay", None]
+    assert step_nums.tolist() == [1, None, None]
@@ -0,0 +1,93 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import utils.model_router as model_router
+from utils.model_router import DEFAULT_ROUTES, ModelRouter, Route, load_routes
+
+
+@pytest.fixture(autouse=True)
+def one_token_per_character(monkeypatch):
+    monkeypatch.setattr(model_router.token_counter, "count_messages",
+                        lambda messages: sum(len(m["content"]) for m in messages if isinstance(m["content"], str)))
+
+
+def prompt(tokens):
+    return [{"role": "user", "content": "x" * tokens}]
+
+
+@pytest.fixture
+def router():
+    route = Route(fast="fast", strong="strong", max_fast_tokens=100, strong_for_images=True, budget=2.0)
+    return ModelRouter({"answer": route, "check": Route(fast="fast")}, min_samples=3, max_age=60)
+
+
+def test_small_prompts_stay_on_the_fast_model(router):
+    choice = router.choose("answer", prompt(100))
+    assert (choice.model, choice.fallback, choice.reason, choice.tokens) == ("fast", "strong", "default", 100)
+
+
+def test_large_prompts_and_images_go_to_the_strong_model(router):
+    assert router.choose("answer", prompt(101)).reason == "large_prompt"
+    image = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:"}}]}]
+    choice = router.choose("answer", image)
+    assert (choice.model, choice.fallback, choice.reason) == ("strong", "fast", "images")
+
+
+def test_route_without_strong_model_never_upgrades(router):
+    choice = router.choose("check", prompt(10_000))
+    assert (choice.model, choice.fallback) == ("fast", None)
+
+
+def test_strong_model_over_budget_is_skipped(router):
+    for seconds in (1.0, 1.0, 3.0):
+        router._record("answer", "strong", seconds)
+    # p90 of [1, 1, 3] is 2.6
+    choice = router.choose("answer", prompt(500))
+    assert (choice.model, choice.fallback, choice.reason) == ("fast", "strong", "large_prompt_over_budget")
+
+    # The budget is per route
+    router._record("other", "strong", 1.0)
+    assert router.recent_p90("other", "strong") is None
+
+
+def test_p90_needs_min_samples_and_ignores_old_ones(router, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    for _ in range(3):
+        router._record("answer", "strong", 5.0)
+    assert router.recent_p90("answer", "strong") == pytest.approx(5.0)
+
+    now[0] += 61
+    assert router.recent_p90("answer", "strong") is None
+    assert router.choose("answer", prompt(500)).model == "strong"
+
+
+def test_failed_attempt_falls_back_to_the_other_model(router, monkeypatch):
+    calls = []
+
+    def create(model, messages, **options):
+        calls.append((model, options))
+        if model == "strong":
+            raise TimeoutError("slow")
+        return "reply"
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    client.call = lambda stage, request: request(client)
+    monkeypatch.setattr(model_router, "openai_client", client)
+    router.routes["answer"] = Route(fast="fast", strong="strong", max_fast_tokens=100, timeout=3.0, max_tokens=50)
+
+    assert router.complete("answer", prompt(500)) == "reply"
+    assert calls == [("strong", {"max_tokens": 50, "timeout": 3.0}), ("fast", {"max_tokens": 50, "timeout": 3.0})]
+    assert router.recent_p90("answer", "strong") is None   # failures are not latency samples
+
+
+def test_load_routes_overrides_fields_and_rejects_unknown_ones():
+    routes = load_routes('{"step_answer": {"budget": 1.5}, "summary": {"fast": "mini"}}')
+    assert routes["step_answer"] == Route(**{**DEFAULT_ROUTES["step_answer"].__dict__, "budget": 1.5})
+    assert routes["summary"] == Route(fast="mini")
+    assert routes["mismatch"] == DEFAULT_ROUTES["mismatch"]
+
+    with pytest.raises(ValueError, match="Unknown fields for route step_answer"):
+        load_routes('{"step_answer": {"budjet": 1.5}}')
@@ -0,0 +1,77 @@
+import time
+
+import numpy as np
+import pytest
+
+from utils.response_cache import ResponseCache
+
+
+def at_angle(cosine):
+    """2-d vector whose cosine similarity with (1, 0) is `cosine`; length doesn't matter."""
+    return [3 * cosine, 3 * np.sqrt(1 - cosine ** 2)]
+
+
+@pytest.mark.parametrize("cosine, hit", [(1.0, True), (0.96, True), (0.94, False), (-1.0, False)])
+def test_hits_only_at_or_above_the_threshold(cosine, hit):
+    cache = ResponseCache(threshold=0.95)
+    cache.put("pay", 1, [1.0, 0.0], "reply", b"audio")
+
+    cached = cache.get("pay", 1, at_angle(cosine))
+
+    assert (cached is not None) == hit
+    if hit:
+        assert (cached.reply, cached.audio) == ("reply", b"audio")
+    assert cache.stats()["hit_rate"] == (1.0 if hit else 0.0)
+
+
+def test_lookups_stay_within_the_step():
+    cache = ResponseCache()
+    cache.put("pay", 1, [1.0, 0.0], "step one")
+
+    assert cache.get("pay", 2, [1.0, 0.0]) is None
+    assert cache.get("ship", 1, [1.0, 0.0]) is None
+    assert cache.get("pay", 1, [1.0, 0.0]).reply == "step one"
+
+
+def test_best_match_wins():
+    cache = ResponseCache(threshold=0.9)
+    cache.put("pay", 1, at_angle(0.92), "close")
+    cache.put("pay", 1, at_angle(0.99), "closer")
+    assert cache.get("pay", 1, [1.0, 0.0]).reply == "closer"
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.put("pay", 1, [1.0, 0.0], "reply")
+
+    now[0] += 10
+    assert cache.get("pay", 1, [1.0, 0.0]) is not None
+    now[0] += 1
+    assert cache.get("pay", 1, [1.0, 0.0]) is None
+
+
+def test_oldest_entry_is_dropped_past_max_entries():
+    cache = ResponseCache(max_entries=2)
+    cache.put("pay", 1, [1.0, 0.0], "first")
+    cache.put("pay", 2, [1.0, 0.0], "second")
+    cache.put("pay", 3, [1.0, 0.0], "third")
+
+    assert cache.get("pay", 1, [1.0, 0.0]) is None
+    assert cache.get("pay", 3, [1.0, 0.0]).reply == "third"
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+    assert ("pay", 1) not in cache.buckets
+
+
+def test_disabled_cache_and_missing_embedding_do_nothing():
+    disabled = ResponseCache(max_entries=0)
+    disabled.put("pay", 1, [1.0, 0.0], "reply")
+    assert disabled.get("pay", 1, [1.0, 0.0]) is None
+    assert disabled.stats()["entries"] == 0
+
+    cache = ResponseCache()
+    cache.put("pay", 1, None, "reply")
+    assert cache.get("pay", 1, None) is None
+    assert cache.stats() == {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "hit_rate": 0.0}
@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+from core.session_store import InMemorySessionStore, RedisSessionStore, SessionStore
+
+
+def use_fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")   # Lua scripting in fakeredis
+    import redis
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url", lambda url: fakeredis.FakeRedis(server=server))
+
+
+@pytest.fixture(params=["memory", "redis"])
+def make_store(request, monkeypatch):
+    if request.param == "redis":
+        use_fake_redis(monkeypatch)
+
+    def make(**kwargs):
+        kwargs.setdefault("lifetime", 60)
+        if request.param == "redis":
+            return RedisSessionStore("redis://fake", **kwargs)
+        return InMemorySessionStore(**kwargs)
+    return make
+
+
+def new_session(store, session_id, **fields):
+    store.create(session_id, {"task_id": None, "step_num": None, "summary": "", **fields})
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_fields_and_history_round_trip(make_store):
+    store = make_store()
+    new_session(store, "a")
+    store.set("a", task_id="pay", step_num=2)
+    store.append_history("a", ("q1", "r1", 5), limit=10)
+    store.append_history("a", ("q2", "r2", 5), limit=10)
+
+    assert store.get("a", "task_id") == "pay"
+    assert store.get("a", "step_num") == 2
+    assert store.get("a", "history") == [("q1", "r1", 5), ("q2", "r2", 5)]
+    assert store.get("missing", "task_id", "default") == "default"
+
+
+def test_history_keeps_the_newest_entries(make_store):
+    store = make_store()
+    new_session(store, "a")
+    for i in range(5):
+        store.append_history("a", (f"q{i}", f"r{i}", 1), limit=3)
+    assert [entry[0] for entry in store.get("a", "history")] == ["q2", "q3", "q4"]
+
+
+def test_fold_applies_once(make_store):
+    store = make_store()
+    new_session(store, "a")
+    for i in range(3):
+        store.append_history("a", (f"q{i}", f"r{i}", 1), limit=10)
+
+    assert store.fold_history("a", ("q0", "r0", 1), 2, "summary")
+    # A second worker folding the same turns finds another head
+    assert not store.fold_history("a", ("q0", "r0", 1), 2, "summary again")
+    assert store.get("a", "summary") == "summary"
+    assert store.get("a", "history") == [("q2", "r2", 1)]
+
+
+def test_count_cap_evicts_the_least_recently_active(make_store):
+    store = make_store(max_sessions=2)
+    new_session(store, "a")
+    time.sleep(0.01)
+    new_session(store, "b")
+    time.sleep(0.01)
+    store.exists("a")
+    time.sleep(0.01)
+    new_session(store, "c")
+
+    assert store.exists("a") and store.exists("c")
+    assert not store.exists("b")
+    assert store.stats()["evictions"] == 1
+
+
+def test_byte_cap_evicts_and_bytes_follow_the_sessions(make_store):
+    store = make_store(max_bytes=4000)
+    new_session(store, "a")
+    time.sleep(0.01)
+    new_session(store, "b")
+    assert store.stats()["bytes"] > 0
+
+    store.append_history("b", ("x" * 3000, "y", 1), limit=10)
+    assert not store.exists("a")
+    assert store.stats()["bytes"] <= 4000
+
+    store.delete("b")
+    assert store.stats()["bytes"] == 0
+
+
+def test_memory_sessions_expire_after_their_lifetime(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    store = InMemorySessionStore(lifetime=10)
+    new_session(store, "a")
+
+    now[0] += 5
+    assert store.exists("a")        # activity pushes the expiry forward
+    now[0] += 9
+    assert store.exists("a")
+    now[0] += 11
+    store.expire()
+    assert not store.exists("a")
+    assert store.stats() == {"sessions": 0, "bytes": 0, "evictions": 0}
+
+
+def test_redis_touch_does_not_revive_an_expired_session(monkeypatch):
+    use_fake_redis(monkeypatch)
+    store = RedisSessionStore("redis://fake", lifetime=60)
+    new_session(store, "a")
+    store.append_history("a", ("q", "r", 1), limit=10)
+
+    # The session's TTL ran out and a sweep took it out of the activity set and the accounting
+    store.redis.delete(store._key("a"))
+    store.redis.zrem(store.activity_key, "a")
+    store._forget(["a"])
+
+    assert store.get("a", "history") is None
+    pipe = store.redis.pipeline()
+    store._touch(pipe, "a")
+    assert pipe.execute() == [0]
+    assert store.redis.zscore(store.activity_key, "a") is None
+    assert not store.redis.exists(store._history_key("a"))
+    assert store.stats()["bytes"] == 0
@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from core.topic_shift import TopicShiftDetector
+from core.vector_index import VectorIndex
+
+DIM = 2
+
+
+def unit(*values):
+    return np.array(values, dtype="float32")
+
+
+class FakeMatcher:
+    """What the detector reads from FaissMatcher: vectors, task metadata and the LLM check."""
+
+    def __init__(self, tasks):
+        self.vectors = VectorIndex(dim=DIM).build(tasks)
+        self.meta = [{"task_id": task_id} for task_id, *_ in tasks]
+        self.llm_calls = 0
+
+    def user_says_mismatch(self, query, client, current_task, current_step):
+        self.llm_calls += 1
+        return "llm verdict"
+
+
+@pytest.fixture
+def matcher():
+    return FakeMatcher([
+        ("pay", unit(0.0, 0.0), [unit(0.0, 0.1), unit(0.0, 0.2)]),
+        ("ship", unit(1.0, 0.0), [unit(1.0, 0.1)]),
+    ])
+
+
+def test_margin_uses_the_closest_step_of_each_task(matcher):
+    detector = TopicShiftDetector(matcher)
+    # Squared L2: 0.01 to the first step of "pay" (0.02 to its task vector),
+    # 0.81 to the step of "ship" (0.82 to its task vector)
+    margin = detector.margin([0.1, 0.1], {"task_id": "pay"})
+    assert margin == pytest.approx(0.81 - 0.01, abs=1e-5)
+    assert detector.margin([0.9, 0.1], {"task_id": "pay"}) < 0
+
+
+def test_margin_without_competing_tasks_keeps_the_task():
+    detector = TopicShiftDetector(FakeMatcher([("only", unit(0.0, 0.0), [])]))
+    assert detector.margin([5.0, 5.0], {"task_id": "only"}) == float("inf")
+
+
+@pytest.mark.parametrize("margin, verdict, counter", [
+    (0.05, False, "local_confirm"),
+    (-0.05, True, "local_reject"),
+    (0.0, "llm verdict", "llm_fallback"),
+    (0.03, "llm verdict", "llm_fallback"),     # band edges are still ambiguous
+    (-0.03, "llm verdict", "llm_fallback"),
+    (None, "llm verdict", "llm_fallback"),
+])
+def test_only_margins_inside_the_band_ask_the_llm(matcher, session_logger, monkeypatch, margin, verdict, counter):
+    detector = TopicShiftDetector(matcher, band_low=-0.03, band_high=0.03)
+    monkeypatch.setattr(detector, "margin", lambda query_embedding, current_task: margin)
+
+    result = detector.is_shift("query", [0.0, 0.0], None, {"task_id": "pay"}, None, session_logger)
+
+    assert result == verdict
+    assert matcher.llm_calls == (counter == "llm_fallback")
+    stats = detector.stats()
+    assert stats[counter] == 1
+    assert stats["fallback_rate"] == (1.0 if counter == "llm_fallback" else 0.0)
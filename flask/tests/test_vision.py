@@ -0,0 +1,82 @@
+import base64
+import io
+
+import pytest
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image, ImageDraw
+
+from utils.vision import ImagePreparer, max_cell_difference, sniff_mime, target_size
+
+
+def form_screen(checked=False, typed="", dialog=False):
+    """A 1920x1080 form: a few labelled fields and a checkbox, like the screens users upload."""
+    image = Image.new("RGB", (1920, 1080), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1920, 60), fill=(40, 70, 140))
+    for row in range(4):
+        top = 150 + row * 90
+        draw.text((100, top + 10), f"Field {row}", fill="black")
+        draw.rectangle((300, top, 900, top + 40), outline=(120, 120, 120), width=2)
+    draw.rectangle((300, 560, 320, 580), outline="black", width=2)
+    if checked:
+        draw.line((303, 570, 309, 577, 318, 562), fill="black", width=3)
+    if typed:
+        draw.text((310, 160), typed, fill="black")
+    if dialog:
+        draw.rectangle((700, 400, 1220, 680), fill=(235, 235, 235), outline="black", width=2)
+        draw.text((740, 430), "Save changes?", fill="black")
+    return image
+
+
+def encode(image, image_format="PNG", **options):
+    out = io.BytesIO()
+    image.save(out, format=image_format, **options)
+    return out.getvalue()
+
+
+@pytest.fixture
+def preparer():
+    return ImagePreparer(workers=1, cache_max_bytes=0)
+
+
+def test_reencoded_screen_is_a_duplicate(preparer):
+    screen = form_screen(typed="Acme")
+    first = preparer.prepare(encode(screen))
+    again = preparer.prepare(encode(screen, "JPEG", quality=85))
+
+    assert preparer.is_duplicate(again.fingerprint, first.fingerprint)
+
+
+@pytest.mark.parametrize("changed", [
+    form_screen(checked=True),
+    form_screen(typed="Ac"),
+    form_screen(dialog=True),
+], ids=["checkbox", "typed text", "dialog"])
+def test_small_changes_are_not_duplicates(preparer, changed):
+    first = preparer.prepare(encode(form_screen()))
+    second = preparer.prepare(encode(changed, "JPEG", quality=85))
+
+    assert not preparer.is_duplicate(second.fingerprint, first.fingerprint)
+
+
+def test_fingerprints_that_do_not_compare_are_never_duplicates(preparer):
+    current = preparer.prepare(encode(form_screen())).fingerprint
+
+    assert not preparer.is_duplicate(current, None)
+    assert not preparer.is_duplicate(current, "12345678901234")      # a hash kept by an older version
+    assert max_cell_difference(current, base64.b64encode(b"\x00" * 16).decode()) is None
+    assert max_cell_difference(current, current) == 0
+
+
+def test_screens_are_downscaled_for_the_detail_level(preparer):
+    prepared = preparer.prepare(encode(form_screen()))
+
+    assert prepared.size == target_size(1920, 1080, "auto") == (1365, 768)
+    assert prepared.data_url.startswith("data:image/jpeg;base64,")
+
+
+def test_sniff_mime():
+    assert sniff_mime(encode(form_screen(), "PNG")) == "image/png"
+    assert sniff_mime(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_mime(b"plain text") is None
@@ -0,0 +1,130 @@
+import json
+import wave
+
+import numpy as np
+import pytest
+
+import core.voice_stream as voice_stream
+from core.voice_stream import VoiceActivityDetector, VoiceConnection, pcm_to_wav
+
+RATE = 16000
+
+
+def tone(seconds, amplitude=8000, rate=RATE):
+    t = np.arange(int(seconds * rate)) / rate
+    return (amplitude * np.sin(2 * np.pi * 220 * t)).astype("<i2").tobytes()
+
+
+def silence(seconds, rate=RATE):
+    return bytes(int(seconds * rate) * 2)
+
+
+def feed_in_chunks(vad, pcm, chunk=1000):
+    """Sends audio the way a browser does: in chunks that don't line up with frames."""
+    events = []
+    for start in range(0, len(pcm), chunk):
+        events += vad.feed(pcm[start:start + chunk])
+    return events
+
+
+def test_frames_are_cut_across_chunks():
+    vad = VoiceActivityDetector(frame_ms=20)
+    assert vad.frame_bytes == 640
+
+    assert vad.feed(b"\x00" * 600) == []
+    assert len(vad.pending) == 600
+    vad.feed(b"\x00" * 1000)
+    assert len(vad.pending) == (600 + 1000) % 640
+
+
+def test_utterance_starts_reaches_speech_and_ends():
+    vad = VoiceActivityDetector()
+    events = feed_in_chunks(vad, silence(0.5) + tone(1.0) + silence(1.0))
+
+    assert [event for event, _ in events] == ["start", "speech", "end"]
+    utterance = events[-1][1]
+    assert len(utterance) % vad.frame_bytes == 0
+    # The whole tone, a little preroll before it and a little of the silence after it
+    assert len(tone(1.0)) <= len(utterance) <= len(tone(1.0)) + len(silence(0.3 + 0.12))
+    assert not vad.speaking
+
+
+def test_click_is_cancelled():
+    vad = VoiceActivityDetector()
+    events = feed_in_chunks(vad, silence(0.5) + tone(0.1) + silence(1.0))
+    assert [event for event, _ in events] == ["start", "cancel"]
+
+
+def test_long_utterance_is_cut_at_the_maximum():
+    vad = VoiceActivityDetector(max_utterance_s=1.0)
+    events = feed_in_chunks(vad, silence(0.2) + tone(2.5))
+    assert [event for event, _ in events][:3] == ["start", "speech", "end"]
+    assert len(events[2][1]) == len(silence(1.0))
+
+
+def test_pcm_to_wav():
+    pcm = tone(0.25, rate=24000)
+    with wave.open(pcm_to_wav(pcm, 24000)) as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (1, 2, 24000)
+        assert wav.readframes(wav.getnframes()) == pcm
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+@pytest.fixture
+def connection(monkeypatch, session_logger):
+    monkeypatch.setattr(voice_stream.image_preparer, "submit", lambda content: content)
+    return VoiceConnection(FakeSocket(), "session", run_turn=None, logger=session_logger)
+
+
+@pytest.mark.parametrize("raw, error", [
+    ("not json", "must be JSON"),
+    ("[1, 2]", "must be JSON objects"),
+    ('{"type": "start", "sample_rate": 0}', "Unsupported sample_rate 0"),
+    ('{"type": "start", "sample_rate": "16000"}', "Unsupported sample_rate '16000'"),
+    ('{"type": "image", "data": "not base64!"}', "must be base64"),
+    ('{"type": "image", "data": 5}', "must be base64"),
+])
+def test_malformed_control_messages_are_rejected(connection, raw, error):
+    connection._control(raw)
+
+    assert len(connection.ws.sent) == 1
+    assert connection.ws.sent[0]["type"] == "error"
+    assert error in connection.ws.sent[0]["error"]
+    assert connection.sample_rate == RATE
+    assert not connection.images
+
+
+def test_control_messages_set_the_rate_and_queue_images(connection):
+    connection._control('{"type": "start", "sample_rate": 48000}')
+    connection._control('{"type": "image", "data": "aGVsbG8="}')
+
+    assert connection.ws.sent == []
+    assert connection.sample_rate == connection.vad.sample_rate == 48000
+    assert list(connection.images) == [b"hello"]
+
+
+def test_finished_utterance_becomes_a_turn_with_the_pending_images(connection):
+    connection.images.append("image future")
+    connection._audio(silence(0.5) + tone(1.0) + silence(1.0))
+
+    assert [message["type"] for message in connection.ws.sent] == ["speech_start", "speech_end"]
+    wav, images = connection.turns.get_nowait()
+    assert images == ["image future"]
+    assert not connection.images
+    with wave.open(wav) as w:
+        assert w.getframerate() == RATE
+
+
+def test_speech_during_a_reply_interrupts_it(connection):
+    connection.replying = True
+    connection._audio(silence(0.5) + tone(0.5))
+
+    assert [message["type"] for message in connection.ws.sent] == ["speech_start", "interrupt"]
+    assert connection.interrupted.is_set()
@@ -0,0 +1,138 @@
+import io
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+
+from utils.metrics import metrics
+
+OGG_TAIL_BYTES = 70 * 1024   # more than the largest Ogg page
+
+
+def ogg_has_audio(data: bytes) -> bool:
+    """Whether an Ogg Opus stream holds any samples past the pre-skip, from its last page."""
+    head = data[:512]
+    tail = data[-OGG_TAIL_BYTES:]
+
+    opus_head = head.find(b"OpusHead")
+    last_page = tail.rfind(b"OggS")
+    if opus_head < 0 or last_page < 0 or len(tail) < last_page + 14:
+        return True   # not what we expected to parse, leave the decision to the caller's checks
+    pre_skip = int.from_bytes(head[opus_head + 10:opus_head + 12], "little")
+    granule = int.from_bytes(tail[last_page + 6:last_page + 14], "little", signed=True)
+    return granule > pre_skip
+
+
+@dataclass
+class PreparedAudio:
+    file: object           # seekable file object positioned at 0
+    filename: str
+    bytes_in: int
+    bytes_out: int
+    normalized: bool
+
+    def close(self):
+        self.file.close()
+
+
+class AudioNormalizer:
+    """
+    Shrinks recorded uploads to what speech recognition needs before they go upstream.
+
+    ffmpeg drops video, downmixes the audio to mono, resamples it, strips leading and trailing
+    silence and encodes it as low-bitrate Opus. The upload itself is sent instead if ffmpeg is
+    missing, fails on the input, takes longer than `timeout` or trims away everything.
+    """
+
+    def __init__(self, enabled: bool = True, ffmpeg: str = "ffmpeg", sample_rate: int = 16000,
+                 bitrate: str = "24k", silence_db: float = -45.0, timeout: float = 20.0):
+        self.enabled = enabled
+        self.ffmpeg = shutil.which(ffmpeg) if enabled else None
+        self.sample_rate = sample_rate
+        self.bitrate = bitrate
+        self.silence_db = silence_db
+        self.timeout = timeout
+
+        if enabled and not self.ffmpeg:
+            print(f"⚠️ {ffmpeg} not found, audio is sent to transcription as uploaded")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.getenv("AUDIO_NORMALIZE", "1") == "1",
+            ffmpeg=os.getenv("FFMPEG_PATH", "ffmpeg"),
+            sample_rate=int(os.getenv("AUDIO_SAMPLE_RATE", "16000")),
+            bitrate=os.getenv("AUDIO_BITRATE", "24k"),
+            silence_db=float(os.getenv("AUDIO_SILENCE_DB", "-45")),
+            timeout=float(os.getenv("AUDIO_NORMALIZE_TIMEOUT", "20")),
+        )
+
+    def command(self):
+        trim = f"silenceremove=start_periods=1:start_threshold={self.silence_db}dB:start_silence=0.1"
+        return [
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-nostdin",
+            "-i", "pipe:0",
+            "-vn", "-sn", "-dn",
+            "-ac", "1", "-ar", str(self.sample_rate),
+            # Trim the start, then the end by trimming the reversed signal
+            "-af", f"{trim},areverse,{trim},areverse",
+            "-c:a", "libopus", "-b:a", self.bitrate, "-application", "voip",
+            "-f", "ogg", "pipe:1",
+        ]
+
+    def prepare(self, file, filename: str = None) -> PreparedAudio:
+        """
+        `file` is the upload as werkzeug received it: in memory when small, else in a temporary file.
+        A real file is handed to ffmpeg as its stdin, so nothing is copied; an in-memory one is
+        written to it by communicate(), under the same timeout as the encoding.
+        """
+        filename = filename or "audio.webm"
+        file.seek(0, os.SEEK_END)
+        bytes_in = file.tell()
+        file.seek(0)
+
+        if not self.ffmpeg or not bytes_in:
+            return self._passthrough(file, filename, bytes_in)
+
+        # werkzeug spools into a SpooledTemporaryFile; its fileno() would first copy memory to disk
+        spooled = getattr(file, "_file", file)
+        try:
+            stdin, data = spooled.fileno(), None
+        except (AttributeError, io.UnsupportedOperation):
+            stdin, data = subprocess.PIPE, file.read()
+
+        process = subprocess.Popen(self.command(), stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            encoded, errors = process.communicate(data, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            encoded, errors = process.communicate()
+            errors += b"timed out"
+
+        if process.returncode != 0 or not encoded:
+            message = errors.decode("utf-8", errors="replace").strip()
+            print(f"⚠️ Audio normalization failed ({process.returncode}), sending upload as is: {message[:200]}")
+            metrics.inc("audio_normalize_failures_total")
+            return self._passthrough(file, filename, bytes_in)
+
+        if not ogg_has_audio(encoded):
+            # Quiet or clipped recordings can be trimmed away entirely; let Whisper judge the original
+            print("⚠️ Nothing left after silence removal, sending upload as is")
+            metrics.inc("audio_normalize_empty_total")
+            return self._passthrough(file, filename, bytes_in)
+
+        self._count(bytes_in, len(encoded))
+        return PreparedAudio(io.BytesIO(encoded), "audio.ogg", bytes_in, len(encoded), True)
+
+    def _passthrough(self, file, filename: str, bytes_in: int) -> PreparedAudio:
+        file.seek(0)
+        self._count(bytes_in, bytes_in)
+        return PreparedAudio(file, filename, bytes_in, bytes_in, False)
+
+    @staticmethod
+    def _count(bytes_in: int, bytes_out: int):
+        metrics.inc("audio_bytes_in_total", bytes_in)
+        metrics.inc("audio_bytes_out_total", bytes_out)
+
+
+audio_normalizer = AudioNormalizer.from_env()
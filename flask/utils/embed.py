@@ -1,30 +1,61 @@
+import time
+
+from utils.embedding_cache import EmbeddingCache
+from utils.embedding_batcher import EmbeddingCoalescer
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+embedding_cache = EmbeddingCache.from_env()
+embedding_coalescer = EmbeddingCoalescer.from_env(EMBEDDING_MODEL)
+
 def embed_query(text, client, logger, silent=False):
     try:
+        started = time.perf_counter()
+        cached = embedding_cache.get(EMBEDDING_MODEL, text)
+        if cached is not None:
+            if not silent:
+                logger.record("embedding", time.perf_counter() - started, "Embedding cache hit")
+            return cached.tolist()
+
+        # Concurrent single-text requests share one upstream call
+        embedding = embedding_coalescer.embed(text, client)
+        embedding_cache.put(EMBEDDING_MODEL, text, embedding)
+
         if not silent:
-            logger.log_time("Generated embedding of length 1536")
-        
-        response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=text
-        )
-        embedding = response.data[0].embedding
+            logger.record("embedding", time.perf_counter() - started, "Generated embedding of length 1536")
         return embedding
     except Exception as e:
-        logger.error("Embedding failed", e)
+        logger.error("Embedding failed: %s", e)
         raise e
-    
+
 def embed_batch(texts, client, logger, silent=False):
     try:
-        if not silent:
-            logger.log_time(f"Batch embedding {len(texts)} texts")
+        started = time.perf_counter()
+        vectors = [embedding_cache.get(EMBEDDING_MODEL, text) for text in texts]
+        missed = list(dict.fromkeys(text for text, vec in zip(texts, vectors) if vec is None))
+
+        if missed:
+            response = client.call("embedding", lambda c: c.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=missed  # <--- Only texts not in cache
+            ))
+            # Checked before anything is cached, as in the coalescer: a short answer fails the whole batch
+            if len(response.data) != len(missed):
+                raise ValueError(f"❌ Got {len(response.data)} embeddings for {len(missed)} texts")
+            items = sorted(response.data, key=lambda item: item.index)
+            if [item.index for item in items] != list(range(len(missed))):
+                raise ValueError(f"❌ Embedding indexes {[item.index for item in items]} don't match {len(missed)} texts")
+            fresh = {text: item.embedding for text, item in zip(missed, items)}
+            for text, embedding in fresh.items():
+                embedding_cache.put(EMBEDDING_MODEL, text, embedding)
+            vectors = [fresh[text] if vec is None else vec.tolist() for text, vec in zip(texts, vectors)]
+        else:
+            vectors = [vec.tolist() for vec in vectors]
 
-        response = client.embeddings.create(
-            model="text-embedding-ada-002",
-            input=texts  # <--- Batch list
-        )
-        vectors = [item.embedding for item in response.data]
+        if not silent:
+            logger.record("embedding", time.perf_counter() - started, f"Batch embedding {len(texts)} texts ({len(missed)} uncached)")
         return vectors
 
     except Exception as e:
-        logger.error("Batch embedding failed", e)
-        raise e
\ No newline at end of file
+        logger.error("Batch embedding failed: %s", e)
+        raise e
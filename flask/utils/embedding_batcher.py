@@ -0,0 +1,106 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class EmbeddingCoalescer:
+    """
+    Collects single-text embedding requests for a short window (or until the batch is full)
+    and sends them as one embeddings.create call, handing each caller back its own vector.
+
+    The dispatcher thread only gathers batches; requests are sent from a small pool so
+    the next batch keeps filling while the previous one is in flight.
+    """
+
+    def __init__(self, model: str, window: float = 0.005, max_batch: int = 64, concurrency: int = 4):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.queue = queue.Queue()
+        self.pool = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "batches": 0, "sent_texts": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    @classmethod
+    def from_env(cls, model: str):
+        return cls(
+            model,
+            window=float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")) / 1000,
+            max_batch=int(os.getenv("EMBED_BATCH_MAX", "64")),
+            concurrency=int(os.getenv("EMBED_BATCH_CONCURRENCY", "4")),
+        )
+
+    def embed(self, text: str, client):
+        """Embedding for one text; blocks until its batch comes back."""
+        if self.window <= 0 or self.max_batch <= 1:
+            response = client.call("embedding", lambda c: c.embeddings.create(model=self.model, input=text))
+            return response.data[0].embedding
+
+        self._start()
+        future = Future()
+        self.queue.put((text, client, future, time.monotonic()))
+        return future.result()
+
+    def _start(self):
+        # Started on first use so a pre-fork master never owns the thread
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed-batch")
+                self.thread = threading.Thread(target=self._run, name="embed-coalescer", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = batch[0][3] + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.pool.submit(self._send, batch)
+
+    def _send(self, batch):
+        dispatched = time.monotonic()
+        # Identical texts in one window go upstream once
+        texts = list(dict.fromkeys(text for text, *_ in batch))
+
+        with self.lock:
+            waits = [dispatched - enqueued for *_, enqueued in batch]
+            self.counters["requests"] += len(batch)
+            self.counters["batches"] += 1
+            self.counters["sent_texts"] += len(texts)
+            self.counters["wait_total"] += sum(waits)
+            self.counters["wait_max"] = max(self.counters["wait_max"], *waits)
+
+        try:
+            client = batch[0][1]
+            response = client.call("embedding", lambda c: c.embeddings.create(model=self.model, input=texts))
+            # Checked before any caller is answered, so the whole batch fails together
+            if len(response.data) != len(texts):
+                raise ValueError(f"❌ Got {len(response.data)} embeddings for {len(texts)} texts")
+            vectors = {text: item.embedding for text, item in zip(texts, response.data)}
+            for text, _, future, _ in batch:
+                future.set_result(vectors[text])
+        except Exception as e:
+            for _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        batches = stats["batches"]
+        stats["avg_batch_size"] = stats["requests"] / batches if batches else 0.0
+        stats["avg_fill"] = stats["requests"] / (batches * self.max_batch) if batches else 0.0
+        stats["avg_wait"] = stats["wait_total"] / stats["requests"] if stats["requests"] else 0.0
+        return stats
@@ -0,0 +1,159 @@
+import os
+import re
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Collapse case, whitespace and surrounding punctuation so near-identical utterances share a key."""
+    text = re.sub(r"\s+", " ", text.casefold()).strip()
+    return text.strip(" .,!?;:…\"'«»")
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha1(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class DiskArena:
+    """
+    Append-only float32 arena shared by all workers on the host.
+
+    vectors.f32 holds fixed-size rows, index.tsv maps cache keys to row numbers.
+    A row is always written before its index line, so readers never see a half-written vector,
+    and a partial row left by a crash is cut off before the next append.
+    """
+
+    def __init__(self, cache_dir: Path, dim: int, max_rows: int):
+        self.dim = dim
+        self.max_rows = max_rows
+        self.row_bytes = dim * 4
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = cache_dir / "vectors.f32"
+        self.index_path = cache_dir / "index.tsv"
+        self.lock_path = cache_dir / ".lock"
+        self.vectors_path.touch(exist_ok=True)
+        self.index_path.touch(exist_ok=True)
+
+        self.rows = {}
+        self.index_offset = 0
+        self.arena = None
+        self.lock = threading.Lock()
+        self._sync()
+
+    def _sync(self):
+        """Pick up rows appended by other workers since the last read."""
+        with open(self.index_path, "rb") as f:
+            f.seek(self.index_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                key, row = line.decode("utf-8").rstrip("\n").split("\t")
+                self.rows[key] = int(row)
+                self.index_offset += len(line)
+
+        n_rows = os.path.getsize(self.vectors_path) // self.row_bytes
+        if n_rows and (self.arena is None or len(self.arena) < n_rows):
+            self.arena = np.memmap(self.vectors_path, dtype="float32", mode="r", shape=(n_rows, self.dim))
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.rows.get(key)
+            if row is None:
+                self._sync()
+                row = self.rows.get(key)
+            if row is None or self.arena is None or row >= len(self.arena):
+                return None
+            return np.array(self.arena[row])
+
+    def put(self, key: str, vector: np.ndarray) -> bool:
+        with self.lock:
+            if key in self.rows or len(self.rows) >= self.max_rows or vector.size != self.dim:
+                return False
+
+            with open(self.lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    with open(self.vectors_path, "r+b") as f:
+                        size = f.seek(0, os.SEEK_END)
+                        row = size // self.row_bytes
+                        if size % self.row_bytes:
+                            # A crash mid-append left a partial row; cut it so later rows stay aligned
+                            f.truncate(row * self.row_bytes)
+                            f.seek(row * self.row_bytes)
+                        f.write(vector.astype("float32").tobytes())
+                    with open(self.index_path, "a", encoding="utf-8") as f:
+                        f.write(f"{key}\t{row}\n")
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            self._sync()
+            return True
+
+
+class EmbeddingCache:
+    """Bounded in-process LRU in front of an optional on-disk arena."""
+
+    def __init__(self, max_items: int = 4096, cache_dir: Path = None, dim: int = 1536, disk_max_rows: int = 200_000):
+        self.max_items = max_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.disk = DiskArena(Path(cache_dir), dim, disk_max_rows) if cache_dir else None
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_items=int(os.getenv("EMBED_CACHE_SIZE", "4096")),
+            cache_dir=os.getenv("EMBED_CACHE_DIR") or None,
+            disk_max_rows=int(os.getenv("EMBED_CACHE_DISK_MAX_ROWS", "200000")),
+        )
+
+    def get(self, model: str, text: str):
+        key = cache_key(model, text)
+
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.counters["hits"] += 1
+                return vector
+
+        vector = self.disk.get(key) if self.disk else None
+
+        with self.lock:
+            if vector is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, vector)
+            return vector
+
+    def put(self, model: str, text: str, vector):
+        key = cache_key(model, text)
+        vector = np.asarray(vector, dtype="float32")
+
+        with self.lock:
+            self._remember(key, vector)
+
+        if self.disk:
+            self.disk.put(key, vector)
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_items:
+            self.memory.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["size"] = len(self.memory)
+        stats["disk_size"] = len(self.disk.rows) if self.disk else 0
+        return stats
@@ -1,50 +1,238 @@
-import logging
+import os
 import sys
+import json
 import time
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 
+from utils.metrics import metrics
+
+# Fields SessionLogger attaches to records; rendered as JSON keys, not inside the message
+STRUCTURED_FIELDS = ("session_id", "stage", "seconds", "outcome", "spans", "payload")
+
+
+class LazyPayload:
+    """A payload that is only serialized when the record is written, on the listener thread."""
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value, max_chars: int):
+        self.value = value
+        self.max_chars = max_chars
+
+    def render(self):
+        text = json.dumps(self.value, ensure_ascii=False, default=str)
+        if len(text) > self.max_chars:
+            return text[:self.max_chars] + f"… (+{len(text) - self.max_chars} chars)"
+        return text
+
+    def structured(self):
+        """The value itself when it fits, so JSON logs keep its structure; otherwise the cut text."""
+        text = self.render()
+        return self.value if len(text) <= self.max_chars else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value.structured() if isinstance(value, LazyPayload) else value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic line format, with the session id and payload folded back in."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s [%(levelname)s] %(message)s")
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        session_id = getattr(record, "session_id", None)
+        if session_id:
+            line = line.replace("] ", f"] [{session_id}] ", 1)
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            line += " " + (payload.render() if isinstance(payload, LazyPayload) else str(payload))
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread without formatting them and never blocks:
+    when the queue is full the record is dropped and counted.
+    """
+
+    def prepare(self, record):
+        # Formatting (message args, payload JSON) happens on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log_records_dropped_total")
+
+
+class PayloadSampling:
+    """Which fraction of payload log calls are written, and how much of each."""
+    __slots__ = ("rate", "max_chars")
+
+    def __init__(self, rate: float, max_chars: int = 4000):
+        self.rate = rate
+        self.max_chars = max_chars
+
+    def sample(self) -> bool:
+        return self.rate >= 1 or (self.rate > 0 and random.random() < self.rate)
+
+
+PayloadSampling.disabled = PayloadSampling(0.0)
+
+
 class SessionLogger:
-    def __init__(self, session_id: str, base_logger: logging.Logger):
+    """
+    Session-scoped log prefix. for_request() gives each request its own copy, so the timers
+    and spans of overlapping requests of one session never mix.
+    """
+    __slots__ = ("session_id", "logger", "started", "spans", "sampling")
+
+    def __init__(self, session_id: str, base_logger: logging.Logger, sampling: "PayloadSampling" = None):
         self.session_id = session_id
         self.logger = base_logger
-        self.timer = None
+        self.started = None
+        self.spans = None
+        self.sampling = sampling
+
+    def for_request(self) -> "SessionLogger":
+        request_logger = SessionLogger(self.session_id, self.logger, self.sampling)
+        request_logger.spans = []
+        request_logger.start_timer()
+        return request_logger
 
-    def info(self, msg, *args):
-        self.logger.info(f"[{self.session_id}] {msg}", *args)
+    def info(self, msg, *args, **fields):
+        self.logger.info(msg, *args, extra={"session_id": self.session_id, **fields})
 
-    def error(self, msg, *args):
-        self.logger.error(f"[{self.session_id}] {msg}", *args)
+    def error(self, msg, *args, **fields):
+        self.logger.error(msg, *args, extra={"session_id": self.session_id, **fields})
 
-    def exception(self, msg, *args):
-        self.logger.exception(f"[{self.session_id}] {msg}", *args)
+    def exception(self, msg, *args, **fields):
+        self.logger.exception(msg, *args, extra={"session_id": self.session_id, **fields})
+
+    def payload(self, label: str, value):
+        """
+        Log a large payload (prompts, histories) for a sampled fraction of calls.
+        Unsampled calls cost one random draw; sampled ones are serialized off the request thread.
+        """
+        sampling = self.sampling or PayloadSampling.disabled
+        if not sampling.sample():
+            return
+        self.info(label, payload=LazyPayload(value, sampling.max_chars))
 
     def start_timer(self):
-        self.timer = time.time()
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str, label: str = None):
+        """Time a stage of the request into the stage histogram and this request's span list."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started, label)
 
-    def log_time(self, label: str):
-        if self.timer is None:
-            self.info(f"⏱️ Timer not started for: {label}")
-        else:
-            duration = time.time() - self.timer
-            self.info(f"{label} in {duration:.3f} sec")
-            self.timer = time.time()  # auto-reset
+    def record(self, stage: str, seconds: float, label: str = None):
+        metrics.observe("stage_seconds", seconds, stage=stage)
+        if self.spans is not None:
+            self.spans.append((stage, seconds))
+        self.info("%s in %.3f sec", label or stage, seconds, stage=stage, seconds=round(seconds, 6))
+
+    def finish(self, outcome: str = "ok"):
+        """Close the request: end-to-end histogram plus one summary line of all spans."""
+        if self.started is None:
+            return
+        total = time.perf_counter() - self.started
+        metrics.observe("request_seconds", total, outcome=outcome)
+        spans = {}
+        for stage, seconds in self.spans or ():
+            spans[stage] = round(spans.get(stage, 0.0) + seconds, 6)
+        self.info("⏱️ Request %s in %.3f sec", outcome, total, outcome=outcome, seconds=round(total, 6), spans=spans)
+        self.started = None
+
+
+def build_file_handler(log_path: Path, rotation: str):
+    """
+    JSON lines file handler for LOG_FILE_ROTATION:
+    "size" rotates by size in-process, which is only safe with a single process writing the file;
+    "external" reopens the file when logrotate (or anything else) has moved it;
+    "off" writes no file, stdout only.
+    """
+    if rotation == "off":
+        return None
+    if rotation == "external":
+        handler = logging.handlers.WatchedFileHandler(log_path, encoding="utf-8")
+    elif rotation == "size":
+        handler = logging.handlers.RotatingFileHandler(
+            log_path,
+            maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+            encoding="utf-8",
+        )
+    else:
+        raise ValueError(f"❌ Unknown LOG_FILE_ROTATION: {rotation}")
+    handler.setFormatter(JsonFormatter())
+    return handler
 
 
 class LogManager:
+    """
+    Log records are queued by the calling thread and written by a single listener thread:
+    JSON lines to a file (see build_file_handler), plus stdout. A full queue drops records
+    instead of waiting.
+    """
+
     def __init__(self, log_file: str = "main.log"):
         log_path = Path(__file__).parent.parent / log_file
-        log_path.open("w").close()  # Clear on start
-
-        logging.basicConfig(
-            level=logging.INFO,
-            format="%(asctime)s [%(levelname)s] %(message)s",
-            handlers=[
-                logging.FileHandler(log_path),
-                logging.StreamHandler(sys.stdout)
-            ]
+        file_handler = build_file_handler(log_path, os.getenv("LOG_FILE_ROTATION", "size"))
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter() if os.getenv("LOG_STDOUT_FORMAT", "text") == "json" else TextFormatter())
+
+        handlers = [h for h in (file_handler, stream_handler) if h is not None]
+        self.queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+        logging.basicConfig(level=logging.INFO, handlers=[DroppingQueueHandler(self.queue)])
+        self.sampling = PayloadSampling(
+            rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.05")),
+            max_chars=int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "4000")),
         )
+        metrics.register_collector("log_queue", lambda: {"size": self.queue.qsize()})
+
         self.logger = logging.getLogger("Needlee")
         self.logger.info("✅ LogManager initialized")
 
     def get_session_logger(self, session_id: str) -> SessionLogger:
-        return SessionLogger(session_id, self.logger)
+        return SessionLogger(session_id, self.logger, self.sampling)
+
+    def close(self):
+        """Write out whatever is still queued."""
+        if self.listener._thread is not None:
+            self.listener.stop()
@@ -0,0 +1,151 @@
+import os
+import math
+import threading
+
+# Upper bounds in seconds; wide enough for both FAISS lookups and upstream calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = "caretaker"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _number(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        copy = Histogram(self.buckets)
+        copy.counts, copy.sum, copy.count = list(self.counts), self.sum, self.count
+        return copy
+
+    def lines(self, name: str, labels: dict):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f"{name}_bucket{_labels({**labels, 'le': _number(bound)})} {cumulative}"
+        yield f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {self.count}"
+        yield f"{name}_sum{_labels(labels)} {_number(self.sum)}"
+        yield f"{name}_count{_labels(labels)} {self.count}"
+
+
+class Metrics:
+    """
+    Process-wide histograms and counters, rendered in the Prometheus text format.
+
+    Components that already keep their own counters (caches, session store, matcher)
+    register a collector instead: a stats() callable read at scrape time, exported as gauges.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}   # (name, labels) -> Histogram
+        self.counters = {}     # (name, labels) -> value
+        self.help = {}
+        self.collectors = {}   # name -> stats callable
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        buckets = os.getenv("METRICS_BUCKETS")
+        if buckets:
+            return cls(tuple(sorted(float(b) for b in buckets.split(","))))
+        return cls()
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_collector(self, name: str, stats):
+        self.collectors[name] = stats
+
+    def render(self) -> str:
+        with self.lock:
+            histograms = sorted((key, histogram.snapshot()) for key, histogram in self.histograms.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            full_name = f"{PREFIX}_{name}"
+            declare(full_name, "histogram")
+            lines.extend(histogram.lines(full_name, dict(labels)))
+
+        for (name, labels), value in counters:
+            full_name = f"{PREFIX}_{name}"
+            declare(full_name, "counter")
+            lines.append(f"{full_name}{_labels(dict(labels))} {_number(value)}")
+
+        for collector, stats in sorted(self.collectors.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                print(f"⚠️ Metrics collector {collector} failed: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+                    continue
+                full_name = f"{PREFIX}_{collector}_{key}"
+                declare(full_name, "gauge")
+                lines.append(f"{full_name} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics.from_env()
+metrics.describe(f"{PREFIX}_stage_seconds", "Time spent per request stage")
+metrics.describe(f"{PREFIX}_request_seconds", "End-to-end time of /api/process and of /api/voice turns")
+metrics.describe(f"{PREFIX}_upstream_errors_total", "Failed OpenAI calls by stage and error type")
+metrics.describe(f"{PREFIX}_route_seconds", "Chat call latency by model route and model")
+metrics.describe(f"{PREFIX}_route_fallbacks_total", "Chat calls retried on the route's other model")
+metrics.describe(f"{PREFIX}_voice_interruptions_total", "Voice replies cut short by the user speaking over them")
+metrics.describe(f"{PREFIX}_voice_rejected_messages_total", "Voice control messages answered with an error instead of applied")
@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, fields, replace
+
+import numpy as np
+
+from utils.metrics import metrics
+from utils.openai_client import openai_client
+from utils.tokens import token_counter
+
+
+@dataclass(frozen=True)
+class Route:
+    fast: str
+    strong: str = None
+    max_fast_tokens: int = None     # prompts above this many text tokens go to the strong model
+    strong_for_images: bool = False
+    budget: float = None            # seconds; the strong model is skipped while its recent p90 exceeds this
+    timeout: float = None           # per attempt; a failed attempt is retried once on the other model
+    max_tokens: int = None
+
+
+@dataclass
+class RouteChoice:
+    route: str
+    model: str
+    fallback: str
+    reason: str
+    tokens: int
+
+
+# Replies are 1–2 sentences and picking a step is a short list, so most turns need only the fast model.
+# Without history a step prompt is 150–500 tokens and a step list 450–1000; the memory adds up to
+# MEMORY_TOKEN_BUDGET (1200). The thresholds send long steps or lists deep into a conversation to
+# the strong model, where the fast one starts losing track of what was already said.
+DEFAULT_ROUTES = {
+    # Matched step: answer about it
+    "step_answer": Route(fast="gpt-4o-mini", strong="gpt-4o", max_fast_tokens=1000, budget=2.5, timeout=15.0, max_tokens=200),
+    # Task matched but no step: pick one from the list
+    "step_choice": Route(fast="gpt-4o-mini", strong="gpt-4o", max_fast_tokens=1500, budget=2.5, timeout=15.0, max_tokens=200),
+    # Does the message still belong to the current task: "confirm" or "reject"
+    "mismatch": Route(fast="gpt-4o-mini", timeout=5.0, max_tokens=3),
+}
+
+
+def load_routes(raw: str = None) -> dict:
+    """Default routes, with fields overridden by a JSON object {route: {field: value}}."""
+    routes = dict(DEFAULT_ROUTES)
+    if not raw:
+        return routes
+
+    known = {field.name for field in fields(Route)}
+    for name, overrides in json.loads(raw).items():
+        unknown = set(overrides) - known
+        if unknown:
+            raise ValueError(f"❌ Unknown fields for route {name}: {sorted(unknown)}")
+        routes[name] = replace(routes[name], **overrides) if name in routes else Route(**overrides)
+    return routes
+
+
+class ModelRouter:
+    """
+    Picks the chat model per call from a configured route.
+
+    The fast model is the default. The strong one is chosen when the prompt is larger than
+    `max_fast_tokens` or carries images (if `strong_for_images`), but not while its recent
+    p90 latency on this route exceeds the route's `budget`. A failed or timed-out attempt is
+    retried once on the other model. Latency is recorded per route and model.
+
+    Samples older than `max_age` seconds don't count. Once the strong model is skipped it gets
+    no new samples, so after a slow spell its old ones age out below `min_samples` and it is
+    tried again, instead of staying downgraded for good.
+    """
+
+    def __init__(self, routes: dict, window: int = 50, min_samples: int = 10, max_age: float = 300.0):
+        self.routes = routes
+        self.min_samples = min_samples
+        self.window = window
+        self.max_age = max_age
+        self.latencies = {}     # (route, model) -> deque of recent (monotonic time, seconds)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            load_routes(os.getenv("MODEL_ROUTES")),
+            max_age=float(os.getenv("MODEL_ROUTE_SAMPLE_MAX_AGE", "300")),
+        )
+
+    def recent_p90(self, route: str, model: str):
+        oldest = time.monotonic() - self.max_age
+        with self.lock:
+            samples = [seconds for at, seconds in self.latencies.get((route, model), ()) if at >= oldest]
+        if len(samples) < self.min_samples:
+            return None
+        return float(np.percentile(samples, 90))
+
+    def choose(self, route_name: str, messages) -> RouteChoice:
+        route = self.routes[route_name]
+        tokens = token_counter.count_messages(messages)
+
+        reason = "default"
+        if route.strong:
+            has_images = any(isinstance(m.get("content"), list) and any(p.get("type") == "image_url" for p in m["content"])
+                             for m in messages)
+            if route.max_fast_tokens is not None and tokens > route.max_fast_tokens:
+                reason = "large_prompt"
+            elif route.strong_for_images and has_images:
+                reason = "images"
+
+        if reason != "default":
+            p90 = self.recent_p90(route_name, route.strong)
+            if route.budget is not None and p90 is not None and p90 > route.budget:
+                # Strong model is currently too slow for this route's budget
+                metrics.inc("route_downgrades_total", route=route_name)
+                return RouteChoice(route_name, route.fast, route.strong, f"{reason}_over_budget", tokens)
+            return RouteChoice(route_name, route.strong, route.fast, reason, tokens)
+
+        return RouteChoice(route_name, route.fast, route.strong, reason, tokens)
+
+    def _record(self, route: str, model: str, seconds: float):
+        metrics.observe("route_seconds", seconds, route=route, model=model)
+        with self.lock:
+            samples = self.latencies.get((route, model))
+            if samples is None:
+                samples = self.latencies[(route, model)] = deque(maxlen=self.window)
+            samples.append((time.monotonic(), seconds))
+
+    def complete(self, route_name: str, messages, logger=None, **kwargs):
+        """chat.completions.create through the route; streamed calls are timed to the first response."""
+        route = self.routes[route_name]
+        choice = self.choose(route_name, messages)
+        if logger:
+            logger.info(f"🧭 Route {route_name}: {choice.model} ({choice.reason}, {choice.tokens} tokens)")
+
+        options = dict(kwargs)
+        if route.max_tokens is not None:
+            options.setdefault("max_tokens", route.max_tokens)
+        if route.timeout is not None:
+            options.setdefault("timeout", route.timeout)
+
+        attempts = [choice.model] + ([choice.fallback] if choice.fallback else [])
+        for i, model in enumerate(attempts):
+            started = time.perf_counter()
+            try:
+                response = openai_client.call("chat", lambda c: c.chat.completions.create(
+                    model=model, messages=messages, **options
+                ))
+            except Exception as e:
+                if i == len(attempts) - 1:
+                    raise
+                metrics.inc("route_fallbacks_total", route=route_name, model=model, error=type(e).__name__)
+                if logger:
+                    logger.error(f"⚠️ Route {route_name}: {model} failed ({e}), falling back to {attempts[i + 1]}")
+                continue
+
+            self._record(route_name, model, time.perf_counter() - started)
+            metrics.inc("route_requests_total", route=route_name, model=model, reason=choice.reason if i == 0 else "fallback")
+            return response
+
+
+model_router = ModelRouter.from_env()
@@ -0,0 +1,160 @@
+import os
+import time
+import random
+import threading
+
+import httpx
+import openai
+
+from utils.metrics import metrics
+
+# Errors worth retrying: the request may well succeed a moment later
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+STAGES = ("transcription", "embedding", "chat", "speech", "summary")
+
+DEFAULT_TIMEOUTS = {
+    "transcription": 30.0,
+    "embedding": 10.0,
+    "chat": 30.0,
+    "speech": 30.0,
+    "summary": 30.0,
+}
+
+
+class RetryBudget:
+    """
+    Token bucket shared by all calls: every call earns `ratio` of a retry, every retry spends one.
+    Keeps retries to a bounded fraction of traffic so an upstream outage doesn't turn into a retry storm.
+    """
+
+    def __init__(self, ratio: float = 0.2, burst: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class OpenAIClient:
+    """
+    Process-wide OpenAI client: one keep-alive connection pool shared by every stage,
+    a timeout per stage and a bounded retry budget with jittered backoff.
+
+    Usage:
+        openai_client.call("chat", lambda c: c.chat.completions.create(...))
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        timeouts: dict = None,
+        max_connections: int = 100,
+        max_keepalive: int = 20,
+        keepalive_expiry: float = 60.0,
+        connect_timeout: float = 5.0,
+        max_retries: int = 2,
+        retry_budget: RetryBudget = None,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+    ):
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget or RetryBudget()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.api_key = api_key
+        self.base_url = base_url
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_timeout = connect_timeout
+        self.stages = None
+        self.lock = threading.Lock()
+
+    def _build(self):
+        """Built on first use so the app can start without credentials in the environment."""
+        http_client = openai.DefaultHttpxClient(limits=self.limits)
+        # Retries are handled here, against the shared budget
+        client = openai.OpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            http_client=http_client,
+            max_retries=0,
+        )
+        # Per-stage copies share the same connection pool
+        return {
+            stage: client.with_options(timeout=httpx.Timeout(timeout, connect=self.connect_timeout))
+            for stage, timeout in self.timeouts.items()
+        }
+
+    def stage(self, stage: str) -> openai.OpenAI:
+        if self.stages is None:
+            with self.lock:
+                if self.stages is None:
+                    self.stages = self._build()
+        return self.stages[stage]
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            # Point at a local stand-in server for offline load tests
+            base_url=os.getenv("OPENAI_BASE_URL") or None,
+            timeouts={
+                stage: float(os.getenv(f"OPENAI_TIMEOUT_{stage.upper()}", DEFAULT_TIMEOUTS[stage]))
+                for stage in STAGES
+            },
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("OPENAI_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+            retry_budget=RetryBudget(
+                ratio=float(os.getenv("OPENAI_RETRY_BUDGET_RATIO", "0.2")),
+                burst=float(os.getenv("OPENAI_RETRY_BUDGET_BURST", "10")),
+            ),
+        )
+
+    def call(self, stage: str, request):
+        """Run `request(client)` with the stage's timeout, retrying transient errors within budget."""
+        client = self.stage(stage)
+        self.retry_budget.deposit()
+
+        attempt = 0
+        while True:
+            metrics.inc("upstream_requests_total", stage=stage)
+            try:
+                return request(client)
+            except RETRYABLE_ERRORS as e:
+                metrics.inc("upstream_errors_total", stage=stage, error=type(e).__name__)
+                if attempt >= self.max_retries or not self.retry_budget.withdraw():
+                    raise
+                metrics.inc("upstream_retries_total", stage=stage)
+                # Full jitter: sleep anywhere up to the exponential backoff
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                attempt += 1
+            except Exception as e:
+                metrics.inc("upstream_errors_total", stage=stage, error=type(e).__name__)
+                raise
+
+
+openai_client = OpenAIClient.from_env()
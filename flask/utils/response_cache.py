@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class CachedResponse:
+    reply: str
+    audio: bytes = None
+
+
+class ResponseCache:
+    """
+    Replies keyed by (task_id, step_num), looked up by cosine similarity of the query embedding.
+
+    Only queries asked against the same step are compared, so each lookup scans a small bucket.
+    Entries expire after `ttl` seconds; past `max_entries` the oldest entry is dropped.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: float = 24 * 3600, max_entries: int = 2000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()   # entry_id -> (key, unit vector, CachedResponse, created_at)
+        self.buckets = {}              # key -> [entry_id, ...]
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX", "2000")),
+        )
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, task_id, step_num, embedding):
+        if self.max_entries <= 0 or embedding is None:
+            return None
+
+        query = self._unit(embedding)
+        now = time.time()
+
+        with self.lock:
+            ids = [i for i in self.buckets.get((task_id, step_num), []) if now - self.entries[i][3] <= self.ttl]
+            if not ids:
+                self.counters["misses"] += 1
+                return None
+
+            similarities = np.stack([self.entries[i][1] for i in ids]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.counters["misses"] += 1
+                return None
+
+            self.counters["hits"] += 1
+            return self.entries[ids[best]][2]
+
+    def put(self, task_id, step_num, embedding, reply: str, audio: bytes = None):
+        if self.max_entries <= 0 or embedding is None:
+            return
+
+        key = (task_id, step_num)
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (key, self._unit(embedding), CachedResponse(reply, audio), time.time())
+            self.buckets.setdefault(key, []).append(entry_id)
+
+            while len(self.entries) > self.max_entries:
+                old_id, (old_key, *_) = self.entries.popitem(last=False)
+                self._unlink(old_key, old_id)
+                self.counters["evictions"] += 1
+
+    def _unlink(self, key, entry_id):
+        bucket = self.buckets.get(key, [])
+        bucket.remove(entry_id)
+        if not bucket:
+            del self.buckets[key]
+
+    def clear(self):
+        """Drop every entry, e.g. when the instructions they answered have changed."""
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,47 @@
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class TokenCounter:
+    """
+    Token counts in gpt-4o's encoding. The vocabulary is loaded in the background (tiktoken
+    may download it); until then, or without tiktoken, counts are estimated from the length.
+    """
+
+    # Russian text runs about 3 characters per token in o200k_base
+    CHARS_PER_TOKEN = 3
+
+    def __init__(self, encoding: str = "o200k_base"):
+        self.encoder = None
+        if tiktoken is not None:
+            threading.Thread(target=self._load, args=(encoding,), name="tiktoken-load", daemon=True).start()
+
+    def _load(self, encoding: str):
+        try:
+            self.encoder = tiktoken.get_encoding(encoding)
+        except Exception as e:
+            print(f"⚠️ Token encoding {encoding} unavailable, estimating token counts: {e}")
+
+    def count(self, text: str) -> int:
+        encoder = self.encoder
+        if encoder is not None:
+            return len(encoder.encode(text))
+        return len(text) // self.CHARS_PER_TOKEN + 1
+
+    def count_messages(self, messages) -> int:
+        """Text tokens of chat messages; image parts are not counted."""
+        total = 0
+        for message in messages:
+            content = message.get("content") or ""
+            if isinstance(content, str):
+                total += self.count(content)
+            else:
+                total += sum(self.count(part.get("text", "")) for part in content if part.get("type") == "text")
+        return total
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,106 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def tts_key(model: str, voice: str, audio_format: str, text: str) -> str:
+    text_hash = hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{model}\0{voice}\0{audio_format}\0{text_hash}".encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed cache of synthesized audio.
+
+    Memory tier is an LRU bounded in bytes; pinned entries (canned replies) are never evicted.
+    Disk tier stores one <key>.<format> file per entry, written atomically, so it survives
+    restarts and can be shared by workers.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, cache_dir: Path = None):
+        self.max_bytes = max_bytes
+        self.memory = OrderedDict()
+        self.pinned = set()
+        self.memory_bytes = 0
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "bytes_saved": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_bytes=int(os.getenv("TTS_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            cache_dir=os.getenv("TTS_CACHE_DIR") or None,
+        )
+
+    def _path(self, key: str, audio_format: str) -> Path:
+        return self.cache_dir / f"{key}.{audio_format}"
+
+    def get(self, model: str, voice: str, audio_format: str, text: str):
+        key = tts_key(model, voice, audio_format, text)
+
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                self.counters["hits"] += 1
+                self.counters["bytes_saved"] += len(audio)
+                return audio
+
+        audio = None
+        if self.cache_dir:
+            try:
+                audio = self._path(key, audio_format).read_bytes()
+            except FileNotFoundError:
+                pass
+
+        with self.lock:
+            if not audio:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self.counters["bytes_saved"] += len(audio)
+            self._remember(key, audio)
+            return audio
+
+    def put(self, model: str, voice: str, audio_format: str, text: str, audio: bytes, pin: bool = False):
+        key = tts_key(model, voice, audio_format, text)
+
+        with self.lock:
+            if pin:
+                self.pinned.add(key)
+            self._remember(key, audio)
+
+        if self.cache_dir:
+            path = self._path(key, audio_format)
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(audio)
+            os.replace(tmp_path, path)
+
+    def _remember(self, key, audio: bytes):
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= len(previous)
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+
+        for old_key in list(self.memory):
+            if self.memory_bytes <= self.max_bytes:
+                break
+            if old_key in self.pinned or old_key == key:
+                continue
+            self.memory_bytes -= len(self.memory.pop(old_key))
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.memory)
+            stats["memory_bytes"] = self.memory_bytes
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,210 @@
+import io
+import os
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# detail -> (fit inside this square, then cap the shortest side); what the vision model resizes to anyway
+DETAIL_SIZES = {
+    "low": (512, None),
+    "high": (2048, 768),
+    "auto": (2048, 768),
+}
+
+# A 1920px screen gives cells of 30x17 px: a ticked checkbox or a few typed characters move a
+# cell's mean by tens of gray levels, while re-encoding the same screen moves it by 1-2
+FINGERPRINT_SIZE = 64
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+# Magic bytes of formats the chat model accepts, for uploads sent as is
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def sniff_mime(content: bytes):
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    return next((mime for signature, mime in SIGNATURES if content.startswith(signature)), None)
+
+
+def target_size(width: int, height: int, detail: str):
+    """Size the model works with for this detail level; never larger than the original."""
+    box, short_side = DETAIL_SIZES.get(detail, DETAIL_SIZES["auto"])
+    scale = min(1.0, box / max(width, height))
+    if short_side:
+        scale = min(scale, short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def fingerprint(image, size: int = FINGERPRINT_SIZE) -> str:
+    """Grayscale size x size thumbnail, each cell the mean of its area, base64-encoded for the session."""
+    thumbnail = image.convert("L").resize((size, size), Image.BOX)
+    return base64.b64encode(thumbnail.tobytes()).decode("ascii")
+
+
+def max_cell_difference(a: str, b: str):
+    """Largest gray level difference between the cells of two fingerprints; None if they don't compare."""
+    try:
+        cells_a, cells_b = base64.b64decode(a), base64.b64decode(b)
+    except (TypeError, ValueError):
+        return None
+    if len(cells_a) != len(cells_b) or not cells_a:
+        return None
+    return max(abs(x - y) for x, y in zip(cells_a, cells_b))
+
+
+@dataclass
+class PreparedImage:
+    data_url: str
+    fingerprint: str       # None when the image was sent as uploaded
+    bytes_in: int
+    bytes_out: int
+    size: tuple = None
+
+    def part(self, detail: str) -> dict:
+        return {"type": "image_url", "image_url": {"url": self.data_url, "detail": detail}}
+
+
+class ImagePreparer:
+    """
+    Turns uploaded screenshots into chat image parts on a pool shared by all requests.
+
+    Each image is decoded once, downscaled to the resolution the model resizes it to for the
+    configured detail level, re-encoded and base64-encoded. Results are cached by content hash,
+    and each carries a thumbnail fingerprint so the caller can drop a screen that did not change:
+    every cell within `dedup_tolerance` gray levels of the previous screen's.
+    Without Pillow uploads are passed through with their sniffed type.
+    """
+
+    def __init__(self, workers: int = 4, detail: str = "auto", image_format: str = "jpeg", quality: int = 80,
+                 cache_max_bytes: int = 32 * 1024 * 1024, dedup_tolerance: int = 2):
+        self.detail = detail
+        self.format = image_format if image_format in MIME_TYPES else "jpeg"
+        self.quality = quality
+        self.cache_max_bytes = cache_max_bytes
+        self.dedup_tolerance = dedup_tolerance
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision")
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"images": 0, "cache_hits": 0, "duplicates": 0, "failures": 0, "bytes_in": 0, "bytes_out": 0}
+
+        if Image is None:
+            print("⚠️ Pillow not installed, screenshots are sent to the model as uploaded")
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            workers=int(os.getenv("VISION_WORKERS", str(min(4, os.cpu_count() or 1)))),
+            detail=os.getenv("VISION_DETAIL", "auto"),
+            image_format=os.getenv("VISION_FORMAT", "jpeg"),
+            quality=int(os.getenv("VISION_QUALITY", "80")),
+            cache_max_bytes=int(os.getenv("VISION_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+            dedup_tolerance=int(os.getenv("VISION_DEDUP_TOLERANCE", "2")),
+        )
+
+    def submit(self, content: bytes):
+        """Future of a PreparedImage, or of None when the upload is not a usable image."""
+        return self.executor.submit(self.prepare, content)
+
+    def prepare(self, content: bytes):
+        if not content:
+            return None
+
+        key = hashlib.sha256(content).hexdigest()
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                self.counters["cache_hits"] += 1
+                return cached
+
+        try:
+            prepared = self._encode(content) if Image is not None else self._passthrough(content)
+        except Exception as e:
+            print(f"⚠️ Image prepare failed: {e}")
+            prepared = None
+
+        with self.lock:
+            if prepared is None:
+                self.counters["failures"] += 1
+                return None
+            self.counters["images"] += 1
+            self.counters["bytes_in"] += prepared.bytes_in
+            self.counters["bytes_out"] += prepared.bytes_out
+            self._remember(key, prepared)
+        return prepared
+
+    def _encode(self, content: bytes) -> PreparedImage:
+        image = Image.open(io.BytesIO(content))
+        size = target_size(*image.size, self.detail)
+        # JPEG can decode straight at a fraction of the resolution
+        image.draft("RGB", size)
+        image = image.convert("RGBA" if self.format != "jpeg" and image.mode in ("RGBA", "LA", "P") else "RGB")
+        if image.size != size:
+            image = image.resize(size, Image.BICUBIC, reducing_gap=2.0)
+
+        out = io.BytesIO()
+        options = {"quality": self.quality} if self.format in ("jpeg", "webp") else {"optimize": True}
+        image.save(out, format=self.format.upper(), **options)
+        encoded = out.getvalue()
+        return PreparedImage(
+            data_url=f"data:{MIME_TYPES[self.format]};base64,{base64.b64encode(encoded).decode('ascii')}",
+            fingerprint=fingerprint(image),
+            bytes_in=len(content),
+            bytes_out=len(encoded),
+            size=size,
+        )
+
+    @staticmethod
+    def _passthrough(content: bytes):
+        mime = sniff_mime(content)
+        if not mime:
+            return None
+        return PreparedImage(
+            data_url=f"data:{mime};base64,{base64.b64encode(content).decode('ascii')}",
+            fingerprint=None,
+            bytes_in=len(content),
+            bytes_out=len(content),
+        )
+
+    def _remember(self, key: str, prepared: PreparedImage):
+        if key in self.cache or self.cache_max_bytes <= 0:
+            return
+        self.cache[key] = prepared
+        self.cache_bytes += len(prepared.data_url)
+        while self.cache_bytes > self.cache_max_bytes:
+            _, old = self.cache.popitem(last=False)
+            self.cache_bytes -= len(old.data_url)
+
+    def is_duplicate(self, fingerprint: str, previous: str) -> bool:
+        if fingerprint is None or previous is None:
+            return False
+        difference = max_cell_difference(fingerprint, previous)
+        return difference is not None and difference <= self.dedup_tolerance
+
+    def count_duplicate(self):
+        with self.lock:
+            self.counters["duplicates"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["cache_entries"] = len(self.cache)
+            stats["cache_bytes"] = self.cache_bytes
+        return stats
+
+
+image_preparer = ImagePreparer.from_env()
@@ -0,0 +1,115 @@
+// Full-duplex voice over /api/voice: 16 kHz PCM frames up, events and MP3 sentences down.
+// The server finds the end of each utterance, so the client just keeps streaming the mic.
+
+const SAMPLE_RATE = 16000
+
+// Float samples to 16-bit PCM, posted every 20 ms of audio
+const CAPTURE_WORKLET = `
+class PcmCapture extends AudioWorkletProcessor {
+  constructor() {
+    super()
+    this.buffer = new Int16Array(${SAMPLE_RATE / 50})
+    this.length = 0
+  }
+  process(inputs) {
+    const input = inputs[0][0]
+    if (input) {
+      for (let i = 0; i < input.length; i++) {
+        const s = Math.max(-1, Math.min(1, input[i]))
+        this.buffer[this.length++] = s < 0 ? s * 0x8000 : s * 0x7fff
+        if (this.length === this.buffer.length) {
+          this.port.postMessage(this.buffer.slice().buffer, [])
+          this.length = 0
+        }
+      }
+    }
+    return true
+  }
+}
+registerProcessor('pcm-capture', PcmCapture)
+`
+
+export async function openVoiceStream({ audioStream, onEvent }) {
+  const protocol = location.protocol === 'https:' ? 'wss' : 'ws'
+  const ws = new WebSocket(`${protocol}://${location.host}/api/voice`)
+  ws.binaryType = 'arraybuffer'
+
+  // The browser resamples the mic to the context rate
+  const audioCtx = new AudioContext({ sampleRate: SAMPLE_RATE })
+  const workletUrl = URL.createObjectURL(new Blob([CAPTURE_WORKLET], { type: 'application/javascript' }))
+  await audioCtx.audioWorklet.addModule(workletUrl)
+  URL.revokeObjectURL(workletUrl)
+
+  const source = audioCtx.createMediaStreamSource(audioStream)
+  const capture = new AudioWorkletNode(audioCtx, 'pcm-capture')
+  capture.port.onmessage = e => {
+    if (ws.readyState === WebSocket.OPEN) ws.send(e.data)
+  }
+  source.connect(capture)
+
+  // Every binary message is a whole MP3 sentence; they are played back to back
+  const player = new Audio()
+  let queue = []
+  let replyDone = true
+
+  const playNext = () => {
+    if (!player.paused) return
+    const chunk = queue.shift()
+    if (!chunk) {
+      if (replyDone) onEvent({ type: 'playback_end' })
+      return
+    }
+    URL.revokeObjectURL(player.src)
+    player.src = URL.createObjectURL(new Blob([chunk], { type: 'audio/mpeg' }))
+    player.play().catch(err => console.error('❌ Failed to play audio:', err))
+  }
+  player.onended = playNext
+
+  const stopPlayback = () => {
+    queue = []
+    replyDone = true
+    player.pause()
+  }
+
+  ws.onopen = () => ws.send(JSON.stringify({ type: 'start', sample_rate: audioCtx.sampleRate }))
+
+  ws.onmessage = e => {
+    if (typeof e.data !== 'string') {
+      queue.push(e.data)
+      onEvent({ type: 'audio' })
+      playNext()
+      return
+    }
+
+    const event = JSON.parse(e.data)
+    if (event.type === 'reply_start') replyDone = false
+    if (event.type === 'reply_end') {
+      replyDone = true
+      if (player.paused && !queue.length) onEvent({ type: 'playback_end' })
+    }
+    if (event.type === 'interrupt') stopPlayback()
+    onEvent(event)
+  }
+
+  ws.onerror = err => console.error('❌ Voice stream error:', err)
+  ws.onclose = () => onEvent({ type: 'closed' })
+
+  return {
+    // Screenshot as a JPEG blob; attached to the utterance in progress
+    sendImage: async blob => {
+      const bytes = new Uint8Array(await blob.arrayBuffer())
+      let binary = ''
+      for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode(...bytes.subarray(i, i + 0x8000))
+      }
+      if (ws.readyState === WebSocket.OPEN) ws.send(JSON.stringify({ type: 'image', data: btoa(binary) }))
+    },
+    close: () => {
+      stopPlayback()
+      ws.close()
+      source.disconnect()
+      capture.disconnect()
+      audioCtx.close()
+    }
+  }
+}
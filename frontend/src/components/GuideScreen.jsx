@@ -2,10 +2,12 @@ import React, { useEffect, useRef, useState } from 'react'
 import RecordRTC from 'recordrtc'
 import Blobs from './Blobs'
 import NoiseOverlay from './NoiseOverlay'
-import { API_URL } from '@/config/api'
+import { API_URL, VOICE_STREAM } from '@/config/api'
+import { openVoiceStream } from '@/api/voiceStream'
 
 export default function GuideScreen({ audioStream, screenStream }) {
   const [agentState, setAgentState] = useState('waiting')
+  const [stepImages, setStepImages] = useState([])
 
   const audioCtxRef = useRef(null)
   const analyserRef = useRef(null)
@@ -19,6 +21,7 @@ export default function GuideScreen({ audioStream, screenStream }) {
   const frameInterval = useRef(null)
   const startTime = useRef(null)
   const loopTimeout = useRef(null)
+  const stepKey = useRef(null)
 
   useEffect(() => {
     if (videoRef.current && screenStream) {
@@ -26,7 +29,91 @@ export default function GuideScreen({ audioStream, screenStream }) {
     }
   }, [screenStream])
 
+  const showStepImages = (taskId, stepNum) => {
+    const key = taskId && stepNum ? `${taskId}/${stepNum}` : null
+    if (key === stepKey.current) return
+    stepKey.current = key
+
+    if (!key) {
+      setStepImages([])
+      return
+    }
+
+    // Revalidated by ETag; the images themselves are immutable and cached by the browser
+    fetch(`/api/tasks/${taskId}/steps/${stepNum}/images`)
+      .then(res => (res.ok ? res.json() : { images: [] }))
+      .then(data => {
+        if (stepKey.current === key) setStepImages(data.images)
+      })
+      .catch(err => console.error('❌ Failed to load step images:', err))
+  }
+
+  const grabFrame = () =>
+    new Promise(resolve => {
+      const video = videoRef.current
+      const canvas = canvasRef.current
+      if (!video || !canvas || !video.videoWidth) return resolve(null)
+
+      canvas.width = video.videoWidth
+      canvas.height = video.videoHeight
+      canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height)
+      canvas.toBlob(resolve, 'image/jpeg', 0.7)
+    })
+
   useEffect(() => {
+    if (!VOICE_STREAM) return
+    console.log('🟢 useEffect init: voice stream starting')
+
+    const setState = state => {
+      setAgentState(state)
+      document.title = state
+    }
+
+    let voice = null
+    let cancelled = false
+
+    openVoiceStream({
+      audioStream,
+      onEvent: event => {
+        switch (event.type) {
+          case 'speech_start':
+            setState('listening')
+            // The screen as the user starts asking goes along with the question
+            grabFrame().then(blob => blob && voice?.sendImage(blob))
+            break
+          case 'speech_end':
+            setState('thinking')
+            break
+          case 'speech_cancel':
+          case 'playback_end':
+          case 'error':
+            setState('waiting')
+            break
+          case 'reply_start':
+            // Same form as the X-Task-Id header, percent-encoded
+            showStepImages(event.task_id && encodeURIComponent(event.task_id), event.step_num)
+            break
+          case 'audio':
+            setState('playing')
+            break
+        }
+      }
+    })
+      .then(stream => {
+        if (cancelled) stream.close()
+        else voice = stream
+      })
+      .catch(err => console.error('❌ Failed to open voice stream:', err))
+
+    return () => {
+      console.log('🧹 Closing voice stream')
+      cancelled = true
+      voice?.close()
+    }
+  }, [audioStream])
+
+  useEffect(() => {
+    if (VOICE_STREAM) return
     console.log('🟢 useEffect init: silence detection starting')
 
     let audioCtx, source, analyser, dataArray
@@ -173,7 +260,10 @@ export default function GuideScreen({ audioStream, screenStream }) {
         method: 'POST',
         body: form
       })
-        .then(res => res.blob())
+        .then(res => {
+          showStepImages(res.headers.get('X-Task-Id'), res.headers.get('X-Step-Num'))
+          return res.blob()
+        })
         .then(blob => {
           const url = URL.createObjectURL(blob)
           const player = audioPlayerRef.current
@@ -235,6 +325,23 @@ export default function GuideScreen({ audioStream, screenStream }) {
         <div className="text-lg font-medium text-gray-800 px-6 py-4">
           {stateText[agentState]}
         </div>
+        {stepImages.length > 0 && (
+          <div className="flex gap-3 overflow-x-auto max-w-sm">
+            {stepImages.map(image => (
+              <a key={image.url} href={image.url} target="_blank" rel="noreferrer" className="shrink-0">
+                <img
+                  src={image.thumb_url}
+                  width={image.thumb_width}
+                  height={image.thumb_height}
+                  alt={image.name}
+                  loading="lazy"
+                  decoding="async"
+                  className="h-24 w-auto rounded-lg border border-gray-300 shadow"
+                />
+              </a>
+            ))}
+          </div>
+        )}
       </div>
     </div>
   )
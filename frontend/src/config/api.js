@@ -1 +1,3 @@
-export const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:9091'
\ No newline at end of file
+export const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:9091'
+// Stream the mic over /api/voice instead of uploading one recording per turn
+export const VOICE_STREAM = import.meta.env.VITE_VOICE_STREAM === '1'